@@ -0,0 +1,111 @@
+"""
+Асинхронный фасад над database.py для хендлеров aiogram.
+
+Синхронные функции database.py выполняются в отдельном пуле потоков, поэтому
+медленный запрос одного пользователя не останавливает цикл событий для остальных.
+У каждого потока пула свое долгоживущее соединение (см. database.db_connection).
+
+    import async_database as db
+    profile = await db.get_filtered_profile(user_id, target_filters=targets)
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+from config import DB_WORKERS, LIKES_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков базы данных"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _wrap(func):
+    timed = metrics.timed_query(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return await run(func, *args, **kwargs)
+        # Снаружи - сколько ждал обработчик (с очередью пула), внутри timed - сам запрос
+        started = time.perf_counter()
+        try:
+            return await run(timed, *args, **kwargs)
+        finally:
+            metrics.add_handler_time(metrics.DB, time.perf_counter() - started)
+    return wrapper
+
+
+def shutdown():
+    """Дожидается запросов в пуле, дописывает буфер лайков и закрывает соединения"""
+    _executor.shutdown(wait=True)
+    database.flush_likes()
+    database.close_connections()
+
+
+# ========== Пользователи ==========
+get_user_by_telegram_id = _wrap(database.get_user_by_telegram_id)
+add_user = _wrap(database.add_user)
+update_user_field = _wrap(database.update_user_field)
+update_user_coordinates = _wrap(database.update_user_coordinates)
+profile_cache_stats = database.profile_cache_stats
+
+# ========== Фильтры ==========
+save_user_filters = _wrap(database.save_user_filters)
+save_user_target_filters = _wrap(database.save_user_target_filters)
+save_user_distance_filter = _wrap(database.save_user_distance_filter)
+get_user_filters = _wrap(database.get_user_filters)
+debug_filters_table = _wrap(database.debug_filters_table)
+filter_cache_stats = database.filter_cache_stats
+
+# ========== Просмотр анкет ==========
+get_filtered_profile = _wrap(database.get_filtered_profile)
+get_random_profile = _wrap(database.get_random_profile)
+get_candidate_ids = _wrap(database.get_candidate_ids)
+get_next_profile_for = _wrap(database.get_next_profile_for)
+
+# ========== Лайки и матчи ==========
+add_like = _wrap(database.add_like)
+flush_likes = _wrap(database.flush_likes)
+check_match = _wrap(database.check_match)
+get_matches_for_user = _wrap(database.get_matches_for_user)
+
+
+async def flush_likes_periodically(interval=LIKES_FLUSH_INTERVAL):
+    """Сбрасывает буфер лайков по таймеру, даже если новых свайпов нет"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_likes()
+        except Exception as e:
+            logger.error("Ошибка записи буфера лайков: %r", e)
+
+# ========== Обслуживание ==========
+archive_expired_likes = _wrap(database.archive_expired_likes)
+incremental_vacuum = _wrap(database.incremental_vacuum)
+optimize_db = _wrap(database.optimize_db)
+database_stats = _wrap(database.database_stats)
+
+# ========== Текущая анкета просмотра ==========
+set_viewing = _wrap(database.set_viewing)
+get_viewing = _wrap(database.get_viewing)
+pop_viewing = _wrap(database.pop_viewing)
+trim_viewing = _wrap(database.trim_viewing)
+count_viewing = _wrap(database.count_viewing)
+
+# ========== Состояния FSM ==========
+load_fsm_record = _wrap(database.load_fsm_record)
+save_fsm_records = _wrap(database.save_fsm_records)
+purge_fsm_records = _wrap(database.purge_fsm_records)
+
+# ========== Кэш геокодирования ==========
+get_cached_city = _wrap(database.get_cached_city)
+save_cached_city = _wrap(database.save_cached_city)
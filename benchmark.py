@@ -0,0 +1,1164 @@
+"""
+Микробенчмарки горячих путей бота.
+Запускаются без Telegram на временной базе, рабочая db.sqlite3 не трогается.
+
+    python benchmark.py swipes --users 5000 --swipes 2000
+    python benchmark.py suite --users 100000 --save-baseline baseline.json
+    python benchmark.py suite --users 100000 --baseline baseline.json   # код 1 при регрессии
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# База для бенчмарка должна быть выбрана до импорта database/config.
+if __name__ == "__mp_main__":
+    # Воркер supervisor.py (spawn) импортирует этот модуль заново: база родителя уже в окружении
+    _BENCH_DIR = os.path.dirname(os.environ["DB_PATH"])
+else:
+    _BENCH_DIR = tempfile.mkdtemp(prefix="dating_bench_")
+    os.environ["DB_PATH"] = os.path.join(_BENCH_DIR, "bench.sqlite3")
+
+import database  # noqa: E402
+import logging_setup  # noqa: E402
+from config import EXCLUSION_INDEX  # noqa: E402
+import reset_and_populate_db  # noqa: E402
+
+TARGETS = ["Дружба", "Общение", "Отношения", "Ничего серьезного", "Свидания"]
+CITIES = [
+    ("Москва", 55.7558, 37.6173),
+    ("Санкт-Петербург", 59.9311, 30.3609),
+    ("Казань", 55.8304, 49.0661),
+    ("Екатеринбург", 56.8431, 60.6454),
+    ("Новосибирск", 55.0084, 82.9357),
+]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует функцию как подкоманду benchmark.py"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def populate(users, seed=42):
+    """Создает отдельную базу с users анкетами без истории свайпов и переключает на нее database"""
+    path = os.path.join(_BENCH_DIR, f"bench_{users}_{seed}.sqlite3")
+    return reset_and_populate_db.generate_dataset(users, seed=seed, filters_share=0, path=path)
+
+
+def summarize(samples):
+    """ops/sec, среднее и перцентили по списку длительностей в секундах; времена в мкс"""
+    ordered = sorted(samples)
+    return {
+        "n": len(samples),
+        "ops": len(samples) / sum(samples),
+        "mean_us": statistics.mean(samples) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p90_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1e6,
+        "p99_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6,
+    }
+
+
+def report(title, samples):
+    """Печатает ops/sec и перцентили по списку длительностей в секундах; возвращает summarize()"""
+    stats = summarize(samples)
+    print_stats(title, stats)
+    return stats
+
+
+def print_stats(title, stats, note=""):
+    ops_text = f"{stats['ops']:,.0f}" if stats["ops"] >= 100 else f"{stats['ops']:.2f}"
+    print(f"{title}: {ops_text} ops/sec | "
+          f"mean {stats['mean_us']:.0f} µs | "
+          f"p50 {stats['p50_us']:.0f} µs | p99 {stats['p99_us']:.0f} µs{note}")
+
+
+@benchmark("swipes")
+def bench_swipes(args):
+    """Цикл свайпа: анкета по фильтрам, лайк/дизлайк, проверка матча"""
+    ids = populate(args.users)
+    rnd = random.Random(7)
+    samples = []
+    for _ in range(args.swipes):
+        viewer = rnd.choice(ids)
+        targets = rnd.sample(TARGETS, 2)
+        started = time.perf_counter()
+        profile = database.get_filtered_profile(viewer, target_filters=targets)
+        if profile:
+            action = "like" if rnd.random() < 0.3 else "dislike"
+            database.add_like(viewer, profile['telegram_id'], action=action)
+            database.check_match(viewer, profile['telegram_id'])
+        samples.append(time.perf_counter() - started)
+    report(f"swipes ({args.users} users)", samples)
+
+
+@benchmark("loop-latency")
+def bench_loop_latency(args):
+    """
+    p99 задержки легких хендлеров, пока один пользователь гоняет тяжелый запрос по фильтрам.
+    Сравниваются прямые синхронные вызовы database.py и фасад async_database.
+    """
+    import asyncio
+    import async_database
+
+    ids = populate(args.users)
+    heavy_user = ids[0]
+
+    async def light_handler(mode, viewer):
+        if mode == "sync":
+            return database.get_user_by_telegram_id(viewer)
+        return await async_database.get_user_by_telegram_id(viewer)
+
+    async def heavy_handler(mode):
+        # Просмотр без фильтров по целям с радиусом 5 км: пробы по первичному ключу
+        # в пределах геоячеек и точная проверка расстояния (ORDER BY RANDOM() больше
+        # нет, для сравнения он остался только в LEGACY_RANDOM_QUERY).
+        if mode == "sync":
+            return database.get_filtered_profile(heavy_user, distance_km=5)
+        return await async_database.get_filtered_profile(heavy_user, distance_km=5)
+
+    async def scenario(mode, with_heavy):
+        rnd = random.Random(11)
+        latencies = []
+        stop = asyncio.Event()
+
+        async def heavy_loop():
+            while not stop.is_set():
+                await heavy_handler(mode)
+                await asyncio.sleep(0)
+
+        async def light_request(viewer, arrived):
+            # Задержка считается от прихода апдейта, а не от старта задачи:
+            # так видно время, которое апдейт простоял в заблокированном цикле.
+            await light_handler(mode, viewer)
+            latencies.append(time.perf_counter() - arrived)
+
+        heavy = asyncio.create_task(heavy_loop()) if with_heavy else None
+        requests = []
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            requests.append(asyncio.create_task(light_request(rnd.choice(ids), time.perf_counter())))
+            await asyncio.sleep(0.002)
+        await asyncio.gather(*requests)
+        stop.set()
+        if heavy:
+            await heavy
+        return latencies
+
+    for mode in ("sync", "async"):
+        for with_heavy in (False, True):
+            samples = asyncio.run(scenario(mode, with_heavy))
+            label = "с тяжелым запросом" if with_heavy else "без нагрузки"
+            report(f"{mode:5} {label}", samples)
+    async_database.shutdown()
+
+
+@benchmark("distance")
+def bench_distance(args):
+    """Просмотр с фильтром по расстоянию для вариантов из distance_keyboard"""
+    ids = populate(args.users)
+    rnd = random.Random(1)
+    lat, lon = CITIES[0][1:]
+    for km in (5, 10, 30, 50):
+        cells = database.geocells_around(lat, lon, km)
+        samples = measure(lambda: database.get_filtered_profile(rnd.choice(ids), distance_km=km), args.swipes)
+        report(f"{km:>2} км ({len(cells)} ячеек)", samples)
+
+
+# Старый запрос просмотра, ORDER BY RANDOM() по всей таблице. В боте его заменили
+# пробы по первичному ключу; здесь он остался только для сравнения в sampling.
+LEGACY_RANDOM_QUERY = """
+SELECT * FROM users
+WHERE telegram_id != ?
+  AND telegram_id NOT IN (
+      SELECT to_user FROM likes
+      WHERE from_user = ?
+        AND created_at > datetime('now', '-9 days')
+  )
+  AND target IN (?, ?)
+ORDER BY RANDOM()
+"""
+
+
+def measure(func, iterations, budget=5.0):
+    """Длительности вызовов func; останавливается раньше, если вышел бюджет времени"""
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < iterations and (not samples or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+@benchmark("sampling")
+def bench_sampling(args):
+    """ORDER BY RANDOM() по всей таблице против проб по первичному ключу на 10k/100k/1M анкет"""
+    for size in args.sizes:
+        ids = populate(size)
+        rnd = random.Random(3)
+        targets = ["Дружба", "Общение"]
+
+        def legacy():
+            viewer = rnd.choice(ids)
+            with database.db_connection() as conn:
+                rows = conn.execute(LEGACY_RANDOM_QUERY, (viewer, viewer, *targets)).fetchall()
+            return rows[0] if rows else None
+
+        def sampled():
+            return database.get_filtered_profile(rnd.choice(ids), target_filters=targets)
+
+        report(f"{size:>9} ORDER BY RANDOM()", measure(legacy, args.swipes))
+        report(f"{size:>9} пробы по id       ", measure(sampled, args.swipes))
+        os.remove(database.DB_PATH)
+
+    # Равномерность: хи-квадрат по частотам выбора на маленькой базе
+    population = 50
+    ids = populate(population, seed=5)
+    draws = 50 * population * 20
+    counts = dict.fromkeys(ids, 0)
+    for _ in range(draws):
+        counts[database.get_random_profile(-1)['telegram_id']] += 1
+    expected = draws / population
+    chi2 = sum((count - expected) ** 2 / expected for count in counts.values())
+    print(f"равномерность: χ² = {chi2:.1f} при {population - 1} степенях свободы "
+          f"(критическое значение 0.99 ≈ 74.9)")
+
+
+@benchmark("haversine")
+def bench_haversine(args):
+    """Скалярный calculate_distance в цикле против within_distance на массиве точек"""
+    rnd = random.Random(9)
+    lat, lon = CITIES[0][1:]
+    latitudes, longitudes = [], []
+    for _ in range(args.points):
+        _, city_lat, city_lon = rnd.choice(CITIES)
+        latitudes.append(city_lat + rnd.uniform(-0.5, 0.5))
+        longitudes.append(city_lon + rnd.uniform(-0.5, 0.5))
+    # Часть точек без координат, как у анкет без геолокации
+    for i in range(0, args.points, 100):
+        latitudes[i] = longitudes[i] = None
+
+    for km in (5, 10, 30, 50):
+        started = time.perf_counter()
+        scalar = [database.calculate_distance(lat, lon, a, b) <= km for a, b in zip(latitudes, longitudes)]
+        scalar_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = database.within_distance(lat, lon, latitudes, longitudes, km)
+        batch_time = time.perf_counter() - started
+
+        mismatches = sum(1 for a, b in zip(scalar, batch) if a != bool(b))
+        print(f"{km:>2} км, {args.points:,} точек: скаляр {scalar_time * 1e3:.0f} мс | "
+              f"батч {batch_time * 1e3:.1f} мс | x{scalar_time / batch_time:.0f} | "
+              f"расхождений {mismatches}")
+
+
+@benchmark("deck")
+def bench_deck(args):
+    """Свайп с запросом по фильтрам на каждую анкету против выдачи из колоды кандидатов"""
+    import asyncio
+    import async_database
+    import deck
+
+    ids = populate(args.users)
+    filters = {'target_filters': ["Дружба", "Общение"], 'distance_filter': 30}
+
+    async def swipes(mode):
+        rnd = random.Random(13)
+        viewers = rnd.sample(ids, 50)
+        samples = []
+        for i in range(args.swipes):
+            viewer = viewers[i % len(viewers)]
+            started = time.perf_counter()
+            if mode == "deck":
+                profile = await deck.next_profile(viewer, filters)
+            else:
+                profile = await async_database.get_filtered_profile(
+                    viewer, target_filters=filters['target_filters'], distance_km=filters['distance_filter'])
+            if profile:
+                await async_database.add_like(viewer, profile['telegram_id'], action="dislike")
+            samples.append(time.perf_counter() - started)
+            # Пауза между свайпами, за которую колода успевает пополниться в фоне
+            await asyncio.sleep(0.001)
+        deck.close()
+        return samples
+
+    for mode in ("query", "deck"):
+        report(f"{mode:5} ({args.users} users)", asyncio.run(swipes(mode)))
+    async_database.shutdown()
+
+
+@benchmark("viewing")
+def bench_viewing(args):
+    """Память и скорость хранилища текущих анкет против старого словаря со строками users"""
+    import asyncio
+    import tracemalloc
+    import async_database
+    import viewing_store
+
+    ids = populate(args.users)
+
+    # Старый вариант: user_id -> полная sqlite3.Row без ограничений. Строки читаются
+    # запросом, а не get_user_by_telegram_id: тот теперь отдает Profile из кэша анкет
+    with database.db_connection() as conn:
+        tracemalloc.start()
+        legacy = {}
+        for viewer in ids:
+            legacy[viewer] = conn.execute("SELECT * FROM users WHERE telegram_id = ?",
+                                          (ids[(viewer * 7) % len(ids)],)).fetchone()
+        legacy_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    assert all(isinstance(row, database.sqlite3.Row) for row in legacy.values())
+    print(f"dict со строками users: {len(legacy)} записей, ~{legacy_bytes / 1024:.0f} КБ")
+
+    async def run(store):
+        samples = []
+        for viewer in ids:
+            started = time.perf_counter()
+            await store.set(viewer, ids[(viewer * 7) % len(ids)])
+            await store.pop(viewer)
+            await store.set(viewer, viewer)
+            samples.append(time.perf_counter() - started)
+        return samples, await store.stats()
+
+    max_users = args.users // 2
+    for store in (viewing_store.MemoryViewingStore(max_users=max_users),
+                  viewing_store.SQLiteViewingStore(max_users=max_users)):
+        samples, stats = asyncio.run(run(store))
+        report(f"{stats['backend']:6} set+pop+set", samples)
+        print(f"  {stats}")
+    async_database.shutdown()
+
+
+@benchmark("fsm")
+def bench_fsm(args):
+    """set_state/update_data шага регистрации: MemoryStorage против SQLiteStorage"""
+    import asyncio
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    import async_database
+    import fsm_storage
+
+    populate(0)
+    steps = ["gender", "name", "age", "city", "target", "bio"]
+
+    async def run(storage):
+        samples = []
+        users = max(1, args.swipes // len(steps))
+        for step_no, step in enumerate(steps):
+            for user_id in range(users):
+                key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+                started = time.perf_counter()
+                await storage.set_state(key, f"Registration:{step}")
+                await storage.update_data(key, {step: f"value {user_id}", "is_editing": step_no > 2})
+                samples.append(time.perf_counter() - started)
+            # Апдейты одного пользователя приходят с паузами, за которые успевает запись
+            await asyncio.sleep(0)
+        await storage.close()
+        return samples
+
+    report("MemoryStorage set_state+update_data", asyncio.run(run(MemoryStorage())))
+    storage = fsm_storage.SQLiteStorage()
+    report("SQLiteStorage set_state+update_data", asyncio.run(run(storage)))
+    print(f"  {storage.stats()}")
+
+    async def restored():
+        # Новый экземпляр, как после перезапуска: данные читаются из базы
+        fresh = fsm_storage.SQLiteStorage()
+        key = StorageKey(bot_id=1, chat_id=0, user_id=0)
+        return await fresh.get_state(key), await fresh.get_data(key)
+
+    print(f"  после перезапуска: {asyncio.run(restored())}")
+    async_database.shutdown()
+
+
+@benchmark("gazetteer")
+def bench_gazetteer(args):
+    """Загрузка офлайн-справочника городов и скорость поиска ближайшего города"""
+    import gazetteer
+
+    started = time.perf_counter()
+    index = gazetteer.load()
+    print(f"загрузка {len(index)} городов: {(time.perf_counter() - started) * 1e3:.1f} мс")
+
+    rnd = random.Random(17)
+    points = []
+    for _ in range(args.points // 10):
+        _, lat, lon = rnd.choice(CITIES)
+        points.append((lat + rnd.uniform(-2, 2), lon + rnd.uniform(-2, 2)))
+    started = time.perf_counter()
+    for lat, lon in points:
+        index.nearest(lat, lon)
+    elapsed = time.perf_counter() - started
+    print(f"nearest: {len(points) / elapsed:,.0f} lookups/sec | {elapsed / len(points) * 1e6:.1f} µs на запрос")
+
+
+@benchmark("likes")
+def bench_likes(args):
+    """Запись свайпов: коммит на каждый лайк против буфера с пачками executemany"""
+    import asyncio
+    import async_database
+
+    ids = populate(args.users)
+
+    async def swipes():
+        rnd = random.Random(21)
+        samples = []
+
+        async def one(viewer, target):
+            started = time.perf_counter()
+            await async_database.add_like(viewer, target, action="dislike")
+            samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        # Пачками по 50 одновременных свайпов, как при наплыве апдейтов
+        for _ in range(args.swipes // 50):
+            await asyncio.gather(*(one(rnd.choice(ids), rnd.choice(ids)) for _ in range(50)))
+        await async_database.flush_likes()
+        return samples, time.perf_counter() - started
+
+    batch_size = database.LIKES_BATCH_SIZE
+    for label, size in (("коммит на свайп", 1), (f"пачки по {batch_size}", batch_size)):
+        database.LIKES_BATCH_SIZE = size
+        samples, elapsed = asyncio.run(swipes())
+        report(f"{label:16}", samples)
+        print(f"  {len(samples) / elapsed:,.0f} свайпов/сек с учетом конкуренции за запись")
+    database.LIKES_BATCH_SIZE = batch_size
+    async_database.shutdown()
+
+
+@benchmark("match-stress")
+def bench_match_stress(args):
+    """
+    Тысячи одновременных взаимных лайков из 16 потоков: на каждую пару ровно
+    одна строка matches и ровно один вызов check_match, вернувший True.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    ids = populate(args.users)
+    batch_size = database.LIKES_BATCH_SIZE
+    for label, size in (("коммит на свайп", 1), (f"буфер по {batch_size}", batch_size)):
+        database.LIKES_BATCH_SIZE = size
+        with database.db_connection() as conn:
+            conn.execute("DELETE FROM matches")
+            conn.execute("DELETE FROM likes")
+
+        rnd = random.Random(23)
+        shuffled = ids[:]
+        rnd.shuffle(shuffled)
+        pairs = list(zip(shuffled[0::2], shuffled[1::2]))[:args.swipes]
+        sides = [(a, b) for a, b in pairs] + [(b, a) for a, b in pairs]
+        rnd.shuffle(sides)
+
+        def swipe(side):
+            started = time.perf_counter()
+            database.add_like(side[0], side[1], action="like")
+            created = database.check_match(side[0], side[1])
+            return created, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(swipe, sides))
+        database.flush_likes()
+
+        with database.db_connection() as conn:
+            rows = conn.execute("SELECT COUNT(*), COUNT(DISTINCT user1 || ':' || user2) FROM matches").fetchone()
+        created = sum(1 for ok, _ in results if ok)
+        report(f"{label:16} like+check_match", [elapsed for _, elapsed in results])
+        status = "✅" if rows[0] == rows[1] == created == len(pairs) else "❌"
+        print(f"  {status} пар {len(pairs)}, строк matches {rows[0]} (уникальных {rows[1]}), "
+              f"создано по check_match {created}")
+    database.LIKES_BATCH_SIZE = batch_size
+
+
+@benchmark("profiles")
+def bench_profiles(args):
+    """get_user_by_telegram_id: запрос к базе на каждый вызов против кэша анкет"""
+    ids = populate(args.users)
+    # Как у бота: часть пользователей активна и обращается к своей анкете постоянно
+    rnd = random.Random(29)
+    active = rnd.sample(ids, max(1, len(ids) // 10))
+    calls = [rnd.choice(active) if rnd.random() < 0.9 else rnd.choice(ids) for _ in range(args.swipes * 10)]
+
+    def uncached():
+        with database.db_connection() as conn:
+            for telegram_id in calls:
+                conn.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+
+    def cached():
+        for telegram_id in calls:
+            database.get_user_by_telegram_id(telegram_id)
+
+    for label, func in (("без кэша", uncached), ("с кэшем", cached)):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        print(f"{label:9}: {len(calls) / elapsed:,.0f} вызовов/сек | {elapsed / len(calls) * 1e6:.1f} µs")
+    stats = database.profile_cache_stats()
+    print(f"  попаданий {stats['hits'] / (stats['hits'] + stats['misses']):.1%}, {stats}")
+
+    # Инвалидация: после update_user_field из кэша приходит новая версия анкеты
+    database.update_user_field(ids[0], "bio", "обновлено")
+    assert database.get_user_by_telegram_id(ids[0])['bio'] == "обновлено"
+    print("  ✅ update_user_field сбрасывает кэш")
+
+
+@benchmark("filters")
+def bench_filters(args):
+    """get_user_filters: проверка sqlite_master и разбор JSON на каждый вызов против кэша"""
+    ids = populate(args.users)
+    rnd = random.Random(31)
+    # Фильтры есть у каждого пятого; остальные тоже спрашивают их на каждом свайпе
+    with_filters = rnd.sample(ids, len(ids) // 5)
+    for telegram_id in with_filters:
+        database.save_user_filters(telegram_id, rnd.sample(TARGETS, rnd.randint(1, 3)), rnd.choice([None, 10, 50]))
+    active = rnd.sample(ids, max(1, len(ids) // 10))
+    calls = [rnd.choice(active) if rnd.random() < 0.9 else rnd.choice(ids) for _ in range(args.swipes * 10)]
+
+    def uncached():
+        # Прежний get_user_filters
+        with database.db_connection() as conn:
+            for telegram_id in calls:
+                cur = conn.cursor()
+                cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
+                cur.fetchone()
+                cur.execute("SELECT target_filters, distance_filter FROM user_filters WHERE telegram_id = ?",
+                            (telegram_id,))
+                row = cur.fetchone()
+                if row:
+                    json.loads(row['target_filters']) if row['target_filters'] else []
+
+    def cached():
+        for telegram_id in calls:
+            database.get_user_filters(telegram_id)
+
+    for label, func in (("без кэша", uncached), ("с кэшем", cached)):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        print(f"{label:9}: {len(calls) / elapsed:,.0f} вызовов/сек | {elapsed / len(calls) * 1e6:.1f} µs")
+    stats = database.filter_cache_stats()
+    print(f"  попаданий {stats['hits'] / (stats['hits'] + stats['misses']):.1%}, {stats}")
+
+    # Инвалидация: сохраненные фильтры сразу видны, в том числе у тех, у кого их не было
+    telegram_id = next(i for i in ids if i not in set(with_filters))
+    assert database.get_user_filters(telegram_id) is None
+    database.save_user_target_filters(telegram_id, ["Свидания", "Дружба"])
+    database.save_user_distance_filter(telegram_id, 25)
+    filters = database.get_user_filters(telegram_id)
+    assert filters['target_filters'] == ["Дружба", "Свидания"] and filters['distance_filter'] == 25
+    print("  ✅ сохранение фильтров сбрасывает кэш")
+
+
+@benchmark("logging")
+def bench_logging(args):
+    """Сохранение и чтение фильтров: синхронный вывод логов против очереди и выключенного DEBUG"""
+    ids = populate(args.users)
+    rnd = random.Random(37)
+    calls = [(rnd.choice(ids), rnd.sample(TARGETS, rnd.randint(1, 3))) for _ in range(args.swipes)]
+
+    def run():
+        samples = []
+        for telegram_id, targets in calls:
+            started = time.perf_counter()
+            database.save_user_target_filters(telegram_id, targets)
+            database.get_user_filters(telegram_id)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    root = logging.getLogger()
+    with open(os.path.join(_BENCH_DIR, "bench.log"), "a", encoding="utf-8") as stream:
+        # Как прежние print(): каждая строка пишется в файл в вызывающем потоке
+        logging_setup.shutdown()
+        root.handlers[:] = [logging.StreamHandler(stream)]
+        root.setLevel(logging.DEBUG)
+        report("DEBUG, синхронный вывод", run())
+        logging_setup.setup("DEBUG", stream=stream)
+        report("DEBUG, QueueHandler     ", run())
+        logging_setup.setup("WARNING", stream=stream)
+        report("WARNING (по умолчанию)  ", run())
+        logging_setup.shutdown()
+        print(f"  записано в лог: {stream.tell() / 1024:,.0f} КБ")
+
+
+@benchmark("metrics")
+def bench_metrics(args):
+    """Цена инструментирования: обертка запросов к базе выключена и включена, middleware, экспорт"""
+    import asyncio
+    import types
+    import async_database
+    import metrics
+
+    ids = populate(args.users)
+    n = args.swipes * 100
+
+    def query():
+        return None
+
+    async def direct_run(func, *a, **kw):
+        return func(*a, **kw)
+
+    async def handler(event, data):
+        return None
+
+    async def per_call(call):
+        started = time.perf_counter()
+        for _ in range(n):
+            await call()
+        return (time.perf_counter() - started) / n
+
+    async def overhead():
+        # Без пула потоков: иначе разница тонет в шуме run_in_executor
+        original_run, async_database.run = async_database.run, direct_run
+        try:
+            wrapped = async_database._wrap(query)
+            base = await per_call(lambda: direct_run(query))
+            metrics.enabled = False
+            off = await per_call(wrapped)
+            metrics.enabled = True
+            on = await per_call(wrapped)
+        finally:
+            async_database.run = original_run
+        middleware = metrics.HandlerTimingMiddleware()
+        data = {"handler": types.SimpleNamespace(callback=query)}
+        plain = await per_call(lambda: handler(None, data))
+        timed = await per_call(lambda: middleware(handler, None, data))
+        return base, off, on, plain, timed
+
+    base, off, on, plain, timed = asyncio.run(overhead())
+    metrics.registry.clear()
+    print(f"обертка базы, выключено: +{(off - base) * 1e9:.0f} нс на вызов")
+    print(f"обертка базы, включено : +{(on - base) * 1e9:.0f} нс на вызов")
+    print(f"HandlerTimingMiddleware: +{(timed - plain) * 1e9:.0f} нс на апдейт")
+
+    async def lookups():
+        samples = []
+        for telegram_id in ids[:args.swipes]:
+            started = time.perf_counter()
+            await async_database.get_user_by_telegram_id(telegram_id)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    for flag in (False, True):
+        metrics.enabled = flag
+        database.clear_profile_cache()
+        report(f"get_user_by_telegram_id, метрики {'вкл ' if flag else 'выкл'}", asyncio.run(lookups()))
+    metrics.enabled = False
+    async_database.shutdown()
+
+    started = time.perf_counter()
+    text = metrics.render_prometheus()
+    print(f"render_prometheus: {len(text.splitlines())} строк, {len(text)} байт, "
+          f"{(time.perf_counter() - started) * 1e3:.2f} мс")
+    print("\n".join(metrics.summary()))
+
+
+@benchmark("webhook")
+def bench_webhook(args):
+    """Апдейтов в секунду через настоящий Dispatcher и handlers: long polling против webhook"""
+    import asyncio
+    from aiogram import BaseMiddleware, Dispatcher
+    import async_database
+    import deck
+    import handlers
+    from fake_telegram import FakeTelegram
+    from webhook import WebhookServer
+
+    ids = populate(args.users)
+    rnd = random.Random(41)
+    viewers = rnd.sample(ids, min(len(ids), 200))
+    texts = ["👀 Смотреть анкеты", "👎 Дизлайк", "❤️ Лайк"]
+
+    class Done(BaseMiddleware):
+        """Считает обработанные апдейты и будит бенчмарк после последнего"""
+        def __init__(self, total):
+            self.left = total
+            self.event = asyncio.Event()
+
+        async def __call__(self, handler, event, data):
+            try:
+                return await handler(event, data)
+            finally:
+                self.left -= 1
+                if self.left == 0:
+                    self.event.set()
+
+    def make_dispatcher(done):
+        # Один router нельзя подключить к двум Dispatcher: отцепляем от прошлого прогона
+        handlers.router._parent_router = None
+        dp = Dispatcher()
+        dp.include_router(handlers.router)
+        dp.update.outer_middleware(done)
+        return dp
+
+    async def run(mode, count):
+        tg = await FakeTelegram(latency=args.api_latency).start()
+        bot = tg.make_bot()
+        updates = [tg.message_update(rnd.choice(viewers), rnd.choice(texts)) for _ in range(count)]
+        done = Done(len(updates))
+        dp = make_dispatcher(done)
+        started = time.perf_counter()
+        if mode == "polling":
+            tg.push(*updates)
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+            await done.event.wait()
+            elapsed = time.perf_counter() - started
+            await dp.stop_polling()
+            await polling
+            extra = f"getUpdates {tg.calls['getupdates']}"
+        else:
+            server = await WebhookServer(dp, bot, path="/webhook", secret="",
+                                         workers=args.workers).start("127.0.0.1", 0)
+            await tg.deliver(f"http://127.0.0.1:{server.port}/webhook", updates, concurrency=40)
+            await done.event.wait()
+            elapsed = time.perf_counter() - started
+            await server.stop()
+            extra = f"429 и повторов {tg.retries}, {server.stats()}"
+        await bot.session.close()
+        await tg.close()
+        deck.close()
+        return f"{mode:8}: {len(updates) / elapsed:,.0f} апдейтов/сек за {elapsed:.2f} с | {extra}"
+
+    # Прогрев: aiogram лениво импортирует методы API и строит модели при первом вызове
+    asyncio.run(run("polling", 50))
+    for mode in ("polling", "webhook"):
+        print(asyncio.run(run(mode, args.swipes)))
+    async_database.shutdown()
+
+
+@benchmark("scaling")
+def bench_scaling(args):
+    """Апдейтов в секунду с BOT_WORKERS = 1, 2, 4... процессами за одним приемом (supervisor.py)"""
+    import asyncio
+    from fake_telegram import FakeTelegram, TOKEN
+    from supervisor import Supervisor
+
+    ids = populate(args.users)
+    # Воркеры запускаются через spawn и берут путь к базе из окружения
+    os.environ["DB_PATH"] = database.DB_PATH
+    rnd = random.Random(43)
+    viewers = rnd.sample(ids, min(len(ids), 500))
+    texts = ["👀 Смотреть анкеты", "👎 Дизлайк", "❤️ Лайк"]
+    counts = [1]
+    while counts[-1] * 2 <= args.max_workers:
+        counts.append(counts[-1] * 2)
+
+    async def run(workers):
+        tg = await FakeTelegram(latency=args.api_latency).start()
+        sup = await Supervisor(workers=workers, token=TOKEN, api_base=tg.url).start()
+        tg.push(*[tg.message_update(rnd.choice(viewers), rnd.choice(texts)) for _ in range(args.swipes)])
+        started = time.perf_counter()
+        receiver = asyncio.create_task(sup.poll(timeout=1))
+        while sup.processed() < args.swipes:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        await sup.stop()
+        await tg.close()
+        return args.swipes / elapsed, sup.backoffs
+
+    print(f"ядер: {os.cpu_count()}, апдейтов: {args.swipes}, задержка API {args.api_latency * 1000:.0f} мс")
+    base = None
+    for workers in counts:
+        rate, backoffs = asyncio.run(run(workers))
+        base = base or rate
+        print(f"  воркеров {workers}: {rate:,.0f} апдейтов/сек (x{rate / base:.2f}), ожиданий очереди {backoffs}")
+
+
+@benchmark("exclusion")
+def bench_exclusion(args):
+    """Кулдаун подзапросом NOT EXISTS к likes против индекса исключений в памяти"""
+    path = os.path.join(_BENCH_DIR, f"exclusion_{args.users}.sqlite3")
+    ids = reset_and_populate_db.generate_dataset(args.users, seed=args.seed, swipes_per_user=args.history,
+                                                 days=14, path=path, now=int(time.time()))
+    with database.db_connection() as conn:
+        likes = conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0]
+        # Самые активные: у них подзапрос длиннее всего
+        active = [row[0] for row in conn.execute(
+            "SELECT from_user FROM likes GROUP BY from_user ORDER BY COUNT(*) DESC LIMIT 100")]
+    print(f"{args.users:,} анкет, {likes:,} свайпов за 14 дней")
+
+    started = time.perf_counter()
+    database.rebuild_exclusion_index()
+    stats = database.exclusion_stats()
+    print(f"построение индекса: {time.perf_counter() - started:.2f} с | {stats['viewers']:,} пользователей, "
+          f"{stats['entries']:,} свайпов в окне, {stats['bytes'] / 1e6:.1f} МБ "
+          f"({stats['bytes'] / max(1, stats['entries']):.0f} байт на свайп)")
+
+    cases = [
+        ("random_profile", ids, lambda viewer: database.get_random_profile(viewer)),
+        ("filtered 2 цели", ids, lambda viewer: database.get_filtered_profile(viewer, ["Дружба", "Общение"])),
+        ("filtered, активные", active, lambda viewer: database.get_filtered_profile(viewer, ["Дружба", "Общение"])),
+        ("кандидаты колоды", active, lambda viewer: database.get_candidate_ids(viewer, limit=20)),
+    ]
+    index = database.rebuild_exclusion_index()
+    for label, viewers, call in cases:
+        for mode in ("SQL", "индекс"):
+            if mode == "SQL":
+                database.drop_exclusion_index()
+            else:
+                database._exclusion = index
+            rnd = random.Random(43)
+            report(f"{label:18} {mode:6}", measure(lambda: call(rnd.choice(viewers)), args.swipes))
+    database.drop_exclusion_index()
+
+
+# Кулдаун до likes.created_ts: строка created_at против datetime() на каждую строку индекса
+TEXT_COOLDOWN_CONDITION = """NOT EXISTS (
+    SELECT 1 FROM likes INDEXED BY bench_likes_pair_text
+    WHERE likes.from_user = ?
+      AND likes.to_user = users.telegram_id
+      AND likes.created_at > datetime(?, 'unixepoch')
+)"""
+INTEGER_COOLDOWN_CONDITION = """NOT EXISTS (
+    SELECT 1 FROM likes INDEXED BY idx_likes_pair_ts
+    WHERE likes.from_user = ?
+      AND likes.to_user = users.telegram_id
+      AND likes.created_ts > ?
+)"""
+
+
+def index_megabytes(conn, name):
+    return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0] / 1e6
+
+
+@benchmark("cooldown")
+def bench_cooldown(args):
+    """
+    Кулдаун по строке created_at против целого created_ts на большой истории:
+    --users 200000 --history 50 дает около 10 млн likes за 30 дней.
+    """
+    path = os.path.join(_BENCH_DIR, f"cooldown_{args.users}_{args.seed}.sqlite3")
+    started = time.perf_counter()
+    ids = reset_and_populate_db.generate_dataset(args.users, seed=args.seed, swipes_per_user=args.history,
+                                                 filters_share=0, path=path, now=int(time.time()))
+    database.drop_exclusion_index()
+    with database.db_connection() as conn:
+        likes = conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0]
+        print(f"{args.users:,} анкет, {likes:,} свайпов за 30 дней: {time.perf_counter() - started:.0f} с")
+        active = [row[0] for row in conn.execute(
+            "SELECT from_user FROM likes GROUP BY from_user ORDER BY COUNT(*) DESC LIMIT 100")]
+
+        # Прежние индексы по created_at строятся рядом с новыми, чтобы сравнить их на одной базе
+        for name, sql in (
+            ("bench_likes_pair_text", "likes(from_user, to_user, created_at, action)"),
+            ("bench_likes_from_text", "likes(from_user, created_at, to_user)"),
+        ):
+            started = time.perf_counter()
+            conn.execute(f"CREATE INDEX {name} ON {sql}")
+            conn.commit()
+            print(f"  {name}: {time.perf_counter() - started:.1f} с")
+        conn.execute("ANALYZE")
+        conn.commit()
+        for text, integer in (("bench_likes_pair_text", "idx_likes_pair_ts"),
+                              ("bench_likes_from_text", "idx_likes_from_ts")):
+            print(f"  размер {text}: {index_megabytes(conn, text):.0f} МБ, {integer}: "
+                  f"{index_megabytes(conn, integer):.0f} МБ")
+
+        # Миграция 9 на этой базе: заполнение created_ts до индексов по нему, затем сами индексы
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE name IN ('idx_likes_pair_ts', 'idx_likes_from_ts')").fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        started = time.perf_counter()
+        conn.execute("UPDATE likes SET created_ts = CAST(strftime('%s', created_at) AS INTEGER)")
+        conn.commit()
+        backfill = time.perf_counter() - started
+        for _, sql in indexes:
+            conn.execute(sql)
+        conn.commit()
+        print(f"  миграция: заполнение created_ts {backfill:.1f} с, индексы по нему "
+              f"{time.perf_counter() - started - backfill:.1f} с")
+
+    cutoff = database.cooldown_start()
+    with database.db_connection() as conn:
+        # Окно кулдауна целиком, как при построении индекса исключений
+        for label, sql, params in (
+            ("окно, строка", "SELECT COUNT(*) FROM likes WHERE created_at > datetime(?, 'unixepoch')", (cutoff,)),
+            ("окно, целое", "SELECT COUNT(*) FROM likes WHERE created_ts > ?", (cutoff,)),
+        ):
+            samples = measure(lambda: conn.execute(sql, params).fetchone(), 5, budget=60)
+            report(f"{label:26}", samples)
+        # История пользователя за окно: диапазон по второму столбцу индекса
+        for label, sql in (
+            ("история за окно, строка", "SELECT COUNT(*) FROM likes INDEXED BY bench_likes_from_text "
+                                       "WHERE from_user = ? AND created_at > datetime(?, 'unixepoch')"),
+            ("история за окно, целое", "SELECT COUNT(*) FROM likes INDEXED BY idx_likes_from_ts "
+                                      "WHERE from_user = ? AND created_ts > ?"),
+        ):
+            rnd = random.Random(43)
+            report(f"{label:26}", measure(lambda: conn.execute(sql, (rnd.choice(active), cutoff)).fetchone(),
+                                         args.swipes))
+
+    cases = [
+        ("random_profile", ids, lambda viewer: database.get_random_profile(viewer)),
+        ("filtered 2 цели", ids, lambda viewer: database.get_filtered_profile(viewer, ["Дружба", "Общение"])),
+        ("filtered, активные", active, lambda viewer: database.get_filtered_profile(viewer, ["Дружба", "Общение"])),
+        ("кандидаты колоды", active, lambda viewer: database.get_candidate_ids(viewer, limit=20)),
+    ]
+    try:
+        for label, viewers, call in cases:
+            for mode, condition in (("строка", TEXT_COOLDOWN_CONDITION), ("целое", INTEGER_COOLDOWN_CONDITION)):
+                database.COOLDOWN_CONDITION = condition
+                rnd = random.Random(43)
+                report(f"{label:18} {mode:6}", measure(lambda: call(rnd.choice(viewers)), args.swipes))
+    finally:
+        database.COOLDOWN_CONDITION = f"NOT EXISTS ({database.RECENT_SWIPE})"
+
+
+def target_combinations():
+    """None (все цели) и каждый непустой набор целей, как их можно выбрать в target_filter_keyboard"""
+    combos = [None]
+    for mask in range(1, 1 << len(database.TARGETS)):
+        combos.append(database.mask_to_targets(mask))
+    return combos
+
+
+@benchmark("suite")
+def bench_suite(args):
+    """
+    Горячие пути просмотра и свайпов на сгенерированной базе с историей свайпов:
+    get_filtered_profile на всех сочетаниях целей и расстояний, get_random_profile,
+    цикл add_like + check_match, get_user_filters, get_user_by_telegram_id.
+    Индекс исключений включен, как в боте по умолчанию (--exclusion off - без него).
+    --save-baseline сохраняет результаты в JSON, --baseline сравнивает с ними.
+
+    Каждый замер - медиана --repeat повторов с одной и той же последовательностью
+    зрителей; p50 сравнивается с базовым в пересчете на скорость эталонного запроса
+    (calibration_query). Регрессия - рост больше --threshold и больше --noise-floor µs,
+    подтвержденный --confirm отложенными перепроверками.
+    """
+    path = os.path.join(_BENCH_DIR, f"suite_{args.users}_{args.seed}.sqlite3")
+    # История свайпов от настоящего времени: кулдаун в боте считается от него
+    ids = reset_and_populate_db.generate_dataset(args.users, seed=args.seed, swipes_per_user=args.history, path=path,
+                                                 now=int(time.time()))
+    if args.exclusion == "on":
+        database.rebuild_exclusion_index()
+    else:
+        database.drop_exclusion_index()
+    rnd = random.Random()
+    baseline = load_baseline(args.baseline, args) if args.baseline else {}
+    results = {}
+    suspects = {}  # name -> (func, iterations, reseed, p50 первого замера, [(p50, ожидаемый p50) перепроверок])
+    regressions = []
+
+    def case(name, func, iterations=args.swipes):
+        # Каждый повтор и каждый запуск гоняют одну и ту же последовательность зрителей
+        # и проб: иначе разброс между анкетами большого и маленького города
+        # перекрывает любую регрессию
+        def reseed():
+            rnd.seed(f"{args.seed}:{name}")
+            random.seed(f"{args.seed}:{name}")
+
+        stats = results[name] = run_case(func, iterations, args, reseed)
+        note = ""
+        base = baseline.get(name)
+        if base:
+            note = f" | p50 {stats['p50_us'] / expected_p50(base, stats) - 1:+.0%} к базовой"
+            if is_regression(base, stats, args):
+                note += " (на перепроверку)"
+                suspects[name] = (func, iterations, reseed, stats["p50_us"], [])
+        print_stats(name, stats, note)
+
+    def confirm():
+        # Регрессия засчитывается, только если ее подтвердили все args.confirm
+        # отложенных проходов: дрейф скорости машины держится секунды и в другом
+        # окне времени пропадает, а настоящая регрессия - нет. Проходы идут
+        # в чередующемся порядке и не чаще раза в args.confirm_gap секунд,
+        # чтобы соседние замеры не попадали в одно окно.
+        pending = list(suspects)
+        started = None
+        for round_ in range(args.confirm):
+            if not pending:
+                break
+            if started is not None:
+                time.sleep(max(0.0, started + args.confirm_gap - time.perf_counter()))
+            started = time.perf_counter()
+            if round_ % 2:
+                pending.reverse()
+            for name in pending:
+                func, iterations, reseed, _, rounds = suspects[name]
+                stats = run_case(func, iterations, args, reseed)
+                expected = expected_p50(baseline[name], stats)
+                print_stats(f"{name} (перепроверка {round_ + 1})", stats,
+                            f" | p50 {stats['p50_us'] / expected - 1:+.0%}")
+                if is_regression(baseline[name], stats, args):
+                    rounds.append((stats["p50_us"], expected))
+                else:
+                    del suspects[name]
+            pending = [name for name in pending if name in suspects]
+        for name in pending:
+            _, _, _, first, rounds = suspects.pop(name)
+            regressions.append((name, first, rounds))
+
+    for targets in target_combinations():
+        for km in (None, 5, 10, 30, 50):
+            label = "+".join(targets) if targets else "все цели"
+            case(f"filtered[{label}|{km or '∞'} км]",
+                 lambda targets=targets, km=km: database.get_filtered_profile(
+                     rnd.choice(ids), target_filters=targets, distance_km=km))
+    case("random_profile", lambda: database.get_random_profile(rnd.choice(ids)))
+
+    database.clear_filter_cache()
+    case("user_filters", lambda: database.get_user_filters(rnd.choice(ids)), iterations=args.swipes * 10)
+    database.clear_profile_cache()
+    case("user_by_telegram_id", lambda: database.get_user_by_telegram_id(rnd.choice(ids)),
+         iterations=args.swipes * 10)
+    # Перепроверяем до свайпов: они меняют базу, и чтение после них уже другое
+    confirm()
+
+    def swipe():
+        viewer = rnd.choice(ids)
+        profile = database.get_filtered_profile(viewer)
+        if profile:
+            database.add_like(viewer, profile['telegram_id'], action="like" if rnd.random() < 0.35 else "dislike")
+            database.check_match(viewer, profile['telegram_id'])
+    case("swipe", swipe)
+    confirm()
+    database.flush_likes()
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, args, results)
+        print(f"Базовые результаты сохранены: {args.save_baseline}")
+    if args.baseline:
+        print(f"Сравнение с {args.baseline}: регрессий {len(regressions)} из {len(results)} "
+              f"(порог p50 +{args.threshold:.0%} и не меньше +{args.noise_floor:.0f} µs "
+              f"в первом замере и во всех {args.confirm} перепроверках)")
+        for name, first, rounds in regressions:
+            rounds = ", ".join(f"{p50:.0f}/{expected:.0f}" for p50, expected in rounds)
+            print(f"  {name}: p50 {first:.0f} µs, перепроверки (p50/ожидалось): {rounds}")
+        if regressions:
+            sys.exit(1)
+
+
+def calibration_query():
+    """
+    Эталонная работа: чтение первых одиннадцати анкет по первичному ключу, которое
+    не зависит ни от свайпов, ни от кэшей, ни от --users. По его времени видно, насколько быстрее или медленнее
+    сейчас машина; запрос к SQLite отслеживает это точнее, чем чистый цикл Python.
+    """
+    with database.db_connection() as conn:
+        return conn.execute(
+            "SELECT * FROM users WHERE id BETWEEN (SELECT MIN(id) FROM users) AND (SELECT MIN(id) FROM users) + 10"
+        ).fetchall()
+
+
+def measure_calibrated(func, iterations, budget):
+    """Как measure, но вызовы func чередуются с calibration_query; возвращает две выборки"""
+    samples, reference = [], []
+    deadline = time.perf_counter() + budget
+    while len(samples) < iterations and (not samples or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        calibration_query()
+        reference.append(time.perf_counter() - started)
+    return samples, reference
+
+
+def run_case(func, iterations, args, reseed):
+    """
+    args.repeat замеров по args.case_budget секунд, перед каждым reseed();
+    результат - замер с медианным p50 относительно эталона. Медиана, а не
+    лучший повтор: лучший из нескольких сам по себе шумит от запуска к запуску.
+    """
+    runs = []
+    for _ in range(args.repeat):
+        reseed()
+        samples, reference = measure_calibrated(func, iterations, args.case_budget)
+        stats = summarize(samples)
+        stats["ref_p50_us"] = summarize(reference)["p50_us"]
+        runs.append(stats)
+    runs.sort(key=lambda stats: stats["p50_us"] / stats["ref_p50_us"])
+    stats = dict(runs[len(runs) // 2])
+    stats["runs_p50_us"] = [run["p50_us"] for run in runs]
+    return stats
+
+
+def expected_p50(base, stats):
+    """
+    p50 базового замера в пересчете на текущую скорость машины. На общих
+    виртуалках она плавает на десятки процентов за секунды, и без поправки на
+    эталон такой дрейф неотличим от регрессии.
+    """
+    if "ref_p50_us" not in base:
+        return base["p50_us"]
+    return base["p50_us"] * stats["ref_p50_us"] / base["ref_p50_us"]
+
+
+def is_regression(base, stats, args):
+    """p50 вырос больше чем на threshold и больше чем на noise_floor микросекунд с поправкой на эталон"""
+    expected = expected_p50(base, stats)
+    return stats["p50_us"] > max(expected * (1 + args.threshold), expected + args.noise_floor)
+
+
+def save_baseline(path, args, results):
+    meta = {
+        "users": args.users,
+        "seed": args.seed,
+        "history": args.history,
+        "exclusion": args.exclusion,
+        "python": sys.version.split()[0],
+        "sqlite": database.sqlite3.sqlite_version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def load_baseline(path, args):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    meta = data.get("meta", {})
+    for key in ("users", "seed", "history", "exclusion"):
+        if meta.get(key) != getattr(args, key):
+            print(f"⚠️ базовые результаты сняты с {key}={meta.get(key)}, сейчас {getattr(args, key)}",
+                  file=sys.stderr)
+    return data["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--swipes", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=3.0, help="секунд нагрузки для loop-latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="размеры баз для sampling")
+    parser.add_argument("--points", type=int, default=1_000_000, help="точек для haversine")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка фейкового Bot API, с")
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков webhook")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="процессов для scaling")
+    parser.add_argument("--seed", type=int, default=42, help="seed базы для suite")
+    parser.add_argument("--history", type=float, default=10, help="свайпов на анкету в базе suite")
+    parser.add_argument("--case-budget", type=float, default=0.2, help="секунд на один повтор замера suite")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждого замера suite; берется медиана")
+    parser.add_argument("--exclusion", choices=("on", "off"), default="on" if EXCLUSION_INDEX else "off",
+                        help="индекс исключений в suite (по умолчанию как EXCLUSION_INDEX)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="сохранить результаты suite в JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="сравнить suite с сохраненными результатами")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="рост p50 относительно базовой, после которого замер считается регрессией")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="отложенных перепроверок, которые должны подтвердить регрессию suite")
+    parser.add_argument("--confirm-gap", type=float, default=10, help="секунд между началами перепроверок suite")
+    parser.add_argument("--noise-floor", type=float, default=20,
+                        help="рост p50 в µs, меньше которого регрессия не засчитывается")
+    args = parser.parse_args()
+    print(f"База бенчмарка: {database.DB_PATH}", file=sys.stderr)
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == "__main__":
+    main()
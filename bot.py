@@ -1,13 +1,28 @@
 # bot.py
 import asyncio
+import logging
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN, require_bot_token
-from database import init_db
+from config import (
+    BOT_TOKEN, require_bot_token, METRICS_ENABLED, METRICS_PORT, METRICS_DUMP_INTERVAL, RUN_MODE, BOT_WORKERS,
+    EXCLUSION_INDEX, MAINTENANCE_INTERVAL,
+)
+import async_database
+import deck
+import fsm_storage
+import geocoding
+import logging_setup
+import maintenance
+import metrics
+import supervisor
+import webhook
+from database import init_db, rebuild_exclusion_index
 from handlers import router
 from aiogram.types import BotCommand
 
+logger = logging.getLogger(__name__)
+
 
 async def set_commands(bot):
     commands = [
@@ -21,23 +36,73 @@ async def set_commands(bot):
 async def main():
     # ensure token is present
     require_bot_token()
+    if RUN_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"Неизвестный RUN_MODE: {RUN_MODE} (polling или webhook)")
+    logging_setup.setup()
 
     # создаём таблицы
     init_db()
 
     bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    storage = fsm_storage.create_storage()
+    if isinstance(storage, fsm_storage.SQLiteStorage):
+        await storage.purge_expired()
     dp = Dispatcher(storage=storage)
 
     # подключаем роутер
     dp.include_router(router)
 
-    print("Бот запущен. Ctrl+C для остановки.")
+    if BOT_WORKERS > 1:
+        # Этот процесс только принимает апдейты, обрабатывают их процессы supervisor.py
+        await set_commands(bot)
+        await bot.session.close()
+        await storage.close()
+        async_database.shutdown()
+        logger.info("Бот запущен с %s воркерами. Ctrl+C для остановки.", BOT_WORKERS)
+        try:
+            await supervisor.run(dp.resolve_used_update_types())
+        finally:
+            logging_setup.shutdown()
+        return
+
+    if EXCLUSION_INDEX:
+        rebuild_exclusion_index()
+    likes_flusher = asyncio.create_task(async_database.flush_likes_periodically())
+    maintainer = asyncio.create_task(maintenance.run_periodically()) if MAINTENANCE_INTERVAL else None
+
+    metrics_server = metrics_dumper = None
+    if METRICS_ENABLED:
+        metrics.install(dp, bot)
+        if METRICS_PORT:
+            metrics_server = await metrics.start_server(METRICS_PORT)
+        if METRICS_DUMP_INTERVAL:
+            metrics_dumper = asyncio.create_task(metrics.dump_periodically())
+
+    logger.info("Бот запущен. Ctrl+C для остановки.")
     try:
         await set_commands(bot)
-        await dp.start_polling(bot)
+        if RUN_MODE == "webhook":
+            await webhook.run_webhook(dp, bot)
+        else:
+            # Telegram не отдает getUpdates, пока установлен webhook от прошлого запуска
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        likes_flusher.cancel()
+        if maintainer:
+            maintainer.cancel()
+        if metrics_dumper:
+            metrics_dumper.cancel()
+        if metrics_server:
+            await metrics_server.cleanup()
+        # Свайпы из буфера записываются до закрытия пула базы
+        await async_database.flush_likes()
         await bot.session.close()
+        await geocoding.close()
+        deck.close()
+        await storage.close()
+        async_database.shutdown()
+        logging_setup.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Ограниченный по размеру LRU-кэш с временем жизни записей.
+
+    cache = TTLCache(maxsize=10000, ttl=3600)
+    cache.set(user_id, value)
+    cache.get(user_id)      # None, если записи нет или она старше ttl
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Записи живут не дольше ttl секунд с момента set(); сверх maxsize вытесняются
+    давно не использованные. Просроченные записи удаляются при обращении к ним
+    и полным проходом не чаще раза в ttl.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()  # key -> (expires_at, value), порядок - от давних к свежим
+        self._next_sweep = timer() + ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= self._timer():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        now = self._timer()
+        if now >= self._next_sweep:
+            self.expire(now)
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= self._timer():
+            return default
+        return entry[1]
+
+    def expire(self, now=None):
+        """Удаляет все просроченные записи"""
+        now = self._timer() if now is None else now
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
+        self._next_sweep = now + self.ttl
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def memory_bytes(self):
+        """Оценка занятой памяти: словарь, кортежи записей, ключи и значения"""
+        total = sys.getsizeof(self._data)
+        for key, entry in self._data.items():
+            total += sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry[1])
+        return total
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "bytes": self.memory_bytes(),
+        }
+
+
+class ReadThroughCache:
+    """
+    Потокобезопасный TTLCache для чтений из базы с инвалидацией при записи.
+
+    Читатель берет epoch вместе с промахом и кладет значение через store(),
+    только если с тех пор не было invalidate(): так чтение, начатое до
+    записи, не вернет в кэш устаревшую строку.
+
+        value, epoch = cache.lookup(key)
+        if value is MISSING:
+            value = load(key)
+            cache.store(key, value, epoch)
+    """
+
+    MISSING = _MISSING
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._epoch = 0
+
+    def lookup(self, key):
+        with self._lock:
+            return self._cache.get(key, _MISSING), self._epoch
+
+    def store(self, key, value, epoch):
+        with self._lock:
+            if epoch == self._epoch:
+                self._cache.set(key, value)
+
+    def invalidate(self, key):
+        """Вызывается после коммита записи"""
+        with self._lock:
+            self._epoch += 1
+            self._cache.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return self._cache.stats()
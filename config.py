@@ -13,3 +13,97 @@ DB_PATH = os.getenv("DB_PATH", "db.sqlite3")
 def require_bot_token():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан. Добавь его в .env или в переменные окружения.")
+
+# Number of threads that run blocking sqlite calls for async handlers.
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+# Candidate deck: profiles fetched per batch, refill threshold and number of users kept in memory.
+DECK_SIZE = int(os.getenv("DECK_SIZE", "20"))
+DECK_LOW_WATER = int(os.getenv("DECK_LOW_WATER", "5"))
+DECK_MAX_USERS = int(os.getenv("DECK_MAX_USERS", "10000"))
+
+# "Currently viewing" store for Like/Dislike buttons: memory or sqlite (survives restarts).
+VIEWING_STORE = os.getenv("VIEWING_STORE", "memory")
+VIEWING_TTL = int(os.getenv("VIEWING_TTL", str(24 * 3600)))
+VIEWING_MAX_USERS = int(os.getenv("VIEWING_MAX_USERS", "100000"))
+
+# FSM storage: sqlite keeps registration/filter flows across restarts, memory is aiogram's MemoryStorage.
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_TTL = int(os.getenv("FSM_TTL", str(7 * 24 * 3600)))
+# Writes made within this many seconds are coalesced into one transaction.
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.05"))
+# Flush attempts on shutdown; states still unwritten after them are logged and dropped.
+FSM_CLOSE_RETRIES = int(os.getenv("FSM_CLOSE_RETRIES", "3"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# Reverse geocoding (Nominatim). The usage policy allows about 1 request per second.
+GEOCODER_URL = os.getenv("GEOCODER_URL", "https://nominatim.openstreetmap.org/reverse")
+GEOCODER_RATE = float(os.getenv("GEOCODER_RATE", "1.0"))
+# Coordinates are rounded to this many decimals for caching (2 ≈ 1 km).
+GEOCODER_PRECISION = int(os.getenv("GEOCODER_PRECISION", "2"))
+GEOCODER_CACHE_SIZE = int(os.getenv("GEOCODER_CACHE_SIZE", "10000"))
+# offline: only the bundled gazetteer (cities.csv); hybrid: gazetteer when a city is within
+# GAZETTEER_RADIUS_KM, otherwise Nominatim; remote: Nominatim first. Both fall back to the gazetteer.
+GEOCODER_MODE = os.getenv("GEOCODER_MODE", "hybrid")
+GAZETTEER_RADIUS_KM = float(os.getenv("GAZETTEER_RADIUS_KM", "30"))
+
+# Likes/dislikes are buffered and written in one transaction per batch
+# (on LIKES_BATCH_SIZE rows or after LIKES_FLUSH_INTERVAL seconds).
+LIKES_BATCH_SIZE = int(os.getenv("LIKES_BATCH_SIZE", "64"))
+LIKES_FLUSH_INTERVAL = float(os.getenv("LIKES_FLUSH_INTERVAL", "0.5"))
+
+# In-memory index of who swiped whom during the 9-day cooldown, built from likes at startup.
+# Profile sampling checks it instead of querying likes; set to 0 to always check in SQL.
+EXCLUSION_INDEX = os.getenv("EXCLUSION_INDEX", "1").lower() in ("1", "true", "yes")
+
+# Background database maintenance (see maintenance.py), every MAINTENANCE_INTERVAL seconds (0 = off).
+# One run moves swipes that no longer matter out of likes in at most MAINTENANCE_BATCHES transactions
+# of MAINTENANCE_BATCH_SIZE rows, then frees up to MAINTENANCE_VACUUM_PAGES pages and refreshes
+# planner statistics. LIKES_ARCHIVE=0 deletes those swipes instead of copying them to likes_archive.
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_BATCHES = int(os.getenv("MAINTENANCE_BATCHES", "200"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "2000"))
+LIKES_ARCHIVE = os.getenv("LIKES_ARCHIVE", "1").lower() in ("1", "true", "yes")
+
+# Read-through cache of user profiles by telegram_id.
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+# With BOT_WORKERS > 1 a worker never sees other workers' profile edits, so profiles of users
+# served by other workers stay cached only this many seconds (PROFILE_CACHE_TTL applies to its own users).
+WORKER_PROFILE_CACHE_TTL = float(os.getenv("WORKER_PROFILE_CACHE_TTL", "5"))
+
+# Cache of decoded user filters (read on every swipe).
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "10000"))
+FILTER_CACHE_TTL = int(os.getenv("FILTER_CACHE_TTL", "300"))
+
+# Logging: level name (DEBUG enables per-call filter/handler traces) and record format.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+# Metrics: handler/DB/Bot API latency histograms. Off by default; METRICS_PORT serves
+# GET /metrics in Prometheus format (0 = no server), METRICS_DUMP_INTERVAL logs a summary.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "0"))
+
+# How updates arrive: "polling" (default) or "webhook" (aiohttp server, see webhook.py).
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+# Public https base URL registered with Telegram; the bot listens on WEBHOOK_HOST:WEBHOOK_PORT.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Concurrent update handlers, accepted-but-unprocessed updates before answering 429,
+# seconds to finish accepted updates on shutdown, and Telegram's parallel deliveries.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Worker processes behind one update receiver (see supervisor.py); 1 keeps the single-process bot.
+# Updates waiting per worker before the receiver backs off, and per-user ordered lanes inside a worker.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_LANES = int(os.getenv("WORKER_LANES", "32"))
@@ -1,96 +1,427 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
+import atexit
+import functools
+import json
+import logging
 import math
+import os
+import random
+import time
 
-from config import DB_PATH
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен: без него расстояния считаются скалярным циклом
+    np = None
 
+import exclusion
+from cache import ReadThroughCache
+from config import (
+    DB_PATH, LIKES_BATCH_SIZE, LIKES_FLUSH_INTERVAL, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, WORKER_PROFILE_CACHE_TTL,
+    FILTER_CACHE_SIZE, FILTER_CACHE_TTL,
+)
 
-def get_connection():
+logger = logging.getLogger(__name__)
+
+
+# ========== Соединения ==========
+# Прагмы применяются один раз при открытии соединения. WAL позволяет читать
+# параллельно с записью, synchronous=NORMAL в WAL-режиме не делает fsync на
+# каждый коммит, mmap/cache уменьшают число системных вызовов на чтение.
+# auto_vacuum действует только до создания первой таблицы, поэтому идет раньше WAL;
+# существующую базу переводит разовый VACUUM (python maintenance.py --vacuum).
+CONNECTION_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool: List[sqlite3.Connection] = []
+# Увеличивается в close_connections(), чтобы потоки не держали закрытые соединения.
+_pool_generation = 0
+
+
+def _open_connection():
     # Allow connections from different threads and return Row objects for
     # nicer attribute access (row['field_name']). Using Row keeps callers
     # backwards-compatible with tuple-index access while improving clarity.
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # IMMEDIATE: неявный BEGIN перед первой записью сразу берет блокировку записи.
+    # Когда в базу пишут несколько процессов (supervisor.py), конкурент ждет ее
+    # по busy_timeout, а не получает SQLITE_BUSY при повышении блокировки.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level="IMMEDIATE")
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    # Используется миграцией, которая заполняет users.geocell для существующих анкет
+    conn.create_function("geocell", 2, geocell_for, deterministic=True)
     return conn
 
 
+def get_connection():
+    """Отдельное соединение, которое вызывающий код закрывает сам (скрипты, отладка)"""
+    return _open_connection()
+
+
+@contextmanager
+def db_connection():
+    """
+    Долгоживущее соединение текущего потока.
+    На выходе из самого внешнего блока делает commit, при исключении - rollback.
+    Соединение не закрывается: следующий вызов в этом потоке получит его же.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.key != (DB_PATH, _pool_generation):
+        conn = _open_connection()
+        _local.conn, _local.key, _local.depth = conn, (DB_PATH, _pool_generation), 0
+        with _pool_lock:
+            _pool.append(conn)
+
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if _local.depth == 1 and conn.in_transaction:
+            conn.rollback()
+        raise
+    else:
+        if _local.depth == 1 and conn.in_transaction:
+            conn.commit()
+    finally:
+        _local.depth -= 1
+
+
+def _forget_inherited_state():
+    """
+    После fork соединения и несохраненные свайпы принадлежат родителю: потомок
+    их не использует и не закрывает, а открывает свои соединения заново.
+    """
+    global _pool_lock, _pool_generation, _likes_lock, _flush_lock, _like_buffer, _likes_in_flight, _exclusion
+    _pool_lock = threading.Lock()
+    _pool.clear()
+    _pool_generation += 1
+    _likes_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _like_buffer, _likes_in_flight = [], []
+    # Свайпы родителя после fork сюда уже не попадут: кулдаун снова проверяет SQL
+    _exclusion = None
+
+
+def close_connections():
+    """Закрывает все соединения пула (вызывается при остановке бота)"""
+    global _pool_generation
+    with _pool_lock:
+        connections = _pool[:]
+        _pool.clear()
+        _pool_generation += 1
+    for conn in connections:
+        conn.close()
+
+
 # ========== Инициализация ==========
 def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        # Пользователи (добавлено поле name и координаты для фильтрации)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            name TEXT,
+            gender TEXT,
+            age INTEGER,
+            city TEXT,
+            latitude REAL,
+            longitude REAL,
+            target TEXT,
+            bio TEXT,
+            photo TEXT
+        )
+        """)
+
+        # Лайки
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS likes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user INTEGER,
+            to_user INTEGER,
+            action TEXT CHECK(action IN ('like', 'dislike')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # Матчи
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1 INTEGER,
+            user2 INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # Фильтры пользователей
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_filters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            target_filters TEXT,  -- JSON строка с массивом целей
+            distance_filter INTEGER,  -- расстояние в км
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # Версионируемая часть схемы: столбцы и индексы добавляются миграциями
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+    run_migrations()
+
+
+# ========== Миграции ==========
+def _column_exists(cur, table, column):
+    return any(row['name'] == column for row in cur.execute(f"PRAGMA table_info({table})"))
+
+
+def _migrate_user_columns(cur):
+    """Столбцы, которых не было в первых версиях таблицы users"""
+    for column, column_type in (("name", "TEXT"), ("latitude", "REAL"), ("longitude", "REAL")):
+        if not _column_exists(cur, "users", column):
+            cur.execute(f"ALTER TABLE users ADD COLUMN {column} {column_type}")
 
-    # Пользователи (добавлено поле name и координаты для фильтрации)
+
+def _migrate_hot_query_indexes(cur):
+    """Индексы под исключение просмотренных анкет, проверку матча и фильтр по целям"""
+    # Старые базы могли накопить дубликаты матчей до уникального индекса.
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id INTEGER UNIQUE,
-        name TEXT,
-        gender TEXT,
-        age INTEGER,
-        city TEXT,
-        latitude REAL,
-        longitude REAL,
-        target TEXT,
-        bio TEXT,
-        photo TEXT
-    )
+    DELETE FROM matches
+    WHERE id NOT IN (SELECT MIN(id) FROM matches GROUP BY user1, user2)
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_from_created ON likes(from_user, created_at, to_user)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_pair ON likes(from_user, to_user, action)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_pair ON matches(user1, user2)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches(user2)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_target ON users(target)")
+
+
+def _migrate_likes_pair_created_index(cur):
+    """
+    Пробы анкет проверяют кулдаун коррелированным NOT EXISTS по паре (from_user, to_user).
+    С индексом (from_user, to_user, action) планировщик выбирал idx_likes_from_created
+    и перебирал всю 9-дневную историю пользователя на каждую анкету.
+    """
+    cur.execute("DROP INDEX IF EXISTS idx_likes_pair")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_pair_created ON likes(from_user, to_user, created_at, action)")
+
+
+def _migrate_users_geocell(cur):
+    """Ячейка сетки для фильтра по расстоянию (см. geocell_for)"""
+    if not _column_exists(cur, "users", "geocell"):
+        cur.execute("ALTER TABLE users ADD COLUMN geocell INTEGER")
+    cur.execute("UPDATE users SET geocell = geocell(latitude, longitude)")
+    # latitude и longitude в индексе: прямоугольник отсекается без чтения строк таблицы
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_geocell ON users(geocell, latitude, longitude)")
 
-    # Лайки
+
+def _migrate_viewing_state(cur):
+    """Какую анкету пользователь видит сейчас (viewing_store.SQLiteViewingStore)"""
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS likes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        from_user INTEGER,
-        to_user INTEGER,
-        action TEXT CHECK(action IN ('like', 'dislike')),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    CREATE TABLE IF NOT EXISTS viewing_state (
+        user_id INTEGER PRIMARY KEY,
+        target_id INTEGER NOT NULL,
+        updated_at REAL NOT NULL
     )
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_viewing_state_updated ON viewing_state(updated_at)")
 
-    # Матчи
+
+def _migrate_fsm_state(cur):
+    """Состояния и данные FSM aiogram (fsm_storage.SQLiteStorage)"""
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS matches (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user1 INTEGER,
-        user2 INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)")
+
 
-    # Фильтры пользователей
+def _migrate_geocode_cache(cur):
+    """Кэш обратного геокодирования по округленным координатам (geocoding.py)"""
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS user_filters (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id INTEGER UNIQUE,
-        target_filters TEXT,  -- JSON строка с массивом целей
-        distance_filter INTEGER,  -- расстояние в км
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        lat_key INTEGER NOT NULL,
+        lon_key INTEGER NOT NULL,
+        city TEXT NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        PRIMARY KEY (lat_key, lon_key)
+    ) WITHOUT ROWID
+    """)
+
+
+def _migrate_likes_archive(cur):
+    """Свайпы, которые больше ни на что не влияют (maintenance.py); без индексов"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS likes_archive (
+        id INTEGER PRIMARY KEY,
+        from_user INTEGER,
+        to_user INTEGER,
+        action TEXT,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
 
-    # Добавляем новые столбцы если их нет (миграция для существующих баз)
-    try:
-        cur.execute("ALTER TABLE users ADD COLUMN name TEXT")
-    except sqlite3.OperationalError:
-        pass  # столбец уже существует
 
-    try:
-        cur.execute("ALTER TABLE users ADD COLUMN latitude REAL")
-    except sqlite3.OperationalError:
-        pass
+def _migrate_likes_created_ts(cur):
+    """
+    likes.created_ts - время свайпа в секундах Unix. Кулдаун сравнивает целые
+    числа в индексе вместо строк created_at с datetime('now', ...) в каждой строке.
+    """
+    for table in ("likes", "likes_archive"):
+        if not _column_exists(cur, table, "created_ts"):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER")
+        cur.execute(f"UPDATE {table} SET created_ts = CAST(strftime('%s', created_at) AS INTEGER)")
+    # Вставки, которые задают только created_at (скрипты, старый код), получают created_ts триггером
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS likes_created_ts AFTER INSERT ON likes
+    WHEN NEW.created_ts IS NULL
+    BEGIN
+        UPDATE likes SET created_ts = CAST(strftime('%s', NEW.created_at) AS INTEGER) WHERE id = NEW.id;
+    END
+    """)
+    cur.execute("DROP INDEX IF EXISTS idx_likes_pair_created")
+    cur.execute("DROP INDEX IF EXISTS idx_likes_from_created")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_pair_ts ON likes(from_user, to_user, created_ts, action)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_from_ts ON likes(from_user, created_ts, to_user)")
 
-    try:
-        cur.execute("ALTER TABLE users ADD COLUMN longitude REAL")
-    except sqlite3.OperationalError:
-        pass
 
-    conn.commit()
-    conn.close()
+def _migrate_likes_ts_index(cur):
+    """
+    Индекс с created_ts первым столбцом: rebuild_exclusion_index читает только окно
+    кулдауна, а не всю историю. from_user и to_user в нем же, поэтому фильтр шарда
+    проверяется по индексу, до чтения строк таблицы.
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_likes_ts ON likes(created_ts, from_user, to_user)")
+
+
+# Порядок важен: миграция применяется один раз, номер записывается в schema_version.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, "users: столбцы name, latitude, longitude", _migrate_user_columns),
+    (2, "индексы likes, matches, users(target)", _migrate_hot_query_indexes),
+    (3, "likes(from_user, to_user, created_at, action) вместо idx_likes_pair", _migrate_likes_pair_created_index),
+    (4, "users.geocell и индекс по нему", _migrate_users_geocell),
+    (5, "таблица viewing_state", _migrate_viewing_state),
+    (6, "таблица fsm_state", _migrate_fsm_state),
+    (7, "таблица geocode_cache", _migrate_geocode_cache),
+    (8, "таблица likes_archive", _migrate_likes_archive),
+    (9, "likes.created_ts и индексы по нему вместо created_at", _migrate_likes_created_ts),
+    (10, "индекс likes(created_ts, from_user, to_user) для индекса исключений", _migrate_likes_ts_index),
+]
+
+
+def run_migrations():
+    """Применяет недостающие миграции, каждую в своей транзакции"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        current = cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            # BEGIN IMMEDIATE берет блокировку записи сразу, чтобы два процесса
+            # не применили одну и ту же миграцию параллельно.
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if cur.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                    conn.commit()
+                    continue
+                migrate(cur)
+                cur.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                            (version, description))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
 
 
 # ========== Пользователи ==========
+@dataclass(frozen=True)
+class Profile:
+    """
+    Неизменяемая анкета из кэша. Доступ по ключу profile['name'] оставлен,
+    чтобы код, написанный под sqlite3.Row, работал без изменений.
+    """
+    __slots__ = ("id", "telegram_id", "name", "gender", "age", "city",
+                 "latitude", "longitude", "target", "bio", "photo")
+    id: int
+    telegram_id: int
+    name: Optional[str]
+    gender: Optional[str]
+    age: Optional[int]
+    city: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    target: Optional[str]
+    bio: Optional[str]
+    photo: Optional[str]
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+
+PROFILE_COLUMNS = ", ".join(field.name for field in fields(Profile))
+
+# Кэш анкет по telegram_id; функции вызываются из пула потоков async_database
+_profile_cache = ReadThroughCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+# Анкеты пользователей других воркеров (SHARD): их правки этот процесс не
+# инвалидирует, поэтому они живут в кэше не дольше WORKER_PROFILE_CACHE_TTL
+_foreign_profile_cache = ReadThroughCache(maxsize=PROFILE_CACHE_SIZE, ttl=WORKER_PROFILE_CACHE_TTL)
+
+
+def _profile_cache_for(telegram_id):
+    if SHARD is None or telegram_id % SHARD[1] == SHARD[0]:
+        return _profile_cache
+    return _foreign_profile_cache
+
+
+def invalidate_profile(telegram_id):
+    """Убирает анкету из кэша; вызывается после коммита изменений users"""
+    _profile_cache.invalidate(telegram_id)
+    _foreign_profile_cache.invalidate(telegram_id)
+
+
+def clear_profile_cache():
+    """Очищает кэш анкет целиком (например, после переключения DB_PATH)"""
+    _profile_cache.clear()
+    _foreign_profile_cache.clear()
+
+
+def profile_cache_stats():
+    return _profile_cache.stats()
+
+
 def add_user(telegram_id, name, gender, age, city, target, bio, photo, latitude=None, longitude=None):
     # Normalize some fields and ensure age is stored as integer when possible.
     try:
@@ -98,409 +429,338 @@ def add_user(telegram_id, name, gender, age, city, target, bio, photo, latitude=
     except Exception:
         age_int = None
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-    INSERT OR REPLACE INTO users (telegram_id, name, gender, age, city, latitude, longitude, target, bio, photo)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (telegram_id, name, gender, age_int, city, latitude, longitude, target, bio, photo))
-    conn.commit()
-    conn.close()
+    # Upsert, а не INSERT OR REPLACE: REPLACE удаляет строку и выдает анкете новый
+    # users.id, а по id анкету знают индекс исключений и колоды кандидатов
+    with db_connection() as conn:
+        conn.execute("""
+        INSERT INTO users (telegram_id, name, gender, age, city, latitude, longitude, geocell, target, bio, photo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(telegram_id) DO UPDATE SET
+            name = excluded.name, gender = excluded.gender, age = excluded.age, city = excluded.city,
+            latitude = excluded.latitude, longitude = excluded.longitude, geocell = excluded.geocell,
+            target = excluded.target, bio = excluded.bio, photo = excluded.photo
+        """, (telegram_id, name, gender, age_int, city, latitude, longitude,
+              geocell_for(latitude, longitude), target, bio, photo))
+    invalidate_profile(telegram_id)
 
 
-def get_user_by_telegram_id(telegram_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-    user = cur.fetchone()
-    conn.close()
-    return user
+def get_user_by_telegram_id(telegram_id) -> Optional[Profile]:
+    cache = _profile_cache_for(telegram_id)
+    profile, epoch = cache.lookup(telegram_id)
+    if profile is not ReadThroughCache.MISSING:
+        return profile
+
+    with db_connection() as conn:
+        row = conn.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+    if row is None:
+        return None
+    profile = Profile(*row)
+    cache.store(telegram_id, profile, epoch)
+    return profile
 
 
 def update_user_field(telegram_id, field, value):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"UPDATE users SET {field} = ? WHERE telegram_id = ?", (value, telegram_id))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(f"UPDATE users SET {field} = ? WHERE telegram_id = ?", (value, telegram_id))
+        if field in ("latitude", "longitude"):
+            conn.execute("UPDATE users SET geocell = geocell(latitude, longitude) WHERE telegram_id = ?",
+                         (telegram_id,))
+    invalidate_profile(telegram_id)
 
 
 def update_user_coordinates(telegram_id, latitude, longitude):
     """Обновляет координаты пользователя"""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET latitude = ?, longitude = ? WHERE telegram_id = ?", 
-                (latitude, longitude, telegram_id))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET latitude = ?, longitude = ?, geocell = ? WHERE telegram_id = ?",
+                     (latitude, longitude, geocell_for(latitude, longitude), telegram_id))
+    invalidate_profile(telegram_id)
 
 
 # ========== Фильтры ==========
+# Пять целей знакомства из клавиатур; в кэше фильтров цели хранятся битовой маской
+TARGETS = ("Дружба", "Общение", "Отношения", "Ничего серьезного", "Свидания")
+TARGET_BITS = {target: 1 << i for i, target in enumerate(TARGETS)}
+
+
+def targets_to_mask(targets) -> int:
+    """Битовая маска целей; неизвестные названия пропускаются"""
+    mask = 0
+    for target in targets or ():
+        mask |= TARGET_BITS.get(target, 0)
+    return mask
+
+
+def mask_to_targets(mask) -> List[str]:
+    return [target for target in TARGETS if mask & TARGET_BITS[target]]
+
+
+@dataclass(frozen=True)
+class UserFilters:
+    """
+    Разобранные фильтры пользователя. filters['target_filters'] и
+    filters['distance_filter'] работают, как у прежнего словаря.
+    """
+    __slots__ = ("target_mask", "distance_filter")
+    target_mask: int
+    distance_filter: Optional[int]
+
+    @property
+    def target_filters(self) -> List[str]:
+        return mask_to_targets(self.target_mask)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"UserFilters(target_filters={self.target_filters!r}, distance_filter={self.distance_filter!r})"
+
+
+# Кэш фильтров по telegram_id. None (фильтров нет) тоже кэшируется: таких
+# пользователей большинство, и они спрашивают фильтры на каждом свайпе.
+_filter_cache = ReadThroughCache(maxsize=FILTER_CACHE_SIZE, ttl=FILTER_CACHE_TTL)
+
+
+def invalidate_filters(telegram_id):
+    _filter_cache.invalidate(telegram_id)
+
+
+def clear_filter_cache():
+    """Очищает кэш фильтров целиком (например, после переключения DB_PATH)"""
+    _filter_cache.clear()
+
+
+def filter_cache_stats():
+    return _filter_cache.stats()
+
+
+def _invalidates_filters(func):
+    """Сбрасывает кэш фильтров после функции сохранения, то есть уже после коммита"""
+    @functools.wraps(func)
+    def wrapper(telegram_id, *args, **kwargs):
+        try:
+            return func(telegram_id, *args, **kwargs)
+        finally:
+            invalidate_filters(telegram_id)
+    return wrapper
+
+
+# Таблицу user_filters создает init_db() при старте, поэтому функции ниже
+# не проверяют ее существование на каждом вызове.
+@_invalidates_filters
 def save_user_target_filters(telegram_id, target_filters: List[str]):
     """Сохраняет только фильтры по целям (Этап 1)"""
-    import json
-    
-    print(f"\n========== SAVE_USER_TARGET_FILTERS ==========")
-    print(f"DEBUG: Начало функции save_user_target_filters")
-    print(f"DEBUG: telegram_id = {telegram_id} (тип: {type(telegram_id)})")
-    print(f"DEBUG: target_filters = {target_filters} (тип: {type(target_filters)})")
+    logger.debug("save_user_target_filters: telegram_id=%r target_filters=%r", telegram_id, target_filters)
     
     if not isinstance(telegram_id, int):
-        print(f"ERROR: telegram_id должен быть int, получен {type(telegram_id)}")
+        logger.error("telegram_id должен быть int, получен %s", type(telegram_id))
         return False
     
     if not isinstance(target_filters, list):
-        print(f"ERROR: target_filters должен быть list, получен {type(target_filters)}")
+        logger.error("target_filters должен быть list, получен %s", type(target_filters))
         return False
     
     # Проверяем входные данные
     if not target_filters:
-        print("WARNING: target_filters пустой, используем все цели по умолчанию")
+        logger.warning("target_filters пустой, используем все цели по умолчанию")
         target_filters = ["Дружба", "Общение", "Отношения", "Ничего серьезного", "Свидания"]
     
     try:
         target_filters_json = json.dumps(target_filters, ensure_ascii=False)
-        print(f"DEBUG: target_filters_json = '{target_filters_json}'")
-    except Exception as e:
-        print(f"ERROR: Ошибка при преобразовании в JSON: {e}")
+    except Exception:
+        logger.exception("Ошибка при преобразовании целей в JSON")
         return False
     
     try:
-        print("DEBUG: Получаем соединение с базой данных...")
-        conn = get_connection()
-        cur = conn.cursor()
-        print("DEBUG: Соединение получено успешно")
+        with db_connection() as conn:
+            cur = conn.cursor()
         
-        # Проверяем, существует ли таблица
-        print("DEBUG: Проверяем существование таблицы user_filters...")
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
+            # Проверяем, существует ли запись
+            cur.execute("SELECT id, target_filters, distance_filter FROM user_filters WHERE telegram_id = ?", (telegram_id,))
+            existing = cur.fetchone()
         
-        if not table_exists:
-            print("ERROR: Таблица user_filters НЕ СУЩЕСТВУЕТ!")
-            print("ERROR: Необходимо запустить /create_filters_table или reset_db.py")
-            conn.close()
-            return False
+            if existing:
+                # Обновляем только цели, расстояние не трогаем
+                cur.execute("""
+                UPDATE user_filters 
+                SET target_filters = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+                """, (target_filters_json, telegram_id))
+                operation = "UPDATE"
+            else:
+                # Создаем новую запись только с целями
+                cur.execute("""
+                INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
+                VALUES (?, ?, NULL, CURRENT_TIMESTAMP)
+                """, (telegram_id, target_filters_json))
+                operation = "INSERT"
         
-        print("DEBUG: Таблица user_filters существует ✓")
+            # Проверяем количество затронутых строк
+            rows_affected = cur.rowcount
+            logger.debug("%s целей для %s: затронуто строк %s", operation, telegram_id, rows_affected)
         
-        # Проверяем, существует ли запись
-        print(f"DEBUG: Ищем существующую запись для telegram_id={telegram_id}...")
-        cur.execute("SELECT id, target_filters, distance_filter FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        existing = cur.fetchone()
-        
-        if existing:
-            existing_dict = dict(existing)
-            print(f"DEBUG: Найдена существующая запись: {existing_dict}")
-            
-            # Обновляем только цели, расстояние не трогаем
-            print("DEBUG: Выполняем UPDATE...")
-            cur.execute("""
-            UPDATE user_filters 
-            SET target_filters = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE telegram_id = ?
-            """, (target_filters_json, telegram_id))
-            operation = "UPDATE"
-        else:
-            print("DEBUG: Записи не найдено, создаем новую...")
-            # Создаем новую запись только с целями
-            cur.execute("""
-            INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
-            VALUES (?, ?, NULL, CURRENT_TIMESTAMP)
-            """, (telegram_id, target_filters_json))
-            operation = "INSERT"
-        
-        # Проверяем количество затронутых строк
-        rows_affected = cur.rowcount
-        print(f"DEBUG: Операция {operation}: затронуто строк = {rows_affected}")
-        
-        if rows_affected == 0:
-            print("ERROR: Ни одна строка не была изменена!")
-            conn.close()
-            return False
-        
-        # Коммитим изменения
-        print("DEBUG: Выполняем COMMIT...")
-        conn.commit()
-        print("DEBUG: COMMIT выполнен успешно ✓")
-        
-        # Проверяем, что данные действительно сохранились
-        print("DEBUG: Проверяем результат сохранения...")
-        cur.execute("SELECT * FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        saved_record = cur.fetchone()
-        
-        if saved_record:
-            saved_dict = dict(saved_record)
-            print(f"DEBUG: Проверка после сохранения: {saved_dict}")
-            
-            # Дополнительно проверяем JSON
-            try:
-                parsed_targets = json.loads(saved_record['target_filters'])
-                print(f"DEBUG: Распарсенные цели: {parsed_targets}")
-                
-                if parsed_targets == target_filters:
-                    print("DEBUG: Данные сохранены корректно ✓")
-                else:
-                    print(f"ERROR: Данные не совпадают! Ожидалось: {target_filters}, получено: {parsed_targets}")
-                    conn.close()
-                    return False
-            except Exception as e:
-                print(f"ERROR: Ошибка парсинга JSON: {e}")
-                conn.close()
+            if rows_affected == 0:
+                logger.error("Цели пользователя %s не сохранены: ни одна строка не изменена", telegram_id)
                 return False
-        else:
-            print("ERROR: Запись не найдена после сохранения!")
-            conn.close()
-            return False
-        
-        conn.close()
-        print(f"DEBUG: Цели сохранены успешно для пользователя {telegram_id} ✓")
-        print(f"========== КОНЕЦ SAVE_USER_TARGET_FILTERS ==========\n")
-        return True
         
-    except Exception as e:
-        print(f"ERROR: Критическая ошибка при сохранении целей: {e}")
-        import traceback
-        traceback.print_exc()
-        print(f"========== ОШИБКА В SAVE_USER_TARGET_FILTERS ==========\n")
+            # Проверка записанной строки только для отладки: при выключенном DEBUG лишнего запроса нет
+            if logger.isEnabledFor(logging.DEBUG):
+                _log_filters_row(cur, telegram_id)
+            return True
+
+    except Exception:
+        logger.exception("Критическая ошибка при сохранении целей пользователя %s", telegram_id)
         return False
 
 
+@_invalidates_filters
 def save_user_distance_filter(telegram_id, distance_km: int):
     """Сохраняет фильтр по расстоянию (Этап 2)"""
-    print(f"DEBUG: save_user_distance_filter вызвана для пользователя {telegram_id}")
-    print(f"  distance_km: {distance_km}")
-    print(f"  type(distance_km): {type(distance_km)}")
+    logger.debug("save_user_distance_filter: telegram_id=%r distance_km=%r", telegram_id, distance_km)
     
     distance_value = distance_km if distance_km is not None else None
-    print(f"DEBUG: distance_value для сохранения: {distance_value}")
     
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Проверяем, существует ли таблица
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
-        if not table_exists:
-            print("ERROR: Таблица user_filters НЕ СУЩЕСТВУЕТ!")
-            conn.close()
-            return False
-        
-        # Проверяем, существует ли запись
-        cur.execute("SELECT id, target_filters, distance_filter FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        existing = cur.fetchone()
+        with db_connection() as conn:
+            cur = conn.cursor()
         
-        if existing:
-            print(f"DEBUG: Найдена существующая запись: {dict(existing)}")
-            # Обновляем расстояние, цели не трогаем
-            cur.execute("""
-            UPDATE user_filters 
-            SET distance_filter = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE telegram_id = ?
-            """, (distance_value, telegram_id))
-            print(f"DEBUG: Выполнен UPDATE расстояния для пользователя {telegram_id}")
-        else:
-            print("WARNING: Записи не найдено! Создаем новую только с расстоянием")
-            # Создаем новую запись только с расстоянием (это странная ситуация)
-            cur.execute("""
-            INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
-            VALUES (?, NULL, ?, CURRENT_TIMESTAMP)
-            """, (telegram_id, distance_value))
-            print(f"DEBUG: Выполнен INSERT только с расстоянием для пользователя {telegram_id}")
+            # Проверяем, существует ли запись
+            cur.execute("SELECT id, target_filters, distance_filter FROM user_filters WHERE telegram_id = ?", (telegram_id,))
+            existing = cur.fetchone()
         
-        # Проверяем количество затронутых строк
-        rows_affected = cur.rowcount
-        print(f"DEBUG: Количество затронутых строк: {rows_affected}")
+            if existing:
+                # Обновляем расстояние, цели не трогаем
+                cur.execute("""
+                UPDATE user_filters 
+                SET distance_filter = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+                """, (distance_value, telegram_id))
+            else:
+                logger.warning("Фильтров пользователя %s нет, создаем запись только с расстоянием", telegram_id)
+                # Создаем новую запись только с расстоянием (это странная ситуация)
+                cur.execute("""
+                INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
+                VALUES (?, NULL, ?, CURRENT_TIMESTAMP)
+                """, (telegram_id, distance_value))
         
-        if rows_affected == 0:
-            print("ERROR: Ни одна строка не была изменена!")
-            conn.close()
-            return False
+            # Проверяем количество затронутых строк
+            rows_affected = cur.rowcount
+            logger.debug("Расстояние для %s: затронуто строк %s", telegram_id, rows_affected)
         
-        conn.commit()
-        print("DEBUG: COMMIT расстояния выполнен успешно")
-        
-        # Проверяем результат
-        cur.execute("SELECT * FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        saved_record = cur.fetchone()
-        if saved_record:
-            print(f"DEBUG: Проверка после сохранения расстояния: {dict(saved_record)}")
-        else:
-            print("ERROR: Запись не найдена после сохранения расстояния!")
-            conn.close()
-            return False
-        
-        conn.close()
-        print(f"DEBUG: Расстояние сохранено успешно для пользователя {telegram_id}")
-        return True
+            if rows_affected == 0:
+                logger.error("Расстояние пользователя %s не сохранено: ни одна строка не изменена", telegram_id)
+                return False
         
-    except Exception as e:
-        print(f"ERROR: Критическая ошибка при сохранении расстояния: {e}")
-        import traceback
-        traceback.print_exc()
+            if logger.isEnabledFor(logging.DEBUG):
+                _log_filters_row(cur, telegram_id)
+            return True
+
+    except Exception:
+        logger.exception("Критическая ошибка при сохранении расстояния пользователя %s", telegram_id)
         return False
 
 
+@_invalidates_filters
 def save_user_filters(telegram_id, target_filters: List[str], distance_km: int):
     """Сохраняет фильтры пользователя (полная версия для обратной совместимости)"""
-    import json
-    
-    print(f"DEBUG: save_user_filters вызвана с параметрами:")
-    print(f"  telegram_id: {telegram_id}")
-    print(f"  target_filters: {target_filters}")
-    print(f"  distance_km: {distance_km}")
+    logger.debug("save_user_filters: telegram_id=%r target_filters=%r distance_km=%r",
+                 telegram_id, target_filters, distance_km)
     
     # Если передан None для distance_km, сохраняем как NULL
     distance_value = distance_km if distance_km is not None else None
     target_filters_json = json.dumps(target_filters, ensure_ascii=False) if target_filters else None
     
-    print(f"DEBUG: Подготовленные данные для сохранения:")
-    print(f"  target_filters_json: {target_filters_json}")
-    print(f"  distance_value: {distance_value}")
-    
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Проверяем, существует ли таблица
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
-        if not table_exists:
-            print("ERROR: Таблица user_filters не существует!")
-            conn.close()
-            return
-        
-        # Проверяем, существует ли запись
-        cur.execute("SELECT id FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        existing = cur.fetchone()
+        with db_connection() as conn:
+            cur = conn.cursor()
         
-        if existing:
-            # Обновляем существующую запись
-            print(f"DEBUG: Обновляем существующую запись (id: {existing['id']})")
-            cur.execute("""
-            UPDATE user_filters 
-            SET target_filters = ?, distance_filter = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE telegram_id = ?
-            """, (target_filters_json, distance_value, telegram_id))
-        else:
-            # Создаем новую запись
-            print("DEBUG: Создаем новую запись")
-            cur.execute("""
-            INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """, (telegram_id, target_filters_json, distance_value))
+            # Проверяем, существует ли запись
+            cur.execute("SELECT id FROM user_filters WHERE telegram_id = ?", (telegram_id,))
+            existing = cur.fetchone()
         
-        # Проверяем количество затронутых строк
-        rows_affected = cur.rowcount
-        print(f"DEBUG: Количество затронутых строк: {rows_affected}")
+            if existing:
+                # Обновляем существующую запись
+                cur.execute("""
+                UPDATE user_filters 
+                SET target_filters = ?, distance_filter = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+                """, (target_filters_json, distance_value, telegram_id))
+            else:
+                # Создаем новую запись
+                cur.execute("""
+                INSERT INTO user_filters (telegram_id, target_filters, distance_filter, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                """, (telegram_id, target_filters_json, distance_value))
         
-        conn.commit()
-        print("DEBUG: Транзакция зафиксирована")
-        
-        # Проверяем, что сохранилось
-        cur.execute("SELECT * FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        saved_filter = cur.fetchone()
-        if saved_filter:
-            print(f"DEBUG: Сохраненные фильтры: {dict(saved_filter)}")
-        else:
-            print("ERROR: Фильтры не найдены после сохранения!")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"ERROR: Ошибка при сохранении фильтров: {e}")
-        import traceback
-        traceback.print_exc()
+            if logger.isEnabledFor(logging.DEBUG):
+                _log_filters_row(cur, telegram_id)
 
+    except Exception:
+        logger.exception("Ошибка при сохранении фильтров пользователя %s", telegram_id)
 
-def get_user_filters(telegram_id):
-    """Получает фильтры пользователя"""
-    import json
-    
-    print(f"DEBUG: get_user_filters вызвана для пользователя {telegram_id}")
-    
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Проверяем, существует ли таблица
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
-        if not table_exists:
-            print("ERROR: Таблица user_filters не существует!")
-            conn.close()
+
+def _log_filters_row(cur, telegram_id):
+    """Пишет в DEBUG строку user_filters, как она лежит в базе после сохранения"""
+    cur.execute("SELECT * FROM user_filters WHERE telegram_id = ?", (telegram_id,))
+    saved_record = cur.fetchone()
+    if saved_record:
+        logger.debug("Фильтры пользователя %s после сохранения: %s", telegram_id, dict(saved_record))
+    else:
+        logger.error("Фильтры пользователя %s не найдены после сохранения", telegram_id)
+
+
+def get_user_filters(telegram_id) -> Optional[UserFilters]:
+    """Фильтры пользователя из кэша или базы; None, если фильтры не настроены"""
+    filters, epoch = _filter_cache.lookup(telegram_id)
+    if filters is not ReadThroughCache.MISSING:
+        return filters
+
+    with db_connection() as conn:
+        row = conn.execute("SELECT target_filters, distance_filter FROM user_filters WHERE telegram_id = ?",
+                           (telegram_id,)).fetchone()
+
+    filters = None
+    if row:
+        try:
+            # Парсим JSON с фильтрами целей
+            targets = json.loads(row['target_filters']) if row['target_filters'] else []
+        except json.JSONDecodeError as e:
+            logger.error("Ошибка парсинга JSON фильтров пользователя %s: %s", telegram_id, e)
             return None
-        
-        cur.execute("SELECT * FROM user_filters WHERE telegram_id = ?", (telegram_id,))
-        filters = cur.fetchone()
-        conn.close()
-        
-        print(f"DEBUG: Загруженные фильтры для пользователя {telegram_id}: {dict(filters) if filters else 'Нет данных'}")
-        
-        if filters:
-            try:
-                # Парсим JSON с фильтрами целей
-                target_filters = []
-                if filters['target_filters']:
-                    target_filters = json.loads(filters['target_filters'])
-                
-                result = {
-                    'target_filters': target_filters,
-                    'distance_filter': filters['distance_filter']
-                }
-                print(f"DEBUG: Обработанные фильтры: {result}")
-                return result
-            except json.JSONDecodeError as e:
-                print(f"ERROR: Ошибка парсинга JSON фильтров: {e}")
-                return None
-        
-        return None
-        
-    except Exception as e:
-        print(f"ERROR: Ошибка при получении фильтров: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        filters = UserFilters(targets_to_mask(targets), row['distance_filter'])
+
+    _filter_cache.store(telegram_id, filters, epoch)
+    return filters
 
 
 def debug_filters_table():
     """Отладочная функция для проверки таблицы фильтров"""
-    print("DEBUG: Проверка таблицы user_filters")
+    logger.info("Проверка таблицы user_filters")
     
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Проверяем, существует ли таблица
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
+        with db_connection() as conn:
+            cur = conn.cursor()
         
-        if not table_exists:
-            print("ERROR: Таблица user_filters НЕ СУЩЕСТВУЕТ!")
-            conn.close()
-            return
+            # Проверяем, существует ли таблица
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
+            table_exists = cur.fetchone()
         
-        # Проверяем структуру таблицы
-        cur.execute("PRAGMA table_info(user_filters)")
-        columns = cur.fetchall()
-        print("DEBUG: Структура таблицы user_filters:")
-        for col in columns:
-            print(f"  {dict(col)}")
+            if not table_exists:
+                logger.error("Таблица user_filters НЕ СУЩЕСТВУЕТ!")
+                return
         
-        # Показываем все записи
-        cur.execute("SELECT * FROM user_filters ORDER BY updated_at DESC")
-        all_filters = cur.fetchall()
-        print(f"DEBUG: Всего записей в user_filters: {len(all_filters)}")
-        for i, f in enumerate(all_filters):
-            print(f"  {i+1}. {dict(f)}")
-        
-        conn.close()
+            # Проверяем структуру таблицы
+            cur.execute("PRAGMA table_info(user_filters)")
+            columns = cur.fetchall()
+            logger.info("Структура таблицы user_filters:\n%s", "\n".join(f"  {dict(col)}" for col in columns))
         
-    except Exception as e:
-        print(f"ERROR: Ошибка при отладке таблицы: {e}")
-        import traceback
-        traceback.print_exc()
+            # Показываем все записи
+            cur.execute("SELECT * FROM user_filters ORDER BY updated_at DESC")
+            all_filters = cur.fetchall()
+            logger.info("Всего записей в user_filters: %s\n%s", len(all_filters),
+                        "\n".join(f"  {i + 1}. {dict(f)}" for i, f in enumerate(all_filters)))
+
+    except Exception:
+        logger.exception("Ошибка при отладке таблицы фильтров")
 
 
 # ========== Функции расчета расстояния ==========
@@ -527,157 +787,728 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return c * r
 
 
+# Кандидаты ближе этой относительной погрешности к порогу перепроверяются скалярной
+# calculate_distance: векторные sin/cos могут отличаться от math в последнем знаке,
+# а решение "показать/не показать" должно совпадать бит в бит.
+DISTANCE_RECHECK_TOLERANCE = 1e-9
+
+
+def calculate_distances(lat, lon, latitudes, longitudes):
+    """
+    Расстояния в километрах от точки (lat, lon) до массивов координат за один проход.
+    Как и в calculate_distance, отсутствующие (None/0) координаты дают бесконечность.
+    """
+    if np is None:
+        return [calculate_distance(lat, lon, lat2, lon2) for lat2, lon2 in zip(latitudes, longitudes)]
+
+    lats = np.asarray(latitudes, dtype=np.float64)
+    lons = np.asarray(longitudes, dtype=np.float64)
+    if not (lat and lon):
+        return np.full(lats.shape, np.inf)
+
+    # None превращается в NaN; и NaN, и 0 считаются неизвестными координатами
+    missing = (lats == 0) | (lons == 0) | np.isnan(lats) | np.isnan(lons)
+
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    distances = 2 * np.arcsin(np.sqrt(a)) * 6371
+    distances[missing] = np.inf
+    return distances
+
+
+def within_distance(lat, lon, latitudes, longitudes, distance_km):
+    """
+    Маска "расстояние <= distance_km" для массивов координат.
+    Совпадает с поэлементным calculate_distance(...) <= distance_km.
+    """
+    if np is None:
+        return [d <= distance_km for d in calculate_distances(lat, lon, latitudes, longitudes)]
+
+    distances = calculate_distances(lat, lon, latitudes, longitudes)
+    mask = distances <= distance_km
+    borderline = np.flatnonzero(np.abs(distances - distance_km) <= DISTANCE_RECHECK_TOLERANCE * distance_km)
+    for i in borderline:
+        mask[i] = calculate_distance(lat, lon, latitudes[i], longitudes[i]) <= distance_km
+    return mask
+
+
+# ========== Сетка для фильтра по расстоянию ==========
+# Земля делится на ячейки GEOCELL_DEG x GEOCELL_DEG градусов. Номер ячейки хранится
+# в users.geocell, и фильтр по расстоянию становится списком ячеек вокруг
+# пользователя: idx_users_geocell(geocell, latitude, longitude) читает только их и
+# сразу отсекает анкеты вне описанного прямоугольника. Точное расстояние потом
+# проверяется гаверсинусом только для оставшихся анкет.
+GEOCELL_DEG = 0.2
+GEOCELL_COLS = int(round(360 / GEOCELL_DEG))
+GEOCELL_ROWS = int(round(180 / GEOCELL_DEG))
+GEOCELL_MAX_CELLS = 400
+EARTH_RADIUS_KM = 6371
+
+
+def _geocell_row(lat):
+    return min(GEOCELL_ROWS - 1, max(0, int(math.floor((lat + 90) / GEOCELL_DEG))))
+
+
+def _geocell_col(lon):
+    return int(math.floor((lon + 180) / GEOCELL_DEG)) % GEOCELL_COLS
+
+
+def geocell_for(latitude, longitude):
+    """Номер ячейки сетки для координат или None, если координат нет"""
+    if latitude is None or longitude is None:
+        return None
+    return _geocell_row(latitude) * GEOCELL_COLS + _geocell_col(longitude)
+
+
+def distance_bounds(latitude, longitude, distance_km):
+    """
+    Прямоугольник в градусах, покрывающий круг distance_km вокруг точки:
+    (lat_lo, lat_hi, [(lon_lo, lon_hi), ...]). Долготных отрезков два, если круг
+    пересекает 180-й меридиан, и один на весь круг, если задевает полюс.
+    """
+    d = distance_km / EARTH_RADIUS_KM
+    # Небольшой запас, чтобы округление не выкинуло точку на границе
+    pad = 1e-6
+    dlat = math.degrees(d) + pad
+    lat_lo, lat_hi = max(-90.0, latitude - dlat), min(90.0, latitude + dlat)
+
+    # Максимальное отклонение по долготе для точек круга
+    cos_lat = math.cos(math.radians(latitude))
+    if math.sin(d) >= cos_lat:
+        return lat_lo, lat_hi, [(-180.0, 180.0)]
+    dlon = math.degrees(math.asin(math.sin(d) / cos_lat)) + pad
+    if dlon >= 180:
+        return lat_lo, lat_hi, [(-180.0, 180.0)]
+
+    lon_lo, lon_hi = longitude - dlon, longitude + dlon
+    if lon_lo < -180:
+        return lat_lo, lat_hi, [(lon_lo + 360, 180.0), (-180.0, lon_hi)]
+    if lon_hi > 180:
+        return lat_lo, lat_hi, [(lon_lo, 180.0), (-180.0, lon_hi - 360)]
+    return lat_lo, lat_hi, [(lon_lo, lon_hi)]
+
+
+def geocells_around(latitude, longitude, distance_km):
+    """
+    Номера ячеек, покрывающих круг distance_km вокруг точки, или None, если их
+    больше GEOCELL_MAX_CELLS (круг у полюса) и выгоднее обойтись прямоугольником.
+    """
+    lat_lo, lat_hi, lon_spans = distance_bounds(latitude, longitude, distance_km)
+    col_spans = []
+    for lon_lo, lon_hi in lon_spans:
+        col_lo, col_hi = _geocell_col(lon_lo), _geocell_col(lon_hi)
+        # lon = 180 попадает в столбец 0, поэтому правый край отрезка берем как последний столбец
+        if lon_hi >= 180:
+            col_hi = GEOCELL_COLS - 1
+        col_spans.append((col_lo, col_hi))
+
+    rows = range(_geocell_row(lat_lo), _geocell_row(lat_hi) + 1)
+    if len(rows) * sum(hi - lo + 1 for lo, hi in col_spans) > GEOCELL_MAX_CELLS:
+        return None
+    return [
+        row * GEOCELL_COLS + col
+        for row in rows
+        for col_lo, col_hi in col_spans
+        for col in range(col_lo, col_hi + 1)
+    ]
+
+
+# ========== Случайная выборка анкет ==========
+# Вместо ORDER BY RANDOM() по всей таблице берутся случайные id из [MIN(id), MAX(id)]
+# и проверяются одним запросом по первичному ключу. Проба, попавшая в дырку или не
+# прошедшая фильтры, отбрасывается, поэтому каждая подходящая анкета равновероятна.
+# Если фильтры отсекают почти все пробы, анкета выбирается из точного списка
+# кандидатов, который читается без сортировки и без полных строк.
+PROBE_BATCH = 16
+PROBE_ROUNDS = 2
+
+# Анкеты, которые пользователь лайкал/дизлайкал за последние 9 дней, не показываются.
+# Параметры RECENT_SWIPE: from_user и начало окна cooldown_start().
+COOLDOWN_DAYS = 9
+COOLDOWN_SECONDS = COOLDOWN_DAYS * 86400
+RECENT_SWIPE = """
+    SELECT 1 FROM likes
+    WHERE likes.from_user = ?
+      AND likes.to_user = users.telegram_id
+      AND likes.created_ts > ?
+"""
+COOLDOWN_CONDITION = f"NOT EXISTS ({RECENT_SWIPE})"
+
+
+def cooldown_start(now=None):
+    """Секунды Unix: свайпы позже этого момента еще действуют"""
+    return int(time.time() if now is None else now) - COOLDOWN_SECONDS
+
+
+def _candidate_conditions(current_user_id, target_filters: List[str] = None, target_index=True, cooldown=True):
+    """
+    Условия WHERE и параметры для анкет, доступных пользователю.
+    target_index=False запрещает планировщику idx_users_target (унарный +), когда
+    есть более узкий индекс, например ячейки сетки при фильтре по расстоянию.
+    cooldown=False - кулдаун проверяет индекс исключений, а не SQL.
+    """
+    conditions = ["users.telegram_id != ?"]
+    params = [current_user_id]
+
+    if cooldown:
+        conditions.append(COOLDOWN_CONDITION)
+        params.extend((current_user_id, cooldown_start()))
+        # Свайпы из буфера еще не в таблице likes, но кулдаун на них уже действует
+        buffered = pending_like_targets(current_user_id)
+        if buffered:
+            placeholders = ','.join(['?' for _ in buffered])
+            conditions.append(f"users.telegram_id NOT IN ({placeholders})")
+            params.extend(buffered)
+
+    if target_filters:
+        placeholders = ','.join(['?' for _ in target_filters])
+        column = "users.target" if target_index else "+users.target"
+        conditions.append(f"{column} IN ({placeholders})")
+        params.extend(target_filters)
+
+    return conditions, params
+
+
+def _sample_users(cur, conditions, params, k=1, accept=None, seen=None):
+    """
+    Возвращает до k разных случайных анкет, подходящих под conditions.
+    accept - дополнительная проверка на стороне Python: получает список строк,
+    в которых есть как минимум id, latitude и longitude, и возвращает маску.
+    seen(cur, ids) - множество id из ids, которые пользователь уже свайпал
+    (индекс исключений); такие пробы отбрасываются до запроса.
+    """
+    # MIN и MAX в одном SELECT сканируют таблицу, отдельные подзапросы берут края индекса
+    lo, hi = cur.execute("SELECT (SELECT MIN(id) FROM users), (SELECT MAX(id) FROM users)").fetchone()
+    if lo is None:
+        return []
+
+    where = " AND ".join(conditions)
+    chosen = {}
+    batch = max(PROBE_BATCH, 2 * k)
+
+    for _ in range(PROBE_ROUNDS):
+        probes = [random.randint(lo, hi) for _ in range(batch)]
+        if seen:
+            excluded = seen(cur, probes)
+            probes = [probe for probe in probes if probe not in excluded]
+            if not probes:
+                continue
+        placeholders = ','.join(['?' for _ in probes])
+        cur.execute(f"SELECT * FROM users WHERE id IN ({placeholders}) AND {where}", probes + params)
+        rows = cur.fetchall()
+        if accept and rows:
+            rows = [row for row, ok in zip(rows, accept(rows)) if ok]
+        rows = {row['id']: row for row in rows}
+
+        # Пробы принимаются в порядке генерации, как при последовательных попытках
+        for probe in probes:
+            row = rows.get(probe)
+            if row is None or probe in chosen:
+                continue
+            chosen[probe] = row
+            if len(chosen) == k:
+                return list(chosen.values())
+
+    # Пробы почти не попадают: выбираем из точного списка оставшихся кандидатов
+    cur.execute(f"SELECT id, latitude, longitude FROM users WHERE {where}", params)
+    rows = cur.fetchall()
+    if accept and rows:
+        rows = [row for row, ok in zip(rows, accept(rows)) if ok]
+    candidates = [row['id'] for row in rows if row['id'] not in chosen]
+    if seen and candidates:
+        excluded = seen(cur, candidates)
+        candidates = [user_id for user_id in candidates if user_id not in excluded]
+    picked = random.sample(candidates, min(k - len(chosen), len(candidates)))
+    if picked:
+        placeholders = ','.join(['?' for _ in picked])
+        cur.execute(f"SELECT * FROM users WHERE id IN ({placeholders})", picked)
+        rows = {row['id']: row for row in cur.fetchall()}
+        chosen.update((user_id, rows[user_id]) for user_id in picked if user_id in rows)
+
+    return list(chosen.values())
+
+
+# ========== Индекс исключений ==========
+# Кто кого свайпал за окно кулдауна (exclusion.py). Пока индекс не построен,
+# кулдаун проверяет COOLDOWN_CONDITION; после rebuild_exclusion_index() его
+# пополняет add_like, а пробы отсеиваются в памяти до запроса к базе.
+_exclusion = None
+# Свайпы окна кулдауна с users.id анкеты по idx_likes_ts; параметр - cooldown_start()
+EXCLUSION_SCAN = """
+SELECT likes.from_user, users.id, likes.created_ts
+FROM likes JOIN users ON users.telegram_id = likes.to_user
+WHERE likes.created_ts > ?
+"""
+# То же для воркера: параметры - cooldown_start(), число воркеров, номер воркера
+EXCLUSION_SCAN_SHARD = EXCLUSION_SCAN + "  AND likes.from_user % ? = ?\n"
+
+
+def rebuild_exclusion_index(shard=None):
+    """
+    Строит индекс по likes за окно кулдауна и включает его.
+    Свайпы в буфере и в записи учитываются, пока add_like ждет блокировку.
+    shard=(номер, всего) - только свайпы пользователей с telegram_id % всего == номер.
+    """
+    global _exclusion
+    index = exclusion.ExclusionIndex(COOLDOWN_SECONDS)
+    if shard is None:
+        query, params = EXCLUSION_SCAN, (cooldown_start(),)
+    else:
+        query, params = EXCLUSION_SCAN_SHARD, (cooldown_start(), shard[1], shard[0])
+    with _likes_lock:
+        with db_connection() as conn:
+            rows = conn.execute(query, params)
+            for from_user, user_id, timestamp in rows:
+                index.add(from_user, user_id, timestamp)
+            buffered = [like for like in _likes_in_flight + _like_buffer
+                        if shard is None or like[0] % shard[1] == shard[0]]
+            if buffered:
+                targets = list({to_user for _, to_user, _, _ in buffered})
+                placeholders = ','.join(['?' for _ in targets])
+                ids = dict(conn.execute(
+                    f"SELECT telegram_id, id FROM users WHERE telegram_id IN ({placeholders})", targets
+                ).fetchall())
+                for from_user, to_user, _, created_ts in buffered:
+                    if to_user in ids:
+                        index.add(from_user, ids[to_user], created_ts)
+        _exclusion = index
+    stats = index.stats()
+    logger.info("Индекс исключений: %s пользователей, %s свайпов, %.1f МБ",
+                stats["viewers"], stats["entries"], stats["bytes"] / 1e6)
+    return index
+
+
+def drop_exclusion_index():
+    """Выключает индекс: кулдаун снова проверяется запросом к likes"""
+    global _exclusion
+    _exclusion = None
+
+
+def exclusion_stats():
+    return _exclusion.stats() if _exclusion is not None else None
+
+
+def _seen_filter(current_user_id):
+    """Проверка seen для _sample_users или None, если индекс выключен"""
+    index = _exclusion
+    if index is None:
+        return None
+
+    def seen(cur, ids):
+        now = time.time()
+        excluded, uncertain = index.check(current_user_id, ids, now)
+        if uncertain:
+            # День границы окна: часть его свайпов уже вне кулдауна, решает likes
+            excluded.update(_recently_swiped(cur, current_user_id, uncertain, now))
+        return excluded
+
+    return seen
+
+
+def _recently_swiped(cur, current_user_id, user_ids, now=None):
+    """users.id из user_ids, которые пользователь свайпал внутри окна кулдауна"""
+    placeholders = ','.join(['?' for _ in user_ids])
+    cur.execute(f"SELECT users.id FROM users WHERE users.id IN ({placeholders}) AND EXISTS ({RECENT_SWIPE})",
+                (*user_ids, current_user_id, cooldown_start(now)))
+    return {row[0] for row in cur.fetchall()}
+
+
 # ========== Просмотр анкет с фильтрацией ==========
-def get_filtered_profile(current_user_id, target_filters: List[str] = None, distance_km: int = None):
+def _filtered_conditions(cur, current_user_id, target_filters: List[str] = None, distance_km: int = None,
+                         cooldown=True):
     """
-    Возвращает случайную анкету с учетом фильтров пользователя
+    Условия WHERE, параметры и проверка accept для анкет под фильтры пользователя.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
     # Получаем данные текущего пользователя для расчета расстояния
     cur.execute("SELECT latitude, longitude FROM users WHERE telegram_id = ?", (current_user_id,))
     current_user_data = cur.fetchone()
-    
-    # Базовый запрос
-    query = """
-    SELECT * FROM users
-    WHERE telegram_id != ?
-      AND telegram_id NOT IN (
-          SELECT to_user FROM likes
-          WHERE from_user = ?
-            AND created_at > datetime('now', '-9 days')
-      )
-    """
-    params = [current_user_id, current_user_id]
-    
-    # Добавляем фильтр по целям
-    if target_filters and len(target_filters) > 0:
-        placeholders = ','.join(['?' for _ in target_filters])
-        query += f" AND target IN ({placeholders})"
-        params.extend(target_filters)
-    
-    query += " ORDER BY RANDOM()"
-    
-    cur.execute(query, params)
-    profiles = cur.fetchall()
-    
+
     # Фильтруем по расстоянию если указано
-    if distance_km and current_user_data and current_user_data['latitude'] and current_user_data['longitude']:
-        filtered_profiles = []
-        for profile in profiles:
-            if profile['latitude'] and profile['longitude']:
-                distance = calculate_distance(
-                    current_user_data['latitude'], current_user_data['longitude'],
-                    profile['latitude'], profile['longitude']
-                )
-                if distance <= distance_km:
-                    filtered_profiles.append(profile)
-            # Если у профиля нет координат, не показываем при фильтре по расстоянию
-        
-        profiles = filtered_profiles
-    
-    conn.close()
+    by_distance = bool(
+        distance_km and current_user_data and current_user_data['latitude'] and current_user_data['longitude']
+    )
+    conditions, params = _candidate_conditions(current_user_id, target_filters, target_index=not by_distance,
+                                               cooldown=cooldown)
+    if not by_distance:
+        return conditions, params, None
+
+    my_lat, my_lon = current_user_data['latitude'], current_user_data['longitude']
+
+    # Читаем только ячейки сетки вокруг пользователя, а внутри них сразу
+    # отбрасываем анкеты вне описанного прямоугольника
+    cells = geocells_around(my_lat, my_lon, distance_km)
+    if cells is not None:
+        placeholders = ','.join(['?' for _ in cells])
+        conditions.append(f"users.geocell IN ({placeholders})")
+        params.extend(cells)
+
+    lat_lo, lat_hi, lon_spans = distance_bounds(my_lat, my_lon, distance_km)
+    conditions.append("users.latitude BETWEEN ? AND ?")
+    params.extend((lat_lo, lat_hi))
+    conditions.append("(" + " OR ".join("users.longitude BETWEEN ? AND ?" for _ in lon_spans) + ")")
+    params.extend(bound for span in lon_spans for bound in span)
+
+    def accept(profiles):
+        # Профили без координат получают бесконечное расстояние и не показываются
+        return within_distance(
+            my_lat, my_lon,
+            [profile['latitude'] for profile in profiles],
+            [profile['longitude'] for profile in profiles],
+            distance_km,
+        )
+
+    return conditions, params, accept
+
+
+def get_filtered_profile(current_user_id, target_filters: List[str] = None, distance_km: int = None):
+    """
+    Возвращает случайную анкету с учетом фильтров пользователя
+    """
+    seen = _seen_filter(current_user_id)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        conditions, params, accept = _filtered_conditions(cur, current_user_id, target_filters, distance_km,
+                                                          cooldown=seen is None)
+        profiles = _sample_users(cur, conditions, params, accept=accept, seen=seen)
+
     return profiles[0] if profiles else None
 
 
+def get_candidate_ids(current_user_id, target_filters: List[str] = None, distance_km: int = None,
+                      limit: int = 20, exclude=()) -> List[int]:
+    """
+    telegram_id до limit случайных анкет под фильтры пользователя одним запросом.
+    exclude - telegram_id, которые уже лежат в колоде или показаны сейчас.
+    """
+    seen = _seen_filter(current_user_id)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        conditions, params, accept = _filtered_conditions(cur, current_user_id, target_filters, distance_km,
+                                                          cooldown=seen is None)
+        if exclude:
+            exclude = list(exclude)
+            placeholders = ','.join(['?' for _ in exclude])
+            conditions.append(f"users.telegram_id NOT IN ({placeholders})")
+            params.extend(exclude)
+        profiles = _sample_users(cur, conditions, params, k=limit, accept=accept, seen=seen)
+
+    return [profile['telegram_id'] for profile in profiles]
+
+
 def get_random_profile(current_user_id):
     """
     Возвращает случайную анкету, которую текущий пользователь не лайкал/дизлайкал за последние 9 дней.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    seen = _seen_filter(current_user_id)
+    with db_connection() as conn:
+        conditions, params = _candidate_conditions(current_user_id, cooldown=seen is None)
+        profiles = _sample_users(conn.cursor(), conditions, params, seen=seen)
+    return profiles[0] if profiles else None
 
-    cur.execute("""
-    SELECT * FROM users
-    WHERE telegram_id != ?
-      AND telegram_id NOT IN (
-          SELECT to_user FROM likes
-          WHERE from_user = ?
-            AND created_at > datetime('now', '-9 days')
-      )
-    ORDER BY RANDOM() LIMIT 1
-    """, (current_user_id, current_user_id))
-
-    profile = cur.fetchone()
-    conn.close()
-    return profile
 
+# ========== Текущая анкета просмотра ==========
+def set_viewing(user_id, target_id, now):
+    with db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO viewing_state (user_id, target_id, updated_at) VALUES (?, ?, ?)",
+                     (user_id, target_id, now))
 
-# ========== Лайки и матчи ==========
-def add_like(from_user, to_user, action="like"):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-    INSERT INTO likes (from_user, to_user, action)
-    VALUES (?, ?, ?)
-    """, (from_user, to_user, action))
-    conn.commit()
-    conn.close()
 
+def get_viewing(user_id, not_before):
+    """telegram_id показанной анкеты, если запись не старше not_before"""
+    with db_connection() as conn:
+        row = conn.execute("SELECT target_id FROM viewing_state WHERE user_id = ? AND updated_at > ?",
+                           (user_id, not_before)).fetchone()
+    return row['target_id'] if row else None
 
-def check_match(user1, user2):
+
+def pop_viewing(user_id, not_before):
+    with db_connection() as conn:
+        row = conn.execute("SELECT target_id, updated_at FROM viewing_state WHERE user_id = ?",
+                           (user_id,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM viewing_state WHERE user_id = ?", (user_id,))
+    return row['target_id'] if row and row['updated_at'] > not_before else None
+
+
+def trim_viewing(not_before, max_rows):
+    """Удаляет просроченные записи и самые старые сверх max_rows; возвращает число удаленных"""
+    with db_connection() as conn:
+        deleted = conn.execute("DELETE FROM viewing_state WHERE updated_at <= ?", (not_before,)).rowcount
+        deleted += conn.execute("""
+        DELETE FROM viewing_state WHERE user_id IN (
+            SELECT user_id FROM viewing_state ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+        )
+        """, (max_rows,)).rowcount
+    return deleted
+
+
+def count_viewing():
+    with db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM viewing_state").fetchone()[0]
+
+
+# ========== Состояния FSM ==========
+def load_fsm_record(key, now):
+    """(state, data) непросроченной записи FSM или None"""
+    with db_connection() as conn:
+        row = conn.execute("SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+    return (row['state'], row['data']) if row else None
+
+
+def save_fsm_records(upserts, deletes=()):
     """
-    Проверяет, есть ли взаимный лайк. Если да — создаёт запись в matches.
+    Пачка изменений FSM одной транзакцией.
+    upserts - (key, state, data, expires_at), deletes - ключи пустых записей.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        if upserts:
+            conn.executemany("INSERT OR REPLACE INTO fsm_state (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+                             upserts)
+        if deletes:
+            conn.executemany("DELETE FROM fsm_state WHERE key = ?", [(key,) for key in deletes])
 
-    cur.execute("""
-    SELECT 1 FROM likes
-    WHERE from_user = ? AND to_user = ? AND action = 'like'
-    """, (user1, user2))
-    like1 = cur.fetchone()
 
-    cur.execute("""
-    SELECT 1 FROM likes
-    WHERE from_user = ? AND to_user = ? AND action = 'like'
-    """, (user2, user1))
-    like2 = cur.fetchone()
-
-    if like1 and like2:
-        # Normalize ordering so one match row represents a pair.
-        a, b = sorted((user1, user2))
-        # Avoid duplicate match rows.
-        cur.execute("SELECT 1 FROM matches WHERE user1 = ? AND user2 = ?", (a, b))
-        exists = cur.fetchone()
-        if not exists:
-            cur.execute("INSERT INTO matches (user1, user2) VALUES (?, ?)", (a, b))
-            conn.commit()
-        conn.close()
-        return True
+def purge_fsm_records(now):
+    """Удаляет просроченные записи FSM; возвращает их число"""
+    with db_connection() as conn:
+        return conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (now,)).rowcount
+
+
+# ========== Кэш геокодирования ==========
+def get_cached_city(lat_key, lon_key):
+    with db_connection() as conn:
+        row = conn.execute("SELECT city FROM geocode_cache WHERE lat_key = ? AND lon_key = ?",
+                           (lat_key, lon_key)).fetchone()
+    return row['city'] if row else None
+
+
+def save_cached_city(lat_key, lon_key, city):
+    with db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO geocode_cache (lat_key, lon_key, city) VALUES (?, ?, ?)",
+                     (lat_key, lon_key, city))
+
+
+# ========== Обслуживание ==========
+# Строка likes больше ни на что не влияет, если свайп старше кулдауна и это
+# дизлайк или лайк, после которого та же пара лайкнула еще раз: check_match
+# достаточно одного лайка пары любой давности.
+EXPIRED_SWIPE = """
+likes.id > ? AND likes.id <= ? AND likes.created_ts <= ?
+AND (likes.action = 'dislike' OR EXISTS (
+    SELECT 1 FROM likes AS newer
+    WHERE newer.from_user = likes.from_user AND newer.to_user = likes.to_user
+      AND newer.action = 'like' AND newer.id > likes.id
+))
+"""
+
+
+def archive_expired_likes(after_id, scan_rows, archive=True):
+    """
+    Разбирает до scan_rows строк likes с id больше after_id одной транзакцией:
+    отжившие (EXPIRED_SWIPE) переносятся в likes_archive или, если archive=False,
+    удаляются. Возвращает (просмотрено, перенесено, id последней разобранной
+    строки, разобрана ли вся часть таблицы старше кулдауна).
+    """
+    with db_connection() as conn:
+        cutoff = cooldown_start()
+        rows = conn.execute("SELECT id, created_ts FROM likes WHERE id > ? ORDER BY id LIMIT ?",
+                            (after_id, scan_rows)).fetchall()
+        # id растут вместе с created_ts: первая строка моложе кулдауна - конец разбора
+        last_id, finished = after_id, len(rows) < scan_rows
+        for row in rows:
+            if row['created_ts'] > cutoff:
+                finished = True
+                break
+            last_id = row['id']
+        if last_id == after_id:
+            return len(rows), 0, after_id, finished
+        params = (after_id, last_id, cutoff)
+        if archive:
+            conn.execute(f"""
+            INSERT INTO likes_archive (id, from_user, to_user, action, created_at, created_ts)
+            SELECT id, from_user, to_user, action, created_at, created_ts FROM likes WHERE {EXPIRED_SWIPE}
+            """, params)
+        moved = conn.execute(f"DELETE FROM likes WHERE {EXPIRED_SWIPE}", params).rowcount
+    return len(rows), moved, last_id, finished
+
+
+def incremental_vacuum(pages):
+    """Возвращает ОС до pages свободных страниц файла базы; возвращает их число"""
+    with db_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # не INCREMENTAL
+            return 0
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() делает один шаг прагмы, то есть одну страницу; executescript доводит ее до конца
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def optimize_db(analysis_limit=1000):
+    """PRAGMA optimize: ANALYZE таблиц, статистика которых устарела, по выборке строк"""
+    with db_connection() as conn:
+        conn.executescript(f"PRAGMA analysis_limit={int(analysis_limit)}; PRAGMA optimize;")
+
+
+def vacuum():
+    """Полный VACUUM; переписывает весь файл и держит блокировку базы все это время"""
+    with db_connection() as conn:
+        conn.executescript("VACUUM")
+
+
+def database_stats():
+    with db_connection() as conn:
+        return {
+            "likes": conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0],
+            "likes_archive": conn.execute("SELECT COUNT(*) FROM likes_archive").fetchone()[0],
+            "pages": conn.execute("PRAGMA page_count").fetchone()[0],
+            "free_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+
+
+# ========== Буфер лайков ==========
+# Лайки и дизлайки копятся в памяти и пишутся пачкой через executemany, когда
+# набралось LIKES_BATCH_SIZE штук или самой старой записи больше LIKES_FLUSH_INTERVAL
+# секунд. Чтения, которые зависят от likes (кулдаун, проверка матча), учитывают буфер.
+# Снимок буфера берется до SQL-запроса: запись удаляется из _likes_in_flight только
+# после коммита, поэтому каждая строка видна либо в буфере, либо в таблице.
+_likes_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_like_buffer = []       # (from_user, to_user, action, created_ts)
+_likes_in_flight = []   # пачка, которая сейчас пишется в базу
+_like_buffer_started = 0.0
+# Базу делят несколько процессов-обработчиков (supervisor.py); буфер каждого не виден остальным
+MULTIPROCESS = False
+# (номер воркера, число воркеров): апдейты пользователя с telegram_id % числу == номеру
+# приходят только в этот процесс. None - процесс один
+SHARD = None
 
-    conn.close()
-    return False
+
+def _buffered_likes():
+    with _likes_lock:
+        return _likes_in_flight + _like_buffer
+
+
+def pending_like_targets(from_user):
+    """to_user из еще не записанных свайпов пользователя"""
+    return [to_user for user, to_user, _, _ in _buffered_likes() if user == from_user]
+
+
+def _pending_like(from_user, to_user):
+    return any(
+        user == from_user and target == to_user and action == 'like'
+        for user, target, action, _ in _buffered_likes()
+    )
+
+
+def flush_likes():
+    """Записывает буфер лайков одной транзакцией; возвращает число записанных строк"""
+    global _like_buffer, _likes_in_flight
+    # Пачки пишутся по одной, иначе вторая могла бы закоммититься раньше первой
+    with _flush_lock:
+        with _likes_lock:
+            if not _like_buffer:
+                return 0
+            _likes_in_flight, _like_buffer = _like_buffer, []
+        batch = _likes_in_flight
+        try:
+            with db_connection() as conn:
+                # created_at в формате CURRENT_TIMESTAMP из того же момента, что и created_ts
+                conn.executemany("""
+                INSERT INTO likes (from_user, to_user, action, created_at, created_ts)
+                VALUES (?1, ?2, ?3, datetime(?4, 'unixepoch'), ?4)
+                """, batch)
+        except BaseException:
+            # Не теряем свайпы: вернем пачку в начало буфера до следующей попытки
+            with _likes_lock:
+                _like_buffer = batch + _like_buffer
+                _likes_in_flight = []
+            raise
+        with _likes_lock:
+            _likes_in_flight = []
+        return len(batch)
+
+
+# Скрипты, которые не вызывают flush_likes() сами, не должны терять свайпы при выходе
+atexit.register(flush_likes)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_inherited_state)
+
+
+# ========== Лайки и матчи ==========
+def add_like(from_user, to_user, action="like"):
+    global _like_buffer_started
+    timestamp = time.time()
+    now = time.monotonic()
+    with _likes_lock:
+        if not _like_buffer:
+            _like_buffer_started = now
+        _like_buffer.append((from_user, to_user, action, int(timestamp)))
+        due = len(_like_buffer) >= LIKES_BATCH_SIZE or now - _like_buffer_started >= LIKES_FLUSH_INTERVAL
+    # Свайп уже в буфере: если индекс строится прямо сейчас, он подхватит его оттуда
+    index = _exclusion
+    if index is not None:
+        profile = get_user_by_telegram_id(to_user)
+        if profile is not None:
+            index.add(from_user, profile.id, int(timestamp))
+        index.expire(timestamp)
+    if due:
+        flush_likes()
+
+
+def check_match(user1, user2):
+    """
+    Создает запись в matches, если лайки взаимные.
+    Возвращает True, только если матч создан этим вызовом: пара уникальна
+    (idx_matches_pair), и из параллельных вызовов вставку делает ровно один.
+    """
+    if MULTIPROCESS:
+        # Встречный лайк может лежать в буфере другого процесса. Свой записываем
+        # до проверки: из двух проверок более поздняя увидит в таблице оба лайка.
+        flush_likes()
+    # Буфер проверяется до запроса, см. комментарий к буферу лайков
+    like1 = _pending_like(user1, user2)
+    like2 = _pending_like(user2, user1)
+    # Normalize ordering so one match row represents a pair.
+    a, b = sorted((user1, user2))
+    with db_connection() as conn:
+        cur = conn.execute("""
+        INSERT OR IGNORE INTO matches (user1, user2)
+        SELECT ?, ?
+        WHERE (? OR EXISTS (SELECT 1 FROM likes WHERE from_user = ? AND to_user = ? AND action = 'like'))
+          AND (? OR EXISTS (SELECT 1 FROM likes WHERE from_user = ? AND to_user = ? AND action = 'like'))
+        """, (a, b, like1, user1, user2, like2, user2, user1))
+        return cur.rowcount == 1
 
 
 def get_matches_for_user(telegram_id):
     """
     Получает список матчей для конкретного пользователя.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-    SELECT * FROM matches
-    WHERE user1 = ? OR user2 = ?
-    """, (telegram_id, telegram_id))
-    matches = cur.fetchall()
-    conn.close()
-    return matches
+    with db_connection() as conn:
+        return conn.execute("""
+        SELECT * FROM matches
+        WHERE user1 = ? OR user2 = ?
+        """, (telegram_id, telegram_id)).fetchall()
 
 
 # Показать "следующую" анкету для пользователя (простое правило: первая, которую user ещё не лайкал/не сам)
 def get_next_profile_for(telegram_id: int) -> Optional[tuple]:
-    with get_connection() as conn:
+    buffered = pending_like_targets(telegram_id)
+    placeholders = ','.join(['?' for _ in buffered])
+    with db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT u.*
             FROM users u
             WHERE u.telegram_id != ?
               AND u.telegram_id NOT IN (
                   SELECT to_user FROM likes WHERE from_user = ?
               )
+              AND u.telegram_id NOT IN ({placeholders})
             ORDER BY u.id
             LIMIT 1
-        """, (telegram_id, telegram_id))
-        return cur.fetchone()
\ No newline at end of file
+        """, (telegram_id, telegram_id, *buffered))
+        return cur.fetchone()
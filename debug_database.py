@@ -3,6 +3,7 @@
 """
 import sqlite3
 import json
+import database
 from database import get_connection, save_user_filters, get_user_filters
 from config import DB_PATH
 
@@ -179,6 +180,95 @@ def recreate_filters_table():
     finally:
         conn.close()
 
+# Горячие запросы просмотра и свайпа. Условия кулдауна берутся из database.py,
+# чтобы план проверялся у того SQL, который бот выполняет на самом деле.
+_CANDIDATE_WHERE, _CANDIDATE_PARAMS = database._candidate_conditions(1001, ["Дружба", "Общение"])
+_NEARBY_WHERE, _NEARBY_PARAMS = database._candidate_conditions(1001, ["Дружба", "Общение"], target_index=False)
+_CUTOFF = database.cooldown_start()
+
+HOT_QUERIES = {
+    "пробы случайных id (get_filtered_profile, get_random_profile)": (
+        f"SELECT * FROM users WHERE id IN (?, ?, ?) AND {' AND '.join(_CANDIDATE_WHERE)}",
+        (1, 2, 3, *_CANDIDATE_PARAMS),
+    ),
+    "список кандидатов, если пробы не попали (_sample_users)": (
+        f"SELECT id, latitude, longitude FROM users WHERE {' AND '.join(_CANDIDATE_WHERE)}",
+        tuple(_CANDIDATE_PARAMS),
+    ),
+    "кандидаты рядом при фильтре по расстоянию (get_filtered_profile)": (
+        f"""
+        SELECT id, latitude, longitude FROM users
+        WHERE {' AND '.join(_NEARBY_WHERE)}
+          AND users.geocell IN (?, ?, ?, ?)
+          AND users.latitude BETWEEN ? AND ?
+          AND (users.longitude BETWEEN ? AND ?)
+        """,
+        (*_NEARBY_PARAMS, 1311487, 1311488, 1313287, 1313288, 55.7, 55.8, 37.5, 37.7),
+    ),
+    "граница окна в индексе исключений (_recently_swiped)": (
+        f"SELECT users.id FROM users WHERE users.id IN (?, ?, ?) AND EXISTS ({database.RECENT_SWIPE})",
+        (1, 2, 3, 1001, _CUTOFF),
+    ),
+    "построение индекса исключений (rebuild_exclusion_index)": (
+        database.EXCLUSION_SCAN,
+        (_CUTOFF,),
+    ),
+    "индекс исключений воркера (rebuild_exclusion_index, shard)": (
+        database.EXCLUSION_SCAN_SHARD,
+        (_CUTOFF, 4, 1),
+    ),
+    "перенос отживших свайпов (archive_expired_likes)": (
+        f"DELETE FROM likes WHERE {database.EXPIRED_SWIPE}",
+        (0, 500, _CUTOFF),
+    ),
+    "взаимный лайк (check_match)": (
+        """
+        INSERT OR IGNORE INTO matches (user1, user2)
+        SELECT ?, ?
+        WHERE (? OR EXISTS (SELECT 1 FROM likes WHERE from_user = ? AND to_user = ? AND action = 'like'))
+          AND (? OR EXISTS (SELECT 1 FROM likes WHERE from_user = ? AND to_user = ? AND action = 'like'))
+        """,
+        (1001, 1002, 0, 1001, 1002, 0, 1002, 1001),
+    ),
+    "матчи пользователя (get_matches_for_user)": (
+        "SELECT * FROM matches WHERE user1 = ? OR user2 = ?",
+        (1001, 1001),
+    ),
+    "анкета по telegram_id (get_user_by_telegram_id)": (
+        "SELECT * FROM users WHERE telegram_id = ?",
+        (1001,),
+    ),
+    "фильтры пользователя (get_user_filters)": (
+        "SELECT * FROM user_filters WHERE telegram_id = ?",
+        (1001,),
+    ),
+}
+
+
+def check_query_plans():
+    """Печатает EXPLAIN QUERY PLAN горячих запросов и отмечает полные сканы likes/matches"""
+    print("\n=== ПЛАНЫ ГОРЯЧИХ ЗАПРОСОВ ===")
+
+    conn = get_connection()
+    cur = conn.cursor()
+    all_indexed = True
+
+    for name, (query, params) in HOT_QUERIES.items():
+        print(f"\n🔎 {name}")
+        for row in cur.execute(f"EXPLAIN QUERY PLAN {query}", params):
+            detail = row['detail']
+            # SCAN без индекса по likes/matches означает чтение всей таблицы на каждый вызов
+            full_scan = detail.startswith("SCAN") and "INDEX" not in detail and (
+                "likes" in detail or "matches" in detail
+            )
+            if full_scan:
+                all_indexed = False
+            print(f"   {'❌' if full_scan else '✅'} {detail}")
+
+    conn.close()
+    return all_indexed
+
+
 def main():
     """Основная диагностическая функция"""
     print("🔍 ДИАГНОСТИКА ПРОБЛЕМ С ФИЛЬТРАМИ")
@@ -207,7 +297,11 @@ def main():
     # 3. Показываем текущие фильтры
     check_all_filters()
     
-    # 4. Тестируем сохранение/загрузку
+    # 4. Проверяем, что горячие запросы идут по индексам
+    if not check_query_plans():
+        print("\n⚠️ Есть полные сканы likes/matches. Запустите бота или init_db(), чтобы применить миграции.")
+
+    # 5. Тестируем сохранение/загрузку
     if manual_filter_test():
         print("\n🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
         print("Фильтры должны работать корректно.")
@@ -0,0 +1,154 @@
+"""
+Колода кандидатов: очередь следующих анкет для каждого пользователя.
+
+Вместо запроса по фильтрам на каждый свайп колода набирается одним пакетным
+запросом (database.get_candidate_ids) и пополняется в фоне, когда в ней
+остается меньше DECK_LOW_WATER анкет. Колода помнит фильтры, по которым
+собрана, и сбрасывается при их смене или явном invalidate().
+
+    profile = await deck.next_profile(user_id, filters)
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+import async_database as db
+from config import DECK_SIZE, DECK_LOW_WATER, DECK_MAX_USERS
+
+logger = logging.getLogger(__name__)
+
+
+def filters_signature(filters):
+    """Ключ фильтров, по которым собрана колода; None - просмотр без фильтров"""
+    if not filters:
+        return None
+    return tuple(sorted(filters['target_filters'] or ())), filters['distance_filter']
+
+
+class _Deck:
+    __slots__ = ("signature", "queue", "shown", "generation", "refill")
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.queue = deque()
+        self.shown = None        # telegram_id последней выданной анкеты
+        self.generation = 0      # растет при сбросе; устаревшие пополнения отбрасываются
+        self.refill = None       # задача фонового пополнения
+
+
+# user_id -> колода; самые давние колоды вытесняются сверх DECK_MAX_USERS
+_decks = OrderedDict()
+
+
+def _get_deck(user_id, signature):
+    deck = _decks.get(user_id)
+    if deck is None:
+        deck = _decks[user_id] = _Deck(signature)
+        while len(_decks) > DECK_MAX_USERS:
+            _, evicted = _decks.popitem(last=False)
+            _cancel(evicted)
+    else:
+        _decks.move_to_end(user_id)
+        if deck.signature != signature:
+            _reset(deck, signature)
+    return deck
+
+
+def _cancel(deck):
+    if deck.refill and not deck.refill.done():
+        deck.refill.cancel()
+    deck.refill = None
+
+
+def _reset(deck, signature):
+    _cancel(deck)
+    deck.signature = signature
+    deck.queue.clear()
+    deck.generation += 1
+
+
+async def _fill(user_id, deck):
+    """Добирает колоду до DECK_SIZE одним запросом к базе"""
+    generation = deck.generation
+    targets, distance = deck.signature or (None, None)
+    exclude = set(deck.queue)
+    if deck.shown is not None:
+        exclude.add(deck.shown)
+    ids = await db.get_candidate_ids(
+        user_id,
+        target_filters=list(targets) if targets else None,
+        distance_km=distance,
+        limit=DECK_SIZE - len(deck.queue),
+        exclude=exclude,
+    )
+    # Пока шел запрос, фильтры могли смениться: такой результат уже не подходит
+    if deck.generation == generation:
+        deck.queue.extend(i for i in ids if i not in exclude)
+
+
+def _schedule_refill(user_id, deck):
+    if len(deck.queue) >= DECK_LOW_WATER or (deck.refill and not deck.refill.done()):
+        return
+    deck.refill = asyncio.create_task(_fill(user_id, deck))
+    deck.refill.add_done_callback(_report_refill_error)
+
+
+def _report_refill_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка пополнения колоды: %r", task.exception())
+
+
+async def next_profile(user_id, filters):
+    """
+    Следующая анкета для user_id с учетом filters (результат get_user_filters) или None.
+    """
+    signature = filters_signature(filters)
+    deck = _get_deck(user_id, signature)
+
+    while True:
+        if not deck.queue:
+            # Колода пуста: ждем текущее пополнение или набираем ее прямо сейчас
+            if deck.refill and not deck.refill.done():
+                await asyncio.wait([deck.refill])
+            if not deck.queue:
+                await _fill(user_id, deck)
+            if deck.signature != signature or _decks.get(user_id) is not deck:
+                # Пока ждали, колоду сбросили из другого апдейта
+                return await next_profile(user_id, filters)
+            if not deck.queue:
+                return None
+
+        candidate_id = deck.queue.popleft()
+        _schedule_refill(user_id, deck)
+
+        # Анкета могла быть удалена или поменять цель, пока лежала в колоде
+        profile = await db.get_user_by_telegram_id(candidate_id)
+        targets = signature[0] if signature else None
+        if profile is None or (targets and profile['target'] not in targets):
+            continue
+
+        deck.shown = candidate_id
+        return profile
+
+
+def invalidate(user_id):
+    """Сбрасывает колоду пользователя; вызывать после изменения фильтров или анкеты"""
+    deck = _decks.pop(user_id, None)
+    if deck is not None:
+        _cancel(deck)
+        deck.generation += 1
+
+
+def close():
+    """Отменяет фоновые пополнения; вызывать до остановки пула базы"""
+    for deck in _decks.values():
+        _cancel(deck)
+    _decks.clear()
+
+
+def stats():
+    """Количество колод и анкет в них"""
+    return {
+        "decks": len(_decks),
+        "queued": sum(len(deck.queue) for deck in _decks.values()),
+    }
@@ -0,0 +1,116 @@
+"""
+Индекс уже просмотренных анкет: кого пользователь лайкал или дизлайкал за окно
+кулдауна. Проверка пробы - поиск в памяти вместо подзапроса к likes.
+
+У каждого пользователя два параллельных массива: отсортированные users.id,
+которые он свайпал, и день последнего свайпа каждого (как контейнер-массив в
+Roaring bitmap: 4 + 2 байта на запись, поиск - bisect на C). Свайп в день
+целиком внутри окна исключает анкету точно, свайп старше окна не в счет, а
+свайп в день, на который приходится граница окна, отдается вызывающему как
+"неизвестно" - его проверяют точным запросом к likes.
+
+    index = ExclusionIndex(window=9 * 86400)
+    index.add(viewer, user_id, time.time())
+    index.expire(time.time())       # чистит от записей старше окна следующих EXPIRE_BATCH пользователей
+    excluded, uncertain = index.check(viewer, probe_ids, time.time())
+"""
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+DAY = 86400
+# Пользователей, которых один вызов expire() проверяет на записи старше окна
+EXPIRE_BATCH = 4
+
+
+class ExclusionIndex:
+    """
+    viewer -> (array('I') users.id по возрастанию, array('H') номер дня с 1970).
+    Пишут add_like и чтения из потоков пула базы, поэтому все операции под
+    одной блокировкой; каждая занимает микросекунды.
+    """
+
+    def __init__(self, window, bucket=DAY):
+        self.window = window
+        self.bucket = bucket
+        self._lock = threading.Lock()
+        self._viewers = {}
+        self._sweep = []  # пользователи, которых expire() еще не проверил в текущем круге
+
+    def add(self, viewer, user_id, timestamp):
+        day = int(timestamp // self.bucket)
+        with self._lock:
+            entry = self._viewers.get(viewer)
+            if entry is None:
+                self._viewers[viewer] = (array("I", (user_id,)), array("H", (day,)))
+                return
+            ids, days = entry
+            i = bisect_left(ids, user_id)
+            if i < len(ids) and ids[i] == user_id:
+                # Повторный свайп после кулдауна продлевает исключение
+                if day > days[i]:
+                    days[i] = day
+                return
+            ids.insert(i, user_id)
+            days.insert(i, day)
+
+    def check(self, viewer, user_ids, now):
+        """
+        (исключенные, неизвестные): исключенные свайпнуты точно внутри окна,
+        неизвестные - в день границы окна, их нужно проверить по likes
+        """
+        boundary = int((now - self.window) // self.bucket)
+        excluded, uncertain = set(), []
+        with self._lock:
+            entry = self._viewers.get(viewer)
+            if entry is None:
+                return excluded, uncertain
+            ids, days = entry
+            n = len(ids)
+            for user_id in user_ids:
+                i = bisect_left(ids, user_id)
+                if i < n and ids[i] == user_id:
+                    day = days[i]
+                    if day > boundary:
+                        excluded.add(user_id)
+                    elif day == boundary:
+                        uncertain.append(user_id)
+        return excluded, uncertain
+
+    def expire(self, now, limit=EXPIRE_BATCH):
+        """
+        Удаляет записи старше окна у следующих limit пользователей по кругу, а
+        пользователей без свайпов в окне - целиком. Вызывается на каждом свайпе:
+        работа одного вызова ограничена, и check() других потоков не ждет полный
+        проход. Старые записи до своей очереди только занимают память, check()
+        их уже не учитывает.
+        """
+        boundary = int((now - self.window) // self.bucket)
+        with self._lock:
+            if not self._sweep:
+                self._sweep = list(self._viewers)
+            for _ in range(min(limit, len(self._sweep))):
+                viewer = self._sweep.pop()
+                entry = self._viewers.get(viewer)
+                if entry is None:
+                    continue
+                ids, days = entry
+                if min(days) >= boundary:
+                    continue
+                keep = [i for i, day in enumerate(days) if day >= boundary]
+                if keep:
+                    self._viewers[viewer] = (array("I", (ids[i] for i in keep)), array("H", (days[i] for i in keep)))
+                else:
+                    del self._viewers[viewer]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "viewers": len(self._viewers),
+                "entries": sum(len(ids) for ids, _ in self._viewers.values()),
+                "bytes": sys.getsizeof(self._viewers) + sum(
+                    sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
+                    for entry in self._viewers.values()
+                ),
+            }
@@ -0,0 +1,187 @@
+"""
+Локальная имитация Telegram Bot API для нагрузочных прогонов без сети.
+
+FakeTelegram поднимает aiohttp-сервер с маршрутом /bot<token>/<method>:
+методы отправки получают правдоподобные объекты Message, остальные - True.
+Апдейты раздаются через getUpdates (long polling) или отправляются
+POST-запросами на webhook бота, как это делает Telegram.
+
+    tg = FakeTelegram(latency=0.02)
+    await tg.start()
+    bot = tg.make_bot()                       # обычный aiogram.Bot, смотрит на tg
+    tg.push(tg.message_update(user_id, "👀 Смотреть анкеты"))
+    await tg.deliver(webhook_url, updates, concurrency=40)
+    await tg.close()
+"""
+import asyncio
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+TOKEN = "123456:fake-telegram-token"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_dating_bot"}
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {"sendmessage", "sendphoto", "editmessagetext", "editmessagecaption", "sendlocation"}
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency  # искусственная задержка ответа, как сеть до api.telegram.org
+        self.calls = Counter()
+        self.retries = 0
+        self._pending = []
+        self._new_updates = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def make_bot(self, token=TOKEN):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.url))
+        return Bot(token=token, session=session)
+
+    # ---------- Апдейты ----------
+    def _next_update_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def message_update(self, user_id, text=None, **fields):
+        """
+        Апдейт с сообщением пользователя user_id в личном чате: текст и/или
+        другие поля Message, например location={...} или photo=[...]
+        """
+        self._message_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            **fields,
+        }
+        if text is not None:
+            message["text"] = text
+        return {"update_id": self._next_update_id(), "message": message}
+
+    def callback_update(self, user_id, data):
+        """Апдейт с нажатием inline-кнопки под сообщением бота"""
+        self._message_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        return {
+            "update_id": self._next_update_id(),
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": self._message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "...",
+                },
+            },
+        }
+
+    def push(self, *updates):
+        """Ставит апдейты в очередь getUpdates"""
+        self._pending.extend(updates)
+        self._new_updates.set()
+
+    async def deliver(self, url, updates, concurrency=40, secret=None):
+        """
+        Отправляет апдейты на webhook не больше чем concurrency запросами сразу
+        (max_connections в setWebhook). На 429/503 повторяет после Retry-After.
+        """
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        queue = asyncio.Queue()
+        for update in updates:
+            queue.put_nowait(update)
+
+        async def connection(session):
+            while not queue.empty():
+                update = queue.get_nowait()
+                while True:
+                    async with session.post(url, json=update, headers=headers) as response:
+                        if response.status < 400:
+                            break
+                        if response.status not in (429, 503):
+                            raise RuntimeError(f"webhook ответил {response.status}: {await response.text()}")
+                        self.retries += 1
+                        await asyncio.sleep(float(response.headers.get("Retry-After", "0.05")))
+
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(connection(session) for _ in range(concurrency)))
+
+    # ---------- Bot API ----------
+    async def _handle(self, request):
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        elif request.can_read_body:
+            params = dict(await request.post())
+        else:
+            params = dict(request.query)
+        self.calls[method] += 1
+        if method == "getupdates":
+            return self._ok(await self._get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getme":
+            return self._ok(BOT_USER)
+        if method in MESSAGE_METHODS:
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            return self._ok({
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text") or params.get("caption") or "",
+            })
+        return self._ok(True)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        # offset подтверждает все апдейты до него, как в настоящем API
+        self._pending = [update for update in self._pending if update["update_id"] >= offset]
+        if not self._pending and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._pending[:limit]
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
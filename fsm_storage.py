@@ -0,0 +1,171 @@
+"""
+Хранилище FSM aiogram в таблице fsm_state основной базы.
+
+Незаконченные регистрация и настройка фильтров переживают перезапуск бота.
+Записи читаются из памяти (с подгрузкой из базы при промахе), а изменения
+копятся FSM_FLUSH_DELAY секунд и пишутся одной транзакцией: set_state и
+update_data одного хендлера дают одну запись в базу, а не две. Запись
+живет FSM_TTL секунд с последнего изменения, данные хранятся компактным JSON.
+При остановке close() делает не больше FSM_CLOSE_RETRIES попыток записи:
+если база так и не ответила, незаписанные состояния пишутся в лог и теряются.
+
+    storage = fsm_storage.create_storage()
+    dp = Dispatcher(storage=storage)
+    ...
+    await storage.close()
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import async_database as db
+from cache import TTLCache
+from config import FSM_STORAGE, FSM_TTL, FSM_FLUSH_DELAY, FSM_CACHE_SIZE, FSM_CLOSE_RETRIES
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = (None, {})
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def _dump(data: Dict[str, Any]) -> Optional[str]:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl=FSM_TTL, flush_delay=FSM_FLUSH_DELAY, cache_size=FSM_CACHE_SIZE,
+                 close_retries=FSM_CLOSE_RETRIES, timer=time.time):
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self.close_retries = close_retries
+        self._timer = timer
+        # Загруженные и записанные записи: key -> (state, data)
+        self._cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        # Еще не записанные в базу изменения: key -> (state, data, expires_at)
+        self._dirty = {}
+        self._flush_task = None
+        self._closing = False
+        self.flushes = 0
+        self.rows_written = 0
+
+    async def _load(self, key):
+        record = self._dirty.get(key)
+        if record is not None:
+            return record[:2]
+        record = self._cache.get(key)
+        if record is not None:
+            return record
+
+        row = await db.load_fsm_record(key, self._timer())
+        record = (row[0], json.loads(row[1]) if row[1] else {}) if row else _EMPTY
+        # Пока шел запрос, запись могли изменить: свежая версия уже в памяти
+        if key in self._dirty:
+            return self._dirty[key][:2]
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        self._cache.set(key, record)
+        return record
+
+    def _write(self, key, state, data):
+        record = (state, data)
+        self._cache.set(key, record)
+        self._dirty[key] = (state, data, self._timer() + self.ttl)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Изменения, пришедшие во время записи, уйдут следующей пачкой
+        # После close() повторами занимается он сам, с ограниченным числом попыток
+        while self._dirty and not self._closing:
+            await asyncio.sleep(self.flush_delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка записи FSM, повтор через %s с: %r", self.flush_delay, e)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        upserts, deletes = [], []
+        for key, (state, data, expires_at) in pending.items():
+            if state is None and not data:
+                deletes.append(key)
+            else:
+                upserts.append((key, state, _dump(data), expires_at))
+        try:
+            await db.save_fsm_records(upserts, deletes)
+        except Exception:
+            # Не теряем изменения: вернем их, если поверх не записали более новые
+            for key, record in pending.items():
+                self._dirty.setdefault(key, record)
+            raise
+        self.flushes += 1
+        self.rows_written += len(pending)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = _key(key)
+        _, data = await self._load(key)
+        self._write(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = _key(key)
+        state, _ = await self._load(key)
+        self._write(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(_key(key)))[1].copy()
+
+    async def purge_expired(self) -> int:
+        """Удаляет из базы записи, которые не менялись дольше ttl"""
+        return await db.purge_fsm_records(self._timer())
+
+    async def close(self) -> None:
+        # Не отменяем запись на лету: пачка уже могла уйти в пул потоков базы
+        self._closing = True
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        for attempt in range(1, self.close_retries + 1):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error("Ошибка записи FSM при остановке, попытка %s из %s: %r", attempt, self.close_retries, e)
+                if attempt < self.close_retries:
+                    await asyncio.sleep(self.flush_delay)
+        if self._dirty:
+            logger.error("Не записано состояний FSM: %s, отбрасываем: %s", len(self._dirty), ", ".join(self._dirty))
+            self._dirty = {}
+
+    def stats(self):
+        return {
+            "cached": len(self._cache),
+            "pending": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+
+def create_storage(backend=FSM_STORAGE) -> BaseStorage:
+    """Хранилище FSM по настройке FSM_STORAGE: sqlite или memory"""
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {backend}")
@@ -0,0 +1,98 @@
+"""
+Офлайн-справочник городов (cities.csv) и поиск ближайшего города.
+
+Города лежат в KD-дереве по точкам на единичной сфере: поиск по хордовому
+расстоянию не ломается на антимеридиане и у полюсов, а порядок ближайших
+совпадает с порядком по расстоянию по большой окружности.
+
+    city, km = gazetteer.nearest_city(55.75, 37.62)
+"""
+import csv
+import math
+import os
+
+CITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.csv")
+EARTH_RADIUS_KM = 6371
+
+
+def _to_xyz(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+class Gazetteer:
+    """
+    KD-дерево в неявном виде: точки переупорядочены так, что узел - середина
+    своего отрезка [lo, hi), левое поддерево слева от него, правое справа.
+    """
+
+    def __init__(self, cities):
+        # cities: [(name, latitude, longitude), ...]
+        points = [(_to_xyz(lat, lon), name) for name, lat, lon in cities]
+        self._axes = [0] * len(points)
+        self._build(points, 0, len(points), 0)
+        self._xyz = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def _build(self, points, lo, hi, depth):
+        # Рекурсия по глубине дерева (~log2 n), а не по числу точек
+        if hi - lo <= 1:
+            return
+        axis = depth % 3
+        points[lo:hi] = sorted(points[lo:hi], key=lambda point: point[0][axis])
+        mid = (lo + hi) // 2
+        self._axes[mid] = axis
+        self._build(points, lo, mid, depth + 1)
+        self._build(points, mid + 1, hi, depth + 1)
+
+    def __len__(self):
+        return len(self._names)
+
+    def nearest(self, latitude, longitude):
+        """(название, км) ближайшего города или None, если справочник пуст"""
+        if not self._names:
+            return None
+        target = _to_xyz(latitude, longitude)
+        xyz, axes = self._xyz, self._axes
+        best, best_d2 = -1, float("inf")
+        # (lo, hi, квадрат расстояния до разделяющей плоскости родителя)
+        stack = [(0, len(xyz), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            # Плоскость дальше найденного лучшего: в этой половине ближе не будет
+            if lo >= hi or bound >= best_d2:
+                continue
+            mid = (lo + hi) // 2
+            point = xyz[mid]
+            dx, dy, dz = point[0] - target[0], point[1] - target[1], point[2] - target[2]
+            d2 = dx * dx + dy * dy + dz * dz
+            if d2 < best_d2:
+                best, best_d2 = mid, d2
+            diff = target[axes[mid]] - point[axes[mid]]
+            if diff > 0:
+                stack.append((lo, mid, diff * diff))
+                stack.append((mid + 1, hi, 0.0))
+            else:
+                stack.append((mid + 1, hi, diff * diff))
+                stack.append((lo, mid, 0.0))
+        chord = math.sqrt(best_d2)
+        return self._names[best], 2 * math.asin(min(1.0, chord / 2)) * EARTH_RADIUS_KM
+
+
+def load(path=CITIES_PATH):
+    """Читает справочник из CSV (name, latitude, longitude, ...)"""
+    with open(path, encoding="utf-8", newline="") as f:
+        cities = [(row["name"], float(row["latitude"]), float(row["longitude"])) for row in csv.DictReader(f)]
+    return Gazetteer(cities)
+
+
+_gazetteer = None
+
+
+def nearest_city(latitude, longitude):
+    """(название, км) ближайшего города из cities.csv; справочник грузится при первом вызове"""
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = load()
+    return _gazetteer.nearest(latitude, longitude)
@@ -0,0 +1,193 @@
+"""
+Обратное геокодирование: город по координатам через Nominatim.
+
+- одна общая aiohttp-сессия с keep-alive вместо новой на каждое сообщение;
+- кэш по округленным до GEOCODER_PRECISION знаков координатам: LRU в памяти
+  и таблица geocode_cache в базе, которая переживает перезапуск;
+- одновременные запросы одних и тех же координат объединяются в один;
+- не больше GEOCODER_RATE запросов в секунду (правила Nominatim - 1 в секунду).
+
+Офлайн-справочник gazetteer.py отвечает без сети: в режиме hybrid (по умолчанию)
+Nominatim спрашивается, только если рядом нет города из справочника, а при
+ошибке сети вместо координат возвращается ближайший город из справочника.
+
+    city = await geocoding.get_city_from_coordinates(latitude, longitude)
+"""
+import asyncio
+import time
+
+import aiohttp
+
+import async_database as db
+import gazetteer
+from cache import TTLCache
+from config import (
+    GEOCODER_URL, GEOCODER_RATE, GEOCODER_PRECISION, GEOCODER_CACHE_SIZE, GEOCODER_MODE, GAZETTEER_RADIUS_KM
+)
+
+USER_AGENT = 'TelegramDatingBot/1.0'  # Обязательный заголовок для Nominatim
+MEMORY_TTL = 30 * 24 * 3600
+
+
+class TokenBucket:
+    """Не больше rate захватов в секунду, до capacity подряд после простоя"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _city_from_response(data):
+    """Извлекает город из ответа Nominatim"""
+    address = data.get('address', {})
+
+    # Ищем город в разных полях (в порядке приоритета)
+    city = (
+        address.get('city') or
+        address.get('town') or
+        address.get('village') or
+        address.get('municipality') or
+        address.get('county') or
+        address.get('state')
+    )
+    if city:
+        return city
+    # Если не нашли город, возвращаем общую информацию
+    country = address.get('country', 'Неизвестная страна')
+    return f"Город рядом с {country}"
+
+
+class ReverseGeocoder:
+    def __init__(self, url=GEOCODER_URL, rate=GEOCODER_RATE, precision=GEOCODER_PRECISION,
+                 cache_size=GEOCODER_CACHE_SIZE, mode=GEOCODER_MODE, radius_km=GAZETTEER_RADIUS_KM):
+        if mode not in ("offline", "hybrid", "remote"):
+            raise ValueError(f"Неизвестный режим геокодирования: {mode}")
+        self.url = url
+        self.mode = mode
+        self.radius_km = radius_km
+        self.precision = precision
+        self._limiter = TokenBucket(rate)
+        self._memory = TTLCache(maxsize=cache_size, ttl=MEMORY_TTL)
+        self._inflight = {}
+        self._session = None
+        self.requests = 0
+        self.db_hits = 0
+        self.offline_hits = 0
+
+    def _key(self, latitude, longitude):
+        scale = 10 ** self.precision
+        return round(latitude * scale), round(longitude * scale)
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=10),
+                connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=60),
+            )
+        return self._session
+
+    async def city_for(self, latitude, longitude):
+        """
+        Город по координатам. Если сеть недоступна - ближайший город справочника,
+        а без него строка с координатами (она не кэшируется).
+        """
+        nearest = None
+        if self.mode != "remote":
+            nearest = gazetteer.nearest_city(latitude, longitude)
+            if nearest and (self.mode == "offline" or nearest[1] <= self.radius_km):
+                self.offline_hits += 1
+                return nearest[0]
+
+        key = self._key(latitude, longitude)
+        city = self._memory.get(key)
+        if city is not None:
+            return city
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(key, latitude, longitude))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        city = await asyncio.shield(task)
+        if city is not None:
+            return city
+
+        if nearest is None:
+            nearest = gazetteer.nearest_city(latitude, longitude)
+        if nearest:
+            return nearest[0]
+        return f"Координаты {latitude:.2f}, {longitude:.2f}"
+
+    async def _lookup(self, key, latitude, longitude):
+        city = await db.get_cached_city(*key)
+        if city is not None:
+            self.db_hits += 1
+            self._memory.set(key, city)
+            return city
+
+        city = await self._request(latitude, longitude)
+        if city is not None:
+            self._memory.set(key, city)
+            await db.save_cached_city(*key, city)
+        return city
+
+    async def _request(self, latitude, longitude):
+        params = {
+            'lat': latitude,
+            'lon': longitude,
+            'format': 'json',
+            'accept-language': 'ru',  # Получаем ответ на русском
+            'addressdetails': 1
+        }
+        await self._limiter.acquire()
+        self.requests += 1
+        try:
+            async with self._get_session().get(self.url, params=params) as response:
+                if response.status != 200:
+                    return None
+                return _city_from_response(await response.json())
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "db_hits": self.db_hits,
+            "offline_hits": self.offline_hits,
+            "inflight": len(self._inflight),
+            **{f"memory_{key}": value for key, value in self._memory.stats().items()},
+        }
+
+
+_geocoder = ReverseGeocoder()
+
+
+async def get_city_from_coordinates(latitude, longitude):
+    """
+    Определение города по координатам: офлайн-справочник и/или Nominatim (см. GEOCODER_MODE)
+    """
+    return await _geocoder.city_for(latitude, longitude)
+
+
+async def close():
+    await _geocoder.close()
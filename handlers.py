@@ -1,26 +1,15 @@
+import logging
+
 from aiogram import Router, F
 from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-import aiohttp
-
-from database import (
-    get_user_by_telegram_id,
-    add_user,
-    update_user_field,
-    update_user_coordinates,
-    get_next_profile_for,
-    get_random_profile,
-    get_filtered_profile,
-    add_like,
-    check_match,
-    save_user_filters,
-    save_user_target_filters,
-    save_user_distance_filter,
-    get_user_filters,
-    debug_filters_table
-)
+
+import async_database as db
+from geocoding import get_city_from_coordinates
+import deck
+import viewing_store
 
 from keyboards import (
     gender_keyboard,
@@ -42,9 +31,10 @@ from keyboards import (
 )
 
 router = Router()
+logger = logging.getLogger(__name__)
 
-# in-memory map user_id -> last shown profile row
-viewing_state = {}
+# user_id -> telegram_id показанной анкеты, чтобы Лайк/Дизлайк применялся к ней
+viewing = viewing_store.create_store()
 
 # ========== FSM для регистрации ==========
 class Registration(StatesGroup):
@@ -63,61 +53,11 @@ class FilterSettings(StatesGroup):
     target_selection = State()       # настройка целей
     distance_selection = State()     # настройка расстояния
 
-# ========== Функция определения города по координатам ==========
-async def get_city_from_coordinates(latitude, longitude):
-    """
-    Определение города по координатам через Nominatim API
-    """
-    try:
-        url = f"https://nominatim.openstreetmap.org/reverse"
-        params = {
-            'lat': latitude,
-            'lon': longitude,
-            'format': 'json',
-            'accept-language': 'ru',  # Получаем ответ на русском
-            'addressdetails': 1
-        }
-        
-        headers = {
-            'User-Agent': 'TelegramDatingBot/1.0'  # Обязательный заголовок для Nominatim
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    # Пытаемся извлечь город из ответа
-                    address = data.get('address', {})
-                    
-                    # Ищем город в разных полях (в порядке приоритета)
-                    city = (
-                        address.get('city') or 
-                        address.get('town') or 
-                        address.get('village') or 
-                        address.get('municipality') or
-                        address.get('county') or
-                        address.get('state')
-                    )
-                    
-                    if city:
-                        return city
-                    else:
-                        # Если не нашли город, возвращаем общую информацию
-                        country = address.get('country', 'Неизвестная страна')
-                        return f"Город рядом с {country}"
-                else:
-                    return f"Координаты {latitude:.2f}, {longitude:.2f}"
-                    
-    except Exception as e:
-        # В случае ошибки возвращаем координаты
-        return f"Координаты {latitude:.2f}, {longitude:.2f}"
-
 # ========== Команды ==========
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await db.get_user_by_telegram_id(message.from_user.id)
     if user:
         # Если анкета уже есть, показываем меню профиля
         await message.answer("С возвращением! 👋")
@@ -130,7 +70,7 @@ async def cmd_start(message: Message, state: FSMContext):
 
 @router.message(Command("myprofile"))
 async def cmd_myprofile(message: Message):
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await db.get_user_by_telegram_id(message.from_user.id)
     if not user:
         await message.answer("У тебя ещё нет анкеты. Используй /resetprofile для создания.")
         return
@@ -181,7 +121,7 @@ async def reset_profile_button(message: Message, state: FSMContext):
 @router.message(F.text == "🔧 Настроить фильтры")
 async def setup_filters(message: Message, state: FSMContext):
     # Получаем текущие фильтры пользователя
-    current_filters = get_user_filters(message.from_user.id)
+    current_filters = await db.get_user_filters(message.from_user.id)
     
     if current_filters:
         targets = current_filters['target_filters']
@@ -210,7 +150,7 @@ async def setup_filters(message: Message, state: FSMContext):
 @router.message(FilterSettings.filter_type_selection, F.text == "🎯 Цель")
 async def setup_target_filters(message: Message, state: FSMContext):
     # Получаем текущие цели
-    current_filters = get_user_filters(message.from_user.id)
+    current_filters = await db.get_user_filters(message.from_user.id)
     current_targets = []
     if current_filters and current_filters['target_filters']:
         current_targets = current_filters['target_filters']
@@ -228,7 +168,7 @@ async def setup_target_filters(message: Message, state: FSMContext):
 @router.message(FilterSettings.filter_type_selection, F.text == "📍 Расстояние")
 async def setup_distance_filters(message: Message, state: FSMContext):
     # Получаем текущее расстояние
-    current_filters = get_user_filters(message.from_user.id)
+    current_filters = await db.get_user_filters(message.from_user.id)
     current_distance = None
     if current_filters:
         current_distance = current_filters['distance_filter']
@@ -280,16 +220,15 @@ async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # ========== Настройка целей ==========
-@router.callback_query(FilterSettings.target_selection, F.data.startswith("filter_target_"))
+# "filter_targets_save" не начинается с "filter_target_", поэтому указан отдельно
+@router.callback_query(FilterSettings.target_selection,
+                       F.data.startswith("filter_target_") | (F.data == "filter_targets_save"))
 async def handle_target_filter_selection(callback: CallbackQuery, state: FSMContext):
-    print(f"DEBUG: handle_target_filter_selection вызван с callback.data = '{callback.data}'")
-    
     data = await state.get_data()
     selected_targets = data.get('selected_targets', [])
-    print(f"DEBUG: Текущие выбранные цели: {selected_targets}")
+    logger.debug("handle_target_filter_selection: data=%r, выбраны %r", callback.data, selected_targets)
     
     if callback.data == "filter_target_all":
-        print("DEBUG: Выбраны ВСЕ цели")
         # Выбираем все цели
         selected_targets = ["Дружба", "Общение", "Отношения", "Ничего серьезного", "Свидания"]
         await state.update_data(selected_targets=selected_targets)
@@ -301,16 +240,16 @@ async def handle_target_filter_selection(callback: CallbackQuery, state: FSMCont
             reply_markup=filter_targets_keyboard
         )
     elif callback.data == "filter_targets_save":
-        print("DEBUG: Нажата кнопка СОХРАНИТЬ")
         # Сохраняем цели
         if not selected_targets:
-            print("DEBUG: Цели не выбраны, используем все по умолчанию")
+            # Цели не выбраны, используем все по умолчанию
             selected_targets = ["Дружба", "Общение", "Отношения", "Ничего серьезного", "Свидания"]
         
-        print(f"DEBUG: Сохраняем цели: {selected_targets}")
-        success = save_user_target_filters(callback.from_user.id, selected_targets)
+        logger.debug("Сохраняем цели %r для %s", selected_targets, callback.from_user.id)
+        success = await db.save_user_target_filters(callback.from_user.id, selected_targets)
         
         if success:
+            deck.invalidate(callback.from_user.id)
             await callback.message.edit_text(
                 f"✅ Цели сохранены!\n\n"
                 f"Сохранённые цели: {', '.join(selected_targets)}\n\n"
@@ -330,17 +269,13 @@ async def handle_target_filter_selection(callback: CallbackQuery, state: FSMCont
                 reply_markup=filter_targets_keyboard
             )
     else:
-        print(f"DEBUG: Переключение конкретной цели: {callback.data}")
         # Переключаем выбор конкретной цели
         target = callback.data.replace("filter_target_", "")
-        print(f"DEBUG: Извлеченная цель: '{target}'")
         
         if target in selected_targets:
             selected_targets.remove(target)
-            print(f"DEBUG: Удалена цель '{target}'")
         else:
             selected_targets.append(target)
-            print(f"DEBUG: Добавлена цель '{target}'")
         
         await state.update_data(selected_targets=selected_targets)
         
@@ -356,8 +291,6 @@ async def handle_target_filter_selection(callback: CallbackQuery, state: FSMCont
 # ========== Настройка расстояния ==========
 @router.callback_query(FilterSettings.distance_selection, F.data.startswith("filter_distance_"))
 async def handle_distance_filter_selection(callback: CallbackQuery, state: FSMContext):
-    print(f"DEBUG: handle_distance_filter_selection вызван с callback.data = '{callback.data}'")
-    
     if callback.data == "filter_distance_unlimited":
         distance_km = None
         distance_text = "Без ограничений"
@@ -365,12 +298,13 @@ async def handle_distance_filter_selection(callback: CallbackQuery, state: FSMCo
         distance_km = int(callback.data.replace("filter_distance_", ""))
         distance_text = f"до {distance_km} км"
     
-    print(f"DEBUG: Сохраняем расстояние: {distance_km}")
+    logger.debug("Сохраняем расстояние %r для %s", distance_km, callback.from_user.id)
     
     # Сохраняем расстояние
-    success = save_user_distance_filter(callback.from_user.id, distance_km)
+    success = await db.save_user_distance_filter(callback.from_user.id, distance_km)
     
     if success:
+        deck.invalidate(callback.from_user.id)
         await callback.message.edit_text(
             f"✅ Расстояние сохранено!\n\n"
             f"Максимальное расстояние: {distance_text}\n\n"
@@ -395,7 +329,7 @@ async def handle_distance_filter_selection(callback: CallbackQuery, state: FSMCo
 # ========== Вспомогательная функция ==========
 async def get_current_filters_text(telegram_id):
     """Возвращает текст с текущими фильтрами"""
-    current_filters = get_user_filters(telegram_id)
+    current_filters = await db.get_user_filters(telegram_id)
     
     if current_filters:
         targets = current_filters['target_filters']
@@ -456,7 +390,7 @@ async def reg_age(message: Message, state: FSMContext):
     
     if is_editing:
         # Получаем текущий город пользователя
-        user = get_user_by_telegram_id(message.from_user.id)
+        user = await db.get_user_by_telegram_id(message.from_user.id)
         if user and user['city']:  # Используем dictionary-style access
             previous_city = user['city']
     
@@ -535,7 +469,7 @@ async def reg_photo(message: Message, state: FSMContext):
     data = await state.get_data()
 
     # Сохраняем пользователя с новыми полями
-    add_user(
+    await db.add_user(
         telegram_id=message.from_user.id,
         name=data["name"],
         gender=data["gender"],
@@ -547,6 +481,8 @@ async def reg_photo(message: Message, state: FSMContext):
         latitude=data.get("latitude"),
         longitude=data.get("longitude")
     )
+    # Координаты могли смениться, а с ними и анкеты в радиусе
+    deck.invalidate(message.from_user.id)
 
     await message.answer("Анкета сохранена! 🎉", reply_markup=profile_menu)
     await message.answer(profile_menu_text, reply_markup=profile_menu)
@@ -556,21 +492,12 @@ async def reg_photo(message: Message, state: FSMContext):
 @router.message(F.text == "👀 Смотреть анкеты")
 async def cmd_view_filtered(message: Message):
     # Получаем фильтры пользователя
-    filters = get_user_filters(message.from_user.id)
-    print(f"DEBUG: Фильтры при просмотре анкет для пользователя {message.from_user.id}: {filters}")
+    filters = await db.get_user_filters(message.from_user.id)
     
-    if filters:
-        # Используем фильтрацию
-        profile = get_filtered_profile(
-            message.from_user.id,
-            target_filters=filters['target_filters'] if filters['target_filters'] else None,
-            distance_km=filters['distance_filter']
-        )
-        print(f"DEBUG: Используем фильтрацию. Найденный профиль: {profile['name'] if profile else 'Нет подходящих'}")
-    else:
-        # Используем стандартный просмотр без фильтров
-        profile = get_random_profile(message.from_user.id)
-        print(f"DEBUG: Без фильтров. Найденный профиль: {profile['name'] if profile else 'Нет анкет'}")
+    # Следующая анкета из колоды, собранной по фильтрам (без фильтров - любая)
+    profile = await deck.next_profile(message.from_user.id, filters)
+    logger.debug("Просмотр с фильтрами %r для %s: %s", filters, message.from_user.id,
+                 profile['telegram_id'] if profile else "нет подходящих")
     
     if not profile:
         await message.answer(
@@ -612,24 +539,16 @@ async def cmd_view_filtered(message: Message):
         await message.answer(text)
 
     # remember which profile we've shown to this user so Like/Dislike applies to it
-    viewing_state[message.from_user.id] = profile
+    await viewing.set(message.from_user.id, profile['telegram_id'])
     await message.answer(view_menu_text, reply_markup=view_menu)
 
 @router.message(Command("view"))
 async def cmd_view_command_filtered(message: Message):
     # Получаем фильтры пользователя
-    filters = get_user_filters(message.from_user.id)
+    filters = await db.get_user_filters(message.from_user.id)
     
-    if filters:
-        # Используем фильтрацию
-        profile = get_filtered_profile(
-            message.from_user.id,
-            target_filters=filters['target_filters'] if filters['target_filters'] else None,
-            distance_km=filters['distance_filter']
-        )
-    else:
-        # Используем стандартный просмотр без фильтров
-        profile = get_random_profile(message.from_user.id)
+    # Следующая анкета из колоды, собранной по фильтрам (без фильтров - любая)
+    profile = await deck.next_profile(message.from_user.id, filters)
     
     if not profile:
         await message.answer(
@@ -668,35 +587,31 @@ async def cmd_view_command_filtered(message: Message):
         await message.answer(text)
 
     # remember which profile we've shown to this user so Like/Dislike applies to it
-    viewing_state[message.from_user.id] = profile
+    await viewing.set(message.from_user.id, profile['telegram_id'])
     await message.answer(view_menu_text, reply_markup=view_menu)
 
 # ========== Логика просмотра анкет (обновленная) ==========
 @router.message(F.text == "❤️ Лайк")
 async def like_profile(message: Message):
-    target = viewing_state.get(message.from_user.id)
-    if not target:
+    # pop сразу: повторное нажатие не поставит второй лайк той же анкете
+    target_telegram_id = await viewing.pop(message.from_user.id)
+    if not target_telegram_id:
         await message.answer("Анкеты закончились.")
         return
     
-    target_telegram_id = target['telegram_id']
-    add_like(message.from_user.id, target_telegram_id, action="like")
-    if check_match(message.from_user.id, target_telegram_id):
+    await db.add_like(message.from_user.id, target_telegram_id, action="like")
+    if await db.check_match(message.from_user.id, target_telegram_id):
         await message.answer("🎉 У вас совпадение! Напишите друг другу в телеграм.")
     else:
         await message.answer("Лайк поставлен ✅")
 
-    # clear viewed profile so next view will fetch another
-    viewing_state.pop(message.from_user.id, None)
     await cmd_view_filtered(message)
 
 @router.message(F.text == "👎 Дизлайк")
 async def dislike_profile(message: Message):
-    target = viewing_state.get(message.from_user.id)
-    if target:
-        target_telegram_id = target['telegram_id']
-        add_like(message.from_user.id, target_telegram_id, action="dislike")
-        viewing_state.pop(message.from_user.id, None)
+    target_telegram_id = await viewing.pop(message.from_user.id)
+    if target_telegram_id:
+        await db.add_like(message.from_user.id, target_telegram_id, action="dislike")
     await message.answer("Пропускаем эту анкету 👌")
     await cmd_view_filtered(message)
 
@@ -712,24 +627,31 @@ async def stop_search(message: Message):
 @router.message(Command("debug_filters"))
 async def debug_filters_command(message: Message):
     """Отладочная команда для проверки фильтров"""
-    print("=== DEBUG FILTERS ===")
-    debug_filters_table()
+    await db.debug_filters_table()
     
-    user_filters = get_user_filters(message.from_user.id)
+    user_filters = await db.get_user_filters(message.from_user.id)
     await message.answer(
         f"🔧 Отладка фильтров:\n"
         f"Твои фильтры: {user_filters}\n"
         f"Подробности в консоли сервера."
     )
 
-@router.message(Command("create_filters_table"))
-async def create_filters_table_command(message: Message):
-    """Принудительно создает таблицу фильтров"""
-    try:
-        from database import get_connection
-        conn = get_connection()
+@router.message(Command("viewing_stats"))
+async def viewing_stats_command(message: Message):
+    """Размер и счетчики хранилища текущих анкет, колод кандидатов, кэшей анкет и фильтров"""
+    stats = await viewing.stats()
+    lines = [f"{key}: {value}" for key, value in stats.items()]
+    lines += [f"deck {key}: {value}" for key, value in deck.stats().items()]
+    lines += [f"profiles {key}: {value}" for key, value in db.profile_cache_stats().items()]
+    lines += [f"filters {key}: {value}" for key, value in db.filter_cache_stats().items()]
+    await message.answer("📊 Просмотр анкет:\n" + "\n".join(lines))
+
+def _create_filters_table():
+    """Создает таблицу фильтров и возвращает, существует ли она после этого"""
+    from database import db_connection
+    with db_connection() as conn:
         cur = conn.cursor()
-        
+
         # Создаем таблицу фильтров
         cur.execute("""
         CREATE TABLE IF NOT EXISTS user_filters (
@@ -741,20 +663,22 @@ async def create_filters_table_command(message: Message):
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """)
-        
-        conn.commit()
-        
+
         # Проверяем создание
         cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_filters'")
-        table_exists = cur.fetchone()
-        
+        return cur.fetchone() is not None
+
+@router.message(Command("create_filters_table"))
+async def create_filters_table_command(message: Message):
+    """Принудительно создает таблицу фильтров"""
+    try:
+        table_exists = await db.run(_create_filters_table)
+
         if table_exists:
             await message.answer("✅ Таблица user_filters создана успешно!")
         else:
             await message.answer("❌ Не удалось создать таблицу user_filters")
-        
-        conn.close()
-        
+
     except Exception as e:
         await message.answer(f"❌ Ошибка при создании таблицы: {e}")
 
@@ -764,19 +688,18 @@ async def test_filter_save_command(message: Message):
     test_targets = ["Отношения", "Дружба"]
     test_distance = 15
     
-    print("=== ТЕСТ СОХРАНЕНИЯ ФИЛЬТРОВ ===")
-    
     # Тест сохранения целей
-    success1 = save_user_target_filters(message.from_user.id, test_targets)
-    print(f"Результат сохранения целей: {success1}")
+    success1 = await db.save_user_target_filters(message.from_user.id, test_targets)
+    logger.info("Тест фильтров: сохранение целей %s", success1)
     
     # Тест сохранения расстояния
-    success2 = save_user_distance_filter(message.from_user.id, test_distance)
-    print(f"Результат сохранения расстояния: {success2}")
+    success2 = await db.save_user_distance_filter(message.from_user.id, test_distance)
+    logger.info("Тест фильтров: сохранение расстояния %s", success2)
+    deck.invalidate(message.from_user.id)
     
     # Проверяем загрузку
-    loaded_filters = get_user_filters(message.from_user.id)
-    print(f"Загруженные фильтры: {loaded_filters}")
+    loaded_filters = await db.get_user_filters(message.from_user.id)
+    logger.info("Тест фильтров: загружены %r", loaded_filters)
     
     await message.answer(
         f"🧪 Тест сохранения фильтров:\n"
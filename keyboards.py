@@ -81,6 +81,11 @@ distance_keyboard = InlineKeyboardMarkup(
         [InlineKeyboardButton(text="🌍 Без ограничений", callback_data="filter_distance_unlimited")]
     ]
 )
+# Расстояния с кнопок distance_keyboard, км (без "Без ограничений")
+DISTANCE_OPTIONS = tuple(
+    int(row[0].callback_data.replace("filter_distance_", ""))
+    for row in distance_keyboard.inline_keyboard if row[0].callback_data != "filter_distance_unlimited"
+)
 
 # Клавиатура после завершения настройки фильтров (остается такой же)
 filters_completed_keyboard = InlineKeyboardMarkup(
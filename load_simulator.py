@@ -0,0 +1,297 @@
+"""
+Сквозная нагрузка без Telegram: скриптовые пользователи проходят регистрацию,
+настройку фильтров и сессию свайпов через настоящий Dispatcher и handlers.py.
+Апдейты приходят через FakeTelegram (long polling или webhook), ответы бота
+уходят туда же. Каждый пользователь шлет следующий апдейт только после того,
+как бот обработал предыдущий, как человек, который ждет ответа.
+
+    python load_simulator.py --users 10000 --swipes 20
+    python load_simulator.py --users 2000 --ingress webhook --api-latency 0.05 --think 0.5
+
+Отчет: апдейтов в секунду, задержка апдейта по этапам сценария (от отправки
+до конца обработки), время каждого обработчика (metrics.py) и число вызовов
+Bot API по методам. Код выхода 1, если были ошибки, таймауты или апдейты без
+обработчика. Рабочая db.sqlite3 не трогается: база во временном каталоге,
+если не задан --db.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+TARGET_BUTTONS = ["🤝 Дружба", "💬 Общение", "❤️ Отношения", "😌 Ничего серьезного", "🌟 Свидания"]
+DISTANCES = ["5", "10", "30", "50", "unlimited"]
+NAMES = ["Алексей", "Мария", "Дмитрий", "Елена", "Андрей", "Анна", "Максим", "София"]
+FIRST_USER_ID = 1_000_000_000  # выше telegram_id анкет из --population
+
+
+class Simulation:
+    """Отправка апдейтов и ожидание конца их обработки; статистика прогона"""
+
+    def __init__(self, send, timeout):
+        self._send = send
+        self.timeout = timeout
+        self._waiters = {}  # update_id -> (future, этап)
+        self.latencies = defaultdict(list)  # этап -> секунды от отправки до конца обработки
+        self.sent = 0
+        self.done = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.unhandled = Counter()
+
+    async def step(self, stage, update):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[update["update_id"]] = (future, stage)
+        started = time.perf_counter()
+        self.sent += 1
+        await self._send(update)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(update["update_id"], None)
+            self.timeouts += 1
+            return
+        self.latencies[stage].append(time.perf_counter() - started)
+
+    def completed(self, update_id, handled, failed):
+        entry = self._waiters.pop(update_id, None)
+        self.done += 1
+        if failed:
+            self.errors += 1
+        if entry is None:
+            return
+        future, stage = entry
+        if not handled:
+            self.unhandled[stage] += 1
+        if not future.done():
+            future.set_result(None)
+
+
+def completion_middleware(sim):
+    """Outer-middleware на dp.update: сообщает симуляции, что апдейт обработан"""
+    from aiogram import BaseMiddleware
+    from aiogram.dispatcher.event.bases import UNHANDLED
+
+    class Completion(BaseMiddleware):
+        async def __call__(self, handler, event, data):
+            result = UNHANDLED
+            failed = False
+            try:
+                result = await handler(event, data)
+                return result
+            except Exception:
+                failed = True
+                raise
+            finally:
+                sim.completed(event.update_id, result is not UNHANDLED or failed, failed)
+
+    return Completion()
+
+
+async def user_script(sim, tg, user_id, rnd, args, cities):
+    """Регистрация, иногда настройка фильтров, затем args.swipes свайпов"""
+    async def pause():
+        if args.think:
+            await asyncio.sleep(rnd.expovariate(1 / args.think))
+
+    async def say(stage, text=None, **fields):
+        await sim.step(stage, tg.message_update(user_id, text, **fields))
+        await pause()
+
+    async def press(stage, data):
+        await sim.step(stage, tg.callback_update(user_id, data))
+        await pause()
+
+    await asyncio.sleep(rnd.uniform(0, args.ramp))
+    await say("registration", "/start")
+    await press("registration", rnd.choice(["gender_male", "gender_female"]))
+    await say("registration", rnd.choice(NAMES))
+    await say("registration", str(rnd.randint(18, 45)))
+    city, lat, lon, _ = rnd.choices(cities, weights=[population for *_, population in cities])[0]
+    if rnd.random() < args.location_share:
+        await say("registration", location={"latitude": lat + rnd.gauss(0, 0.05), "longitude": lon + rnd.gauss(0, 0.05)})
+    else:
+        await say("registration", city)
+    await say("registration", rnd.choice(TARGET_BUTTONS))
+    await say("registration", "Люблю путешествовать и читать книги.")
+    await say("registration", photo=[{
+        "file_id": f"photo-{user_id}", "file_unique_id": f"u{user_id}", "width": 640, "height": 640,
+    }])
+
+    if rnd.random() < args.filters_share:
+        await say("filters", "🔧 Настроить фильтры")
+        await say("filters", "🎯 Цель")
+        for button in rnd.sample(TARGET_BUTTONS, rnd.randint(1, 3)):
+            await press("filters", "filter_target_" + button.split(" ", 1)[1])
+        await press("filters", "filter_targets_save")
+        await say("filters", "📍 Расстояние")
+        await press("filters", "filter_distance_" + rnd.choice(DISTANCES))
+        await say("swipes", "👀 Посмотреть анкеты")
+    else:
+        await say("swipes", "👀 Смотреть анкеты")
+    for _ in range(args.swipes):
+        await say("swipes", "❤️ Лайк" if rnd.random() < args.like_share else "👎 Дизлайк")
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def simulate(args):
+    from aiogram import Dispatcher
+    import aiohttp
+
+    import async_database
+    import database
+    import deck
+    import fsm_storage
+    import geocoding
+    import metrics
+    import reset_and_populate_db
+    from config import EXCLUSION_INDEX
+    from fake_telegram import FakeTelegram
+    from handlers import router
+    from webhook import WebhookServer
+
+    if args.population:
+        started = time.perf_counter()
+        reset_and_populate_db.generate_dataset(args.population, seed=args.seed, swipes_per_user=args.history,
+                                               path=database.DB_PATH, now=int(time.time()))
+        print(f"База: {args.population:,} анкет за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    else:
+        database.init_db()
+    if EXCLUSION_INDEX:
+        database.rebuild_exclusion_index()
+
+    tg = await FakeTelegram(latency=args.api_latency).start()
+    bot = tg.make_bot()
+    storage = fsm_storage.create_storage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    metrics.install(dp, bot)
+    likes_flusher = asyncio.create_task(async_database.flush_likes_periodically())
+
+    session = server = polling = None
+    if args.ingress == "webhook":
+        server = await WebhookServer(dp, bot, path="/webhook", secret="", workers=args.workers,
+                                     dispatcher=dp).start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.port}/webhook"
+        # Telegram держит не больше max_connections соединений с webhook
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.max_connections))
+
+        async def send(update):
+            while True:
+                async with session.post(url, json=update) as response:
+                    if response.status not in (429, 503):
+                        return
+                tg.retries += 1
+                await asyncio.sleep(0.05)
+    else:
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+        async def send(update):
+            tg.push(update)
+
+    sim = Simulation(send, args.timeout)
+    dp.update.outer_middleware(completion_middleware(sim))
+    cities = reset_and_populate_db.load_cities()
+    rnd = random.Random(args.seed)
+    users = [
+        user_script(sim, tg, FIRST_USER_ID + i, random.Random(rnd.random()), args, cities)
+        for i in range(args.users)
+    ]
+
+    async def progress():
+        last = 0
+        while True:
+            await asyncio.sleep(5)
+            print(f"  обработано {sim.done:,} апдейтов (+{(sim.done - last) / 5:,.0f}/с)", file=sys.stderr)
+            last = sim.done
+
+    reporter = asyncio.create_task(progress())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - started
+    finally:
+        reporter.cancel()
+        if polling:
+            await dp.stop_polling()
+            await polling
+        if server:
+            await server.stop()
+        if session:
+            await session.close()
+        likes_flusher.cancel()
+        await async_database.flush_likes()
+        await bot.session.close()
+        await tg.close()
+        await geocoding.close()
+        deck.close()
+        await storage.close()
+
+    with database.db_connection() as conn:
+        totals = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("users", "likes", "matches")]
+    async_database.shutdown()
+
+    print(f"Пользователей {args.users:,}, апдейтов {sim.done:,} за {elapsed:.1f} с: "
+          f"{sim.done / elapsed:,.0f} апдейтов/сек ({args.ingress}, задержка API {args.api_latency * 1000:.0f} мс)")
+    print("Задержка апдейта, мс (отправка → конец обработки):")
+    for stage, samples in sim.latencies.items():
+        ordered = sorted(samples)
+        print(f"  {stage:12} n={len(ordered):<8,} p50 {_percentile(ordered, 0.5) * 1000:7.1f} | "
+              f"p90 {_percentile(ordered, 0.9) * 1000:7.1f} | p99 {_percentile(ordered, 0.99) * 1000:7.1f} | "
+              f"max {ordered[-1] * 1000:7.1f}")
+    print("Обработчики (metrics.py, p50/p99 - верхние границы корзин):")
+    for line in metrics.summary():
+        if line.startswith("dating_handler_seconds"):
+            print("  " + line.replace("dating_handler_seconds", "", 1))
+    print("Вызовы Bot API: " + ", ".join(f"{method} {count:,}" for method, count in tg.calls.most_common()))
+    print(f"В базе: анкет {totals[0]:,}, свайпов {totals[1]:,}, матчей {totals[2]:,}")
+    print(f"Ошибок в обработчиках {sim.errors}, без обработчика {dict(sim.unhandled) or 0}, "
+          f"таймаутов {sim.timeouts}, повторов webhook {tg.retries}")
+    return 1 if sim.errors or sim.timeouts or sim.unhandled else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="одновременных скриптовых пользователей")
+    parser.add_argument("--swipes", type=int, default=20, help="свайпов на пользователя после регистрации")
+    parser.add_argument("--like-share", type=float, default=0.35, help="доля лайков среди свайпов")
+    parser.add_argument("--filters-share", type=float, default=0.5, help="доля пользователей, настраивающих фильтры")
+    parser.add_argument("--location-share", type=float, default=0.5,
+                        help="доля пользователей, отправляющих геолокацию вместо названия города")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза пользователя между действиями, с")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--population", type=int, default=0,
+                        help="заранее сгенерировать столько анкет (reset_and_populate_db.generate_dataset)")
+    parser.add_argument("--history", type=float, default=5, help="свайпов на анкету в --population")
+    parser.add_argument("--ingress", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков webhook")
+    parser.add_argument("--max-connections", type=int, default=40, help="соединений с webhook")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа фейкового Bot API, с")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать обработки одного апдейта, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="база вместо временной (будет перезаписана при --population)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # До импорта config: своя база и офлайн-геокодер, чтобы прогон не трогал рабочие данные и сеть
+    os.environ["DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(prefix="dating_sim_"), "sim.sqlite3")
+    os.environ.setdefault("GEOCODER_MODE", "offline")
+    import logging_setup
+
+    print(f"База симуляции: {os.environ['DB_PATH']}", file=sys.stderr)
+    logging_setup.setup(level=args.log_level.upper())
+    try:
+        return asyncio.run(simulate(args))
+    finally:
+        logging_setup.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
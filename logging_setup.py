@@ -0,0 +1,54 @@
+"""
+Логирование без блокировки обработчиков.
+
+Записи попадают в очередь (QueueHandler), а в stderr их пишет отдельный поток
+QueueListener: обработчик бота и потоки пула базы не ждут вывода. Сообщения
+форматируются лениво (logger.debug("... %s", value)), поэтому при уровне выше
+DEBUG отладочные вызовы стоят одну проверку уровня.
+
+    logging_setup.setup()      # при старте, уровень из LOG_LEVEL
+    logging_setup.shutdown()   # дописывает очередь при остановке
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+_listener = None
+
+
+def setup(level=LOG_LEVEL, stream=None, fmt=LOG_FORMAT):
+    """Перенастраивает корневой логгер на очередь; повторный вызов сначала останавливает прежний поток"""
+    global _listener
+    shutdown()
+
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(logging.Formatter(fmt))
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    # aiogram пишет строку на каждый апдейт в INFO; оставляем ее только для DEBUG
+    if root.getEffectiveLevel() > logging.DEBUG:
+        logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown():
+    """Останавливает поток записи, дописав все, что уже в очереди"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,118 @@
+"""
+Фоновое обслуживание базы: таблица likes только растет, а свайпы старше
+кулдауна нужны лишь матчам, и то только лайки. Раз в MAINTENANCE_INTERVAL
+секунд отжившие строки (database.EXPIRED_SWIPE) переносятся в likes_archive,
+освободившиеся страницы возвращаются ОС (incremental_vacuum), а статистика
+планировщика обновляется (PRAGMA optimize).
+
+Работа одного прохода ограничена: не больше MAINTENANCE_BATCHES транзакций по
+MAINTENANCE_BATCH_SIZE строк, между ними пауза, чтобы запись свайпов и
+регистрации не ждала блокировку базы. Что не успели, доделает следующий проход.
+
+    asyncio.create_task(maintenance.run_periodically())   # bot.py
+    python maintenance.py               # один проход вручную
+    python maintenance.py --vacuum      # разовый VACUUM старой базы под auto_vacuum=INCREMENTAL
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import async_database as db
+from config import (
+    MAINTENANCE_INTERVAL, MAINTENANCE_BATCHES, MAINTENANCE_BATCH_SIZE, MAINTENANCE_VACUUM_PAGES, LIKES_ARCHIVE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Пауза между транзакциями прохода, секунды
+BATCH_PAUSE = 0.05
+
+# id последней разобранной строки likes. Оставшиеся старые лайки лежат до него,
+# поэтому следующий проход продолжает отсюда; после перезапуска разбор начнется
+# сначала и один раз просмотрит их заново.
+_cursor = 0
+
+
+async def run_once(batches=MAINTENANCE_BATCHES, batch_size=MAINTENANCE_BATCH_SIZE,
+                   vacuum_pages=MAINTENANCE_VACUUM_PAGES, archive=LIKES_ARCHIVE, pause=BATCH_PAUSE):
+    """Один ограниченный проход; возвращает словарь с числом строк и временем этапов"""
+    global _cursor
+    started = time.perf_counter()
+    report = {"batches": 0, "scanned": 0, "archived": 0, "freed_pages": 0, "finished": False}
+    for _ in range(batches):
+        scanned, moved, _cursor, finished = await db.archive_expired_likes(_cursor, batch_size, archive)
+        report["batches"] += 1
+        report["scanned"] += scanned
+        report["archived"] += moved
+        if finished:
+            report["finished"] = True
+            break
+        await asyncio.sleep(pause)
+    report["archive_seconds"] = time.perf_counter() - started
+
+    step = time.perf_counter()
+    report["freed_pages"] = await db.incremental_vacuum(vacuum_pages)
+    report["vacuum_seconds"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    await db.optimize_db()
+    report["optimize_seconds"] = time.perf_counter() - step
+    report["seconds"] = time.perf_counter() - started
+
+    logger.info(
+        "Обслуживание базы: просмотрено %s строк likes, %s %s, освобождено страниц %s; "
+        "%.2f с (архив %.2f, vacuum %.2f, optimize %.2f)",
+        report["scanned"], "в архив" if archive else "удалено", report["archived"], report["freed_pages"],
+        report["seconds"], report["archive_seconds"], report["vacuum_seconds"], report["optimize_seconds"],
+    )
+    return report
+
+
+async def run_periodically(interval=MAINTENANCE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_once()
+        except Exception as e:
+            logger.error("Ошибка обслуживания базы: %r", e)
+
+
+async def _main(args):
+    import database
+    import logging_setup
+
+    logging_setup.setup()
+    database.init_db()
+    try:
+        before = await db.database_stats()
+        if args.vacuum:
+            started = time.perf_counter()
+            await db.run(database.vacuum)
+            logger.info("VACUUM за %.1f с", time.perf_counter() - started)
+        else:
+            while True:
+                report = await run_once(batches=args.batches, batch_size=args.batch_size,
+                                        archive=not args.delete)
+                if not args.all or report["finished"]:
+                    break
+        logger.info("До: %s", before)
+        logger.info("После: %s", await db.database_stats())
+    finally:
+        db.shutdown()
+        logging_setup.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=MAINTENANCE_BATCHES, help="транзакций за проход")
+    parser.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE, help="строк likes в транзакции")
+    parser.add_argument("--all", action="store_true", help="повторять проходы, пока не разобрана вся старая часть")
+    parser.add_argument("--delete", action="store_true", help="удалять отжившие свайпы, а не переносить в архив")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="полный VACUUM: включает auto_vacuum=INCREMENTAL у базы, созданной до него")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
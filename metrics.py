@@ -0,0 +1,260 @@
+"""
+Метрики бота: гистограммы длительности апдейтов, обработчиков, запросов к базе
+и вызовов Telegram API, плюс разбивка времени обработчика на базу и API.
+
+По умолчанию выключены (METRICS_ENABLED). Тогда middleware не регистрируются,
+а обертка запросов к базе в async_database стоит одну проверку флага.
+
+    metrics.install(dp, bot)           # middleware, включает сбор
+    text = metrics.render_prometheus() # то же отдает GET /metrics (METRICS_PORT)
+    metrics.summary()                  # строки p50/p99, их пишет dump_periodically()
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_DUMP_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Проверяется на каждом вызове обертки запросов; переключается install() и бенчмарком
+enabled = METRICS_ENABLED
+
+# Верхние границы корзин в секундах, от 100 мкс до 10 с
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# имя -> (тип, имя метки, описание)
+METRICS = {
+    "dating_update_seconds": ("histogram", "type", "Полная обработка апдейта Telegram"),
+    "dating_handler_seconds": ("histogram", "handler", "Время обработчика"),
+    "dating_handler_errors_total": ("counter", "handler", "Исключения в обработчике"),
+    "dating_handler_db_seconds_total": ("counter", "handler", "Ожидание базы внутри обработчика"),
+    "dating_handler_api_seconds_total": ("counter", "handler", "Вызовы Telegram API внутри обработчика"),
+    "dating_db_query_seconds": ("histogram", "query", "Выполнение функции базы в потоке пула"),
+    "dating_db_query_rows_total": ("counter", "query", "Строк вернула функция базы"),
+    "dating_telegram_api_seconds": ("histogram", "method", "Запрос к Telegram Bot API"),
+}
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя корзина - +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        # bisect_left: значение, равное границе, попадает в ее корзину (le в Prometheus)
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Оценка сверху: граница корзины, в которую попал квантиль"""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    """Метрики по (имя, значение метки); пишут и event loop, и потоки пула базы"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, label, value):
+        with self._lock:
+            histogram = self._histograms.get((name, label))
+            if histogram is None:
+                histogram = self._histograms[name, label] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, label, value=1):
+        with self._lock:
+            self._counters[name, label] = self._counters.get((name, label), 0) + value
+
+    def histogram(self, name, label):
+        return self._histograms.get((name, label))
+
+    def counter(self, name, label):
+        return self._counters.get((name, label), 0)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render_prometheus(self):
+        """Текстовый формат экспозиции Prometheus 0.0.4"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for name, (kind, label_name, help_text) in METRICS.items():
+            if kind == "histogram":
+                series = [(label, h) for (metric, label), h in histograms if metric == name]
+            else:
+                series = [(label, v) for (metric, label), v in counters if metric == name]
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label, value in series:
+                labels = f'{label_name}="{_escape(label)}"'
+                if kind == "counter":
+                    lines.append(f"{name}{{{labels}}} {value}")
+                    continue
+                cumulative = 0
+                for bound, n in zip(BUCKETS, value.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {value.count}')
+                lines.append(f"{name}_sum{{{labels}}} {value.sum}")
+                lines.append(f"{name}_count{{{labels}}} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Строка на каждую гистограмму: число, среднее и оценки p50/p99 в мс"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        return [
+            f"{name}{{{label}}}: n={h.count} mean={h.sum / h.count * 1000:.2f}ms "
+            f"p50<={h.quantile(0.5) * 1000:g}ms p99<={h.quantile(0.99) * 1000:g}ms"
+            for (name, label), h in histograms if h.count
+        ]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+render_prometheus = registry.render_prometheus
+summary = registry.summary
+
+# [секунды в базе, секунды в Telegram API] текущего обработчика
+_handler_spent = contextvars.ContextVar("handler_spent", default=None)
+DB, API = 0, 1
+
+
+def add_handler_time(index, seconds):
+    spent = _handler_spent.get()
+    if spent is not None:
+        spent[index] += seconds
+
+
+def _row_count(result):
+    if result is None or result is False:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def timed_query(func):
+    """Обертка блокирующей функции базы: длительность и число строк под ее именем"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            registry.observe("dating_db_query_seconds", name, time.perf_counter() - started)
+        registry.inc("dating_db_query_rows_total", name, _row_count(result))
+        return result
+    return wrapper
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: весь апдейт, включая фильтры и FSM"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            registry.observe("dating_update_seconds", event.event_type, time.perf_counter() - started)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner-middleware: время конкретного обработчика и сколько из него ушло на базу и API"""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        spent = [0.0, 0.0]
+        token = _handler_spent.set(spent)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            registry.inc("dating_handler_errors_total", name)
+            raise
+        finally:
+            registry.observe("dating_handler_seconds", name, time.perf_counter() - started)
+            _handler_spent.reset(token)
+            registry.inc("dating_handler_db_seconds_total", name, spent[DB])
+            registry.inc("dating_handler_api_seconds_total", name, spent[API])
+
+
+class TelegramApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: длительность каждого метода Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.observe("dating_telegram_api_seconds", type(method).__name__, elapsed)
+            add_handler_time(API, elapsed)
+
+
+def install(dp, bot):
+    """Регистрирует middleware и включает сбор метрик"""
+    global enabled
+    enabled = True
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    # Inner-middleware корневого роутера действуют и на обработчики вложенных
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+    bot.session.middleware(TelegramApiTimingMiddleware())
+
+
+async def start_server(port, host="0.0.0.0"):
+    """HTTP-сервер с GET /metrics; возвращает runner для cleanup()"""
+    async def handle_metrics(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики Prometheus: http://%s:%s/metrics", host, port)
+    return runner
+
+
+async def dump_periodically(interval=METRICS_DUMP_INTERVAL):
+    """Пишет summary() в лог раз в interval секунд"""
+    while True:
+        await asyncio.sleep(interval)
+        lines = summary()
+        if lines:
+            logger.info("Метрики за все время:\n%s", "\n".join(lines))
@@ -1,11 +1,28 @@
 """
 Скрипт для полного сброса базы данных и добавления тестовых пользователей
 ВНИМАНИЕ: Этот скрипт удалит ВСЕ данные из базы!
+
+Без аргументов - 15 тестовых анкет. С --users N - синтетическая база для
+нагрузочных тестов: N анкет вокруг городов из cities.csv, история свайпов
+и матчей, воспроизводимая по --seed:
+
+    python reset_and_populate_db.py --users 1000000 --swipes 5 --seed 1 --yes
 """
+import argparse
+import bisect
+import csv
+import json
+import math
 import os
+import random
 import sqlite3
+import time
+
+import database
+import gazetteer
 from database import init_db, add_user, get_user_by_telegram_id
 from config import DB_PATH
+from keyboards import DISTANCE_OPTIONS
 
 
 def reset_database():
@@ -370,8 +387,190 @@ def add_test_filters():
             print(f"❌ Ошибка при добавлении фильтров для {filter_data['telegram_id']}: {e}")
 
 
+# ========== Синтетическая база ==========
+TARGET_WEIGHTS = {"Отношения": 30, "Общение": 20, "Дружба": 20, "Свидания": 18, "Ничего серьезного": 12}
+MALE_NAMES = ["Алексей", "Дмитрий", "Андрей", "Максим", "Игорь", "Сергей", "Владимир", "Артем", "Иван", "Никита"]
+FEMALE_NAMES = ["Мария", "Елена", "Анна", "София", "Виктория", "Екатерина", "Ольга", "Дарья", "Полина", "Алина"]
+BIOS = [
+    "Люблю путешествовать и читать книги.",
+    "Программист, увлекаюсь технологиями.",
+    "Обожаю природу и активный отдых.",
+    "Музыкант, играю на гитаре.",
+    "Готовлю лучше всех, кого знаю.",
+    "Ищу компанию для кино и прогулок.",
+]
+KM_PER_DEGREE = 111.2
+
+
+def load_cities(path=gazetteer.CITIES_PATH):
+    """[(название, широта, долгота, население), ...] из cities.csv"""
+    with open(path, encoding="utf-8", newline="") as f:
+        return [(row["name"], float(row["latitude"]), float(row["longitude"]), int(row["population"]))
+                for row in csv.DictReader(f)]
+
+
+# Момент "сейчас" сгенерированной базы по умолчанию (2026-01-01 UTC): с одним seed
+# получается одна и та же база, когда бы ее ни сгенерировали
+DATASET_NOW = 1767225600
+
+
+def generate_dataset(users, seed=42, swipes_per_user=0, like_share=0.35, mutual_share=0.25, days=30,
+                     filters_share=0.2, start_id=100000, path=None, now=DATASET_NOW):
+    """
+    Пересоздает базу path (по умолчанию DB_PATH) с users анкетами и историей свайпов.
+
+    Анкеты распределены по городам cities.csv пропорционально населению и лежат
+    облаком вокруг центра: чем больше город, тем шире облако. У каждого в среднем
+    swipes_per_user свайпов по анкетам своего города (like с долей like_share);
+    на долю mutual_share лайков приходит ответный лайк, и такие пары дают матч.
+    Свайпы размазаны по days дням до now (unix time). Кулдаун бот считает от
+    настоящего времени, поэтому для замеров сразу после генерации передают
+    now=int(time.time()). Фильтры расстояния - как на distance_keyboard или без
+    ограничения. Все пишется executemany одной транзакцией; возвращает
+    telegram_id созданных анкет.
+    """
+    path = path or database.DB_PATH
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.DB_PATH = path
+    database.close_connections()
+    database.clear_profile_cache()
+    database.clear_filter_cache()
+    init_db()
+    database.close_connections()
+
+    rnd = random.Random(seed)
+    cities = load_cities()
+    largest = max(population for *_, population in cities)
+    cumulative, total = [], 0
+    for *_, population in cities:
+        total += population
+        cumulative.append(total)
+    targets, target_weights = list(TARGET_WEIGHTS), list(TARGET_WEIGHTS.values())
+
+    ids = list(range(start_id, start_id + users))
+    user_rows = []
+    by_city = {}  # (город, пол) -> telegram_id, кандидаты для свайпов
+    for telegram_id in ids:
+        name, lat0, lon0, population = cities[bisect.bisect_left(cumulative, rnd.random() * total)]
+        # Радиус облака: ~3 км у маленьких городов, ~20 км у Москвы
+        spread_km = 3 + 17 * math.sqrt(population / largest)
+        lat = lat0 + rnd.gauss(0, spread_km / KM_PER_DEGREE)
+        lon = lon0 + rnd.gauss(0, spread_km / (KM_PER_DEGREE * max(0.1, math.cos(math.radians(lat0)))))
+        gender = "male" if rnd.random() < 0.5 else "female"
+        age = min(60, 18 + int(rnd.expovariate(1 / 8)))
+        user_rows.append((
+            telegram_id, rnd.choice(MALE_NAMES if gender == "male" else FEMALE_NAMES), gender, age, name,
+            lat, lon, database.geocell_for(lat, lon), rnd.choices(targets, target_weights)[0],
+            rnd.choice(BIOS), None,
+        ))
+        by_city.setdefault((name, gender), []).append(telegram_id)
+
+    filter_rows = []
+    for telegram_id in ids:
+        if rnd.random() < filters_share:
+            chosen = rnd.sample(targets, rnd.randint(1, 3))
+            filter_rows.append((telegram_id, json.dumps(chosen, ensure_ascii=False), rnd.choice((None,) + DISTANCE_OPTIONS)))
+
+    like_rows, match_pairs = [], {}  # (user1, user2) -> время ответного лайка
+    if swipes_per_user:
+        horizon = days * 86400
+        for telegram_id, _, gender, _, city, *_ in user_rows:
+            pool = by_city.get((city, "female" if gender == "male" else "male"))
+            if not pool:
+                continue
+            for _ in range(min(len(pool), int(rnd.expovariate(1 / swipes_per_user)))):
+                target = pool[int(rnd.random() * len(pool))]
+                created = now - int(rnd.random() * horizon)
+                if rnd.random() >= like_share:
+                    like_rows.append((telegram_id, target, "dislike", created))
+                    continue
+                like_rows.append((telegram_id, target, "like", created))
+                if rnd.random() < mutual_share:
+                    # Ответный лайк чуть позже, на него и создается матч
+                    reply = min(now, created + int(rnd.random() * 3600))
+                    like_rows.append((target, telegram_id, "like", reply))
+                    match_pairs.setdefault((min(telegram_id, target), max(telegram_id, target)), reply)
+        # Бот дописывает свайпы по времени, и id в likes растут вместе с created_at
+        like_rows.sort(key=lambda row: row[3])
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    # База создается с нуля: при сбое ее просто генерируют заново
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("BEGIN")
+    # Индексы users и likes быстрее построить один раз по готовым данным, чем обновлять на каждой вставке
+    indexes = conn.execute("""
+    SELECT name, sql FROM sqlite_master
+    WHERE type = 'index' AND tbl_name IN ('users', 'likes') AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+    """).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    conn.executemany("""
+    INSERT INTO users (telegram_id, name, gender, age, city, latitude, longitude, geocell, target, bio, photo)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, user_rows)
+    # Время строк тоже от now, а не CURRENT_TIMESTAMP: иначе база зависит от момента генерации
+    conn.executemany("""
+    INSERT INTO user_filters (telegram_id, target_filters, distance_filter, created_at, updated_at)
+    VALUES (?1, ?2, ?3, datetime(?4, 'unixepoch'), datetime(?4, 'unixepoch'))
+    """, [row + (now,) for row in filter_rows])
+    # created_at в формате CURRENT_TIMESTAMP; datetime() в SQLite быстрее strftime на каждую строку
+    conn.executemany("""
+    INSERT INTO likes (from_user, to_user, action, created_at, created_ts)
+    VALUES (?1, ?2, ?3, datetime(?4, 'unixepoch'), ?4)
+    """, like_rows)
+    conn.executemany("INSERT OR IGNORE INTO matches (user1, user2, created_at) VALUES (?, ?, datetime(?, 'unixepoch'))",
+                     [pair + (created,) for pair, created in sorted(match_pairs.items())])
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA optimize")
+    conn.close()
+    return ids
+
+
+def generate_main(args):
+    path = args.db or DB_PATH
+    if not args.yes:
+        print(f"🚨 База {path} будет пересоздана. Продолжить? (y/N): ", end="")
+        if input().strip().lower() not in ['y', 'yes', 'д', 'да']:
+            print("❌ Операция отменена")
+            return
+    started = time.perf_counter()
+    ids = generate_dataset(
+        args.users, seed=args.seed, swipes_per_user=args.swipes, like_share=args.like_share,
+        mutual_share=args.mutual_share, days=args.days, filters_share=args.filters_share,
+        start_id=args.start_id, path=path, now=args.now,
+    )
+    elapsed = time.perf_counter() - started
+    conn = sqlite3.connect(path)
+    likes, matches = (conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("likes", "matches"))
+    conn.close()
+    print(f"✅ {path}: {len(ids):,} анкет, {likes:,} свайпов, {matches:,} матчей за {elapsed:.1f} с")
+
+
 def main():
     """Основная функция"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, help="сгенерировать столько анкет вместо тестовых")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--swipes", type=float, default=5, help="свайпов на анкету в среднем")
+    parser.add_argument("--like-share", type=float, default=0.35, help="доля лайков среди свайпов")
+    parser.add_argument("--mutual-share", type=float, default=0.25, help="доля лайков со взаимностью (матчем)")
+    parser.add_argument("--days", type=int, default=30, help="за сколько последних дней история свайпов")
+    parser.add_argument("--filters-share", type=float, default=0.2, help="доля анкет с настроенными фильтрами")
+    parser.add_argument("--start-id", type=int, default=100000, help="telegram_id первой анкеты")
+    parser.add_argument("--now", type=int, default=DATASET_NOW,
+                        help="unix time, от которого отсчитывается история свайпов; "
+                             "для базы, с которой бот запустится сразу, $(date +%%s)")
+    parser.add_argument("--db", help="путь к базе вместо DB_PATH")
+    parser.add_argument("--yes", action="store_true", help="не спрашивать подтверждение")
+    args = parser.parse_args()
+    if args.users is not None:
+        generate_main(args)
+        return
+
     print("🚨 ВНИМАНИЕ! Этот скрипт полностью удалит текущую базу данных!")
     print("Вы уверены, что хотите продолжить? (y/N): ", end="")
     
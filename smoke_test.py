@@ -1,14 +1,18 @@
 """Quick smoke test for database functions.
 Run this locally to verify DB creation and basic operations without starting the bot.
+The geocoding and webhook checks talk to local servers, so no network access is needed.
 """
+import asyncio
+import time
+
 from database import init_db, add_user, get_user_by_telegram_id, add_like, check_match, get_matches_for_user
 
 
 def run():
     init_db()
     # create two users
-    add_user(telegram_id=1001, gender='male', age=30, city='CityA', target='female', bio='Hi', photo=None)
-    add_user(telegram_id=1002, gender='female', age=28, city='CityB', target='male', bio='Hello', photo=None)
+    add_user(telegram_id=1001, name='UserA', gender='male', age=30, city='CityA', target='female', bio='Hi', photo=None)
+    add_user(telegram_id=1002, name='UserB', gender='female', age=28, city='CityB', target='male', bio='Hello', photo=None)
 
     u1 = get_user_by_telegram_id(1001)
     u2 = get_user_by_telegram_id(1002)
@@ -22,5 +26,183 @@ def run():
     print('Matches for user1:', get_matches_for_user(1001))
 
 
+def run_exclusion():
+    """The exclusion index must hide exactly what the SQL cooldown hides, boundary day included."""
+    import database
+    from database import db_connection, get_candidate_ids, rebuild_exclusion_index, drop_exclusion_index
+
+    viewer, others = 2000, list(range(2001, 2031))
+    with db_connection() as conn:
+        conn.execute("DELETE FROM likes WHERE from_user = ?", (viewer,))
+        for telegram_id in [viewer] + others:
+            conn.execute("INSERT OR IGNORE INTO users (telegram_id, name, gender, age, city, target) "
+                         "VALUES (?, 'X', 'female', 25, 'CityX', 'Дружба')", (telegram_id,))
+        # Every 5 hours back from now: inside the window, the boundary day and expired swipes
+        for i, telegram_id in enumerate(others[:25]):
+            conn.execute("INSERT INTO likes (from_user, to_user, action, created_at) "
+                         "VALUES (?, ?, 'dislike', datetime('now', ?))", (viewer, telegram_id, f'-{i * 10} hours'))
+
+    drop_exclusion_index()
+    expected = set(get_candidate_ids(viewer, limit=100000))
+    rebuild_exclusion_index()
+    database.add_like(viewer, others[-1], action='like')
+    indexed = set(get_candidate_ids(viewer, limit=100000))
+    print('Exclusion index:', database.exclusion_stats(), 'candidates:', len(indexed))
+    assert others[-1] in expected and indexed == expected - {others[-1]}
+
+    # Re-registering a swiped profile must keep it hidden: the index knows it by users.id
+    swiped = others[0]
+    before = database.get_user_by_telegram_id(swiped).id
+    database.add_user(swiped, 'Y', 'female', 26, 'CityX', 'Дружба', 'bio', 'photo')
+    assert database.get_user_by_telegram_id(swiped).id == before
+    indexed = set(get_candidate_ids(viewer, limit=100000))
+    drop_exclusion_index()
+    assert indexed == set(get_candidate_ids(viewer, limit=100000))
+    drop_exclusion_index()
+    database.flush_likes()
+
+
+def run_maintenance():
+    """Compaction moves expired dislikes and superseded likes, and keeps what cooldown and matches need."""
+    from database import db_connection, archive_expired_likes
+
+    viewer = 2100
+    swipes = [  # (to_user, action, age)
+        (2101, 'dislike', '-20 days'),  # expired: archived
+        (2102, 'dislike', '-2 days'),   # inside the cooldown: kept
+        (2103, 'like', '-20 days'),     # the pair's only like: kept for check_match
+        (2104, 'like', '-20 days'),     # superseded by the later like below: archived
+        (2104, 'like', '-1 days'),
+    ]
+    with db_connection() as conn:
+        conn.execute("DELETE FROM likes WHERE from_user = ?", (viewer,))
+        after_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM likes").fetchone()[0]
+        # Rows are appended in time order, as the bot writes them
+        for to_user, action, age in sorted(swipes, key=lambda swipe: int(swipe[2].split()[0])):
+            conn.execute("INSERT INTO likes (from_user, to_user, action, created_at) "
+                         "VALUES (?, ?, ?, datetime('now', ?))", (viewer, to_user, action, age))
+
+    scanned, moved, last_id, finished = archive_expired_likes(after_id, 100)
+    with db_connection() as conn:
+        kept = sorted((row['to_user'], row['action']) for row in conn.execute(
+            "SELECT to_user, action FROM likes WHERE from_user = ?", (viewer,)))
+    print('Maintenance: scanned', scanned, 'archived', moved, 'kept', kept)
+    assert moved == 2 and finished and kept == [(2102, 'dislike'), (2103, 'like'), (2104, 'like')]
+
+
+async def run_geocoding():
+    """Reverse geocoding against a stub Nominatim: coalescing, caches, rate limit."""
+    from aiohttp import web
+    import geocoding
+
+    requests = []
+
+    async def reverse(request):
+        requests.append(time.monotonic())
+        await asyncio.sleep(0.05)
+        lat = float(request.query['lat'])
+        return web.json_response({'address': {'city': f'Stub city {lat:.2f}', 'country': 'Stubland'}})
+
+    app = web.Application()
+    app.router.add_get('/reverse', reverse)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}/reverse'
+
+    try:
+        # Use a unique spot so earlier runs' persistent cache doesn't hide requests;
+        # lat stays within 10..80 so lat + 2 below is still a valid latitude
+        lat = round(10 + (time.time() % 700) / 10, 2)
+        geocoder = geocoding.ReverseGeocoder(url=url, rate=10, mode='remote')
+        cities = await asyncio.gather(*[geocoder.city_for(lat, 20.0) for _ in range(5)])
+        print('Concurrent identical lookups:', set(cities), 'requests:', len(requests))
+        assert len(set(cities)) == 1 and len(requests) == 1
+
+        await geocoder.city_for(lat + 0.001, 20.001)
+        print('Nearby lookup served from memory, requests:', len(requests))
+        assert len(requests) == 1
+
+        await asyncio.gather(geocoder.city_for(lat + 1, 20.0), geocoder.city_for(lat + 2, 20.0))
+        gaps = [b - a for a, b in zip(requests, requests[1:])]
+        print('Gaps between requests at 10 req/s:', [f'{gap:.2f}' for gap in gaps])
+        assert all(gap >= 0.09 for gap in gaps)
+        await geocoder.close()
+
+        restarted = geocoding.ReverseGeocoder(url=url, rate=10, mode='remote')
+        await restarted.city_for(lat, 20.0)
+        print('After restart served from SQLite, requests:', len(requests), restarted.stats())
+        assert len(requests) == 3 and restarted.db_hits == 1
+        await restarted.close()
+
+        # Offline gazetteer: answers near a known city without the network,
+        # and replaces the "coordinates" fallback when the remote call fails
+        hybrid = geocoding.ReverseGeocoder(url=url, rate=10, mode='hybrid')
+        print('Hybrid near Moscow:', await hybrid.city_for(55.70, 37.55), 'requests:', len(requests))
+        assert len(requests) == 3
+        await hybrid.close()
+        dead = geocoding.ReverseGeocoder(url='http://127.0.0.1:9/reverse', rate=10, mode='remote')
+        city = await dead.city_for(59.93, 30.36)
+        print('Remote failure falls back to gazetteer:', city)
+        assert city == 'Санкт-Петербург'
+        await dead.close()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook():
+    """Malformed webhook bodies get 400 and never reach the update queue; stopping servers answer 503."""
+    import aiohttp
+    from webhook import WebhookServer
+
+    server = await WebhookServer(dp=None, bot=None, path='/webhook', secret='', workers=0).start('127.0.0.1', 0)
+    url = f'http://127.0.0.1:{server.port}/webhook'
+    try:
+        async with aiohttp.ClientSession() as session:
+            statuses = []
+            for body in (b'{"update_id": 1', b'\xff\xfe', b'[1, 2]', b'{"update_id": 2}'):
+                async with session.post(url, data=body, headers={'Content-Type': 'application/json'}) as resp:
+                    statuses.append(resp.status)
+        print('Webhook statuses:', statuses, server.stats())
+        assert statuses == [400, 400, 400, 200]
+        assert server.stats()['malformed'] == 3 and server.stats()['queued'] == 1
+    finally:
+        await server.stop(timeout=0)
+
+    # The multi-process supervisor shares the same checks; its workers are not started here
+    from aiohttp import web
+    from supervisor import Supervisor
+
+    sup = Supervisor(workers=1)
+    app = web.Application()
+    app.router.add_post('/webhook', lambda request: sup.handle_webhook(request, secret=''))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook'
+    try:
+        async with aiohttp.ClientSession() as session:
+            statuses = []
+            for body in (b'{"update_id": 1', b'[1, 2]', b'{"update_id": 2}'):
+                async with session.post(url, data=body, headers={'Content-Type': 'application/json'}) as resp:
+                    statuses.append(resp.status)
+            await sup.stop(timeout=1)
+            async with session.post(url, data=b'{"update_id": 3}') as resp:
+                statuses.append(resp.status)
+        print('Supervisor webhook statuses:', statuses, 'routed', sup.routed, 'malformed', sup.malformed)
+        assert statuses == [400, 400, 200, 503] and sup.routed == 1 and sup.malformed == 2
+    finally:
+        await runner.cleanup()
+
+
 if __name__ == '__main__':
     run()
+    run_exclusion()
+    run_maintenance()
+    asyncio.run(run_geocoding())
+    asyncio.run(run_webhook())
+    import async_database
+    async_database.shutdown()
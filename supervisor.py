@@ -0,0 +1,306 @@
+"""
+Несколько процессов-обработчиков за одним приемом апдейтов (BOT_WORKERS > 1).
+
+Родительский процесс только получает апдейты (long polling или webhook, как в
+RUN_MODE) и раскладывает их по воркерам по telegram_id % BOT_WORKERS. Все
+апдейты пользователя попадают в один процесс, поэтому его FSM, колода и
+текущая анкета живут там же. Внутри воркера апдейты снова делятся по
+пользователю на WORKER_LANES очередей, каждая обрабатывается по порядку:
+сообщения одного пользователя не обгоняют друг друга, разные пользователи
+обрабатываются параллельно.
+
+Кэши процесса (анкеты, фильтры, колоды) точны для его пользователей: их правки
+проходят через этот же воркер. Анкеты чужих пользователей кэшируются не дольше
+WORKER_PROFILE_CACHE_TTL секунд, столько же колода может показывать анкету,
+которую в другом воркере удалили или перевели на другую цель.
+
+Воркеры запускаются через spawn (одинаково на Linux и Windows) и пишут в общую
+SQLite-базу сами: WAL дает параллельное чтение, а BEGIN IMMEDIATE и busy_timeout
+(database.py) выстраивают запись процессов в очередь на блокировке базы.
+
+    sup = Supervisor(workers=4)
+    await sup.start()
+    await sup.poll()        # или sup.handle_webhook как обработчик aiohttp
+    await sup.stop()
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+import aiohttp
+from aiohttp import web
+
+from config import (
+    BOT_TOKEN, BOT_WORKERS, WORKER_QUEUE_SIZE, WORKER_LANES, RUN_MODE, METRICS_ENABLED, METRICS_PORT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_DRAIN_TIMEOUT, EXCLUSION_INDEX, MAINTENANCE_INTERVAL,
+)
+from webhook import RETRY_AFTER, read_update, stop_event
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://api.telegram.org"
+POLLING_TIMEOUT = 10
+
+
+def user_key(update):
+    """telegram_id автора апдейта; для апдейтов без автора - update_id"""
+    for value in update.values():
+        if isinstance(value, dict):
+            author = value.get("from") or value.get("user") or value.get("chat")
+            if author:
+                return author["id"]
+    return update.get("update_id", 0)
+
+
+class Supervisor:
+    def __init__(self, workers=BOT_WORKERS, token=BOT_TOKEN, api_base=API_BASE,
+                 queue_size=WORKER_QUEUE_SIZE, lanes=WORKER_LANES):
+        self.workers = workers
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.lanes = lanes
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processed = [self._ctx.Value("q", 0) for _ in range(workers)]
+        self._ready = [self._ctx.Event() for _ in range(workers)]
+        self._processes = []
+        self._draining = False
+        self.routed = 0
+        self.backoffs = 0
+        self.malformed = 0
+
+    async def start(self):
+        """Запускает воркеры и ждет, пока каждый поднимет Dispatcher"""
+        for index in range(self.workers):
+            process = self._ctx.Process(
+                target=_worker_main, name=f"bot-worker-{index}", daemon=True,
+                args=(index, self.workers, self._queues[index], self._processed[index], self._ready[index],
+                      self.token, self.api_base, self.lanes),
+            )
+            process.start()
+            self._processes.append(process)
+        loop = asyncio.get_running_loop()
+        for ready, process in zip(self._ready, self._processes):
+            while not await loop.run_in_executor(None, ready.wait, 1.0):
+                if not process.is_alive():
+                    raise RuntimeError(f"{process.name} завершился при запуске (код {process.exitcode})")
+        logger.info("Запущено воркеров: %s", self.workers)
+        return self
+
+    def route(self, update):
+        """Кладет апдейт в очередь его воркера; False, если очередь переполнена"""
+        try:
+            self._queues[user_key(update) % self.workers].put_nowait(update)
+        except queue.Full:
+            return False
+        self.routed += 1
+        return True
+
+    async def dispatch(self, update):
+        """route() с ожиданием: long polling просто перестает читать, пока воркер занят"""
+        while not self.route(update):
+            self.backoffs += 1
+            await asyncio.sleep(0.01)
+
+    def processed(self):
+        return sum(counter.value for counter in self._processed)
+
+    async def poll(self, allowed_updates=None, timeout=POLLING_TIMEOUT):
+        """getUpdates без разбора в объекты aiogram: родителю нужен только JSON и автор"""
+        url = f"{self.api_base}/bot{self.token}/getUpdates"
+        offset = 0
+        client_timeout = aiohttp.ClientTimeout(total=timeout + 10)
+        async with aiohttp.ClientSession(timeout=client_timeout) as session:
+            try:
+                while True:
+                    params = {"offset": offset, "timeout": timeout}
+                    if allowed_updates is not None:
+                        params["allowed_updates"] = allowed_updates
+                    try:
+                        async with session.post(url, json=params) as response:
+                            payload = await response.json()
+                    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                        logger.warning("getUpdates не удался: %r", e)
+                        await asyncio.sleep(1)
+                        continue
+                    if not payload.get("ok"):
+                        logger.warning("getUpdates вернул ошибку: %s", payload.get("description"))
+                        await asyncio.sleep(1)
+                        continue
+                    for update in payload["result"]:
+                        await self.dispatch(update)
+                        offset = update["update_id"] + 1
+            finally:
+                # Подтверждаем уже разосланные апдейты, чтобы после перезапуска они не пришли снова
+                if offset:
+                    try:
+                        async with session.post(url, json={"offset": offset, "timeout": 0, "limit": 1}):
+                            pass
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        pass
+
+    async def handle_webhook(self, request, secret=WEBHOOK_SECRET):
+        update, response = await read_update(request, secret, self._draining)
+        if response is not None:
+            if response.status == 400:
+                self.malformed += 1
+            return response
+        if not self.route(update):
+            self.backoffs += 1
+            return web.Response(status=429, headers={"Retry-After": RETRY_AFTER})
+        return web.Response()
+
+    async def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Воркеры дообрабатывают свои очереди и выходят; зависшие завершаются принудительно"""
+        self._draining = True
+        loop = asyncio.get_running_loop()
+        for worker_queue in self._queues:
+            # Очередь может быть полна: ждем места в пуле потоков, а не в цикле событий
+            try:
+                await loop.run_in_executor(None, worker_queue.put, None, True, timeout)
+            except queue.Full:
+                logger.warning("Очередь воркера полна дольше %s с, он будет остановлен принудительно", timeout)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("%s не завершился за %s с", process.name, timeout)
+                process.terminate()
+        self._processes = []
+
+
+# ========== Процесс-воркер ==========
+def _worker_main(index, workers, updates, processed, ready, token, api_base, lanes):
+    # Ctrl+C получает вся группа процессов; воркер останавливает родитель через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(index, workers, updates, processed, ready, token, api_base, lanes))
+
+
+async def _serve(index, workers, updates, processed, ready, token, api_base, lanes):
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.methods import TelegramMethod
+
+    import async_database
+    import database
+    import deck
+    import fsm_storage
+    import geocoding
+    import logging_setup
+    import maintenance
+    import metrics
+    from handlers import router
+
+    logging_setup.setup()
+    database.MULTIPROCESS = True
+    database.SHARD = (index, workers)
+    if EXCLUSION_INDEX:
+        # Свайпы пользователя делает только его воркер: индексу процесса нужны только его пользователи
+        database.rebuild_exclusion_index(shard=database.SHARD)
+    bot = Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(api_base)))
+    storage = fsm_storage.create_storage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    likes_flusher = asyncio.create_task(async_database.flush_likes_periodically())
+    # База общая: обслуживает ее один воркер
+    maintainer = None
+    if MAINTENANCE_INTERVAL and index == 0:
+        maintainer = asyncio.create_task(maintenance.run_periodically())
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics.install(dp, bot)
+        if METRICS_PORT:
+            metrics_server = await metrics.start_server(METRICS_PORT + 1 + index)
+
+    async def lane(lane_queue):
+        while True:
+            update = await lane_queue.get()
+            try:
+                result = await dp.feed_raw_update(bot, update, dispatcher=dp)
+                if isinstance(result, TelegramMethod):
+                    await dp.silent_call_request(bot, result)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта %s", update.get("update_id"))
+            finally:
+                lane_queue.task_done()
+                with processed.get_lock():
+                    processed.value += 1
+
+    # Ограниченные очереди: пока занята очередь пользователя, воркер не забирает
+    # новые апдейты, и родитель упирается в переполненную очередь процесса
+    lane_queues = [asyncio.Queue(maxsize=16) for _ in range(lanes)]
+    lane_tasks = [asyncio.create_task(lane(lane_queue)) for lane_queue in lane_queues]
+    ready.set()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            # Пользователи воркера - это telegram_id с одним остатком от деления на workers
+            await lane_queues[(user_key(update) // workers) % lanes].put(update)
+        for lane_queue in lane_queues:
+            await lane_queue.join()
+    finally:
+        for task in lane_tasks:
+            task.cancel()
+        likes_flusher.cancel()
+        if maintainer:
+            maintainer.cancel()
+        if metrics_server:
+            await metrics_server.cleanup()
+        await async_database.flush_likes()
+        await bot.session.close()
+        await geocoding.close()
+        deck.close()
+        await storage.close()
+        async_database.shutdown()
+        logging_setup.shutdown()
+
+
+# ========== Запуск из bot.py ==========
+async def run(allowed_updates=None):
+    """Принимает апдейты в режиме RUN_MODE и раздает их BOT_WORKERS воркерам до SIGINT/SIGTERM"""
+    sup = await Supervisor().start()
+    stopped = stop_event()
+
+    runner = receiver = None
+    try:
+        if RUN_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL не задан: нужен публичный https-адрес для RUN_MODE=webhook")
+            app = web.Application()
+            app.router.add_post(WEBHOOK_PATH, sup.handle_webhook)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            await _call_api(sup, "setWebhook", {
+                "url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                "secret_token": WEBHOOK_SECRET or None,
+                "max_connections": WEBHOOK_MAX_CONNECTIONS,
+                "allowed_updates": allowed_updates,
+            })
+        else:
+            await _call_api(sup, "deleteWebhook", {})
+            receiver = asyncio.create_task(sup.poll(allowed_updates))
+        await stopped.wait()
+    finally:
+        if receiver:
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+        if runner:
+            await runner.cleanup()
+        await sup.stop()
+        logger.info("Супервизор остановлен: разослано %s, обработано %s", sup.routed, sup.processed())
+
+
+async def _call_api(sup, method, params):
+    params = {key: value for key, value in params.items() if value is not None}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{sup.api_base}/bot{sup.token}/{method}", json=params) as response:
+            payload = await response.json()
+    if not payload.get("ok"):
+        raise RuntimeError(f"{method}: {payload.get('description')}")
@@ -0,0 +1,78 @@
+"""
+Хранилище "какую анкету пользователь смотрит сейчас" для кнопок Лайк/Дизлайк.
+
+Хранится только telegram_id показанной анкеты, а не вся строка users.
+Записи живут VIEWING_TTL секунд, их число ограничено VIEWING_MAX_USERS.
+
+    store = viewing_store.create_store()
+    await store.set(user_id, profile['telegram_id'])
+    target_id = await store.pop(user_id)
+"""
+import time
+
+import async_database as db
+from cache import TTLCache
+from config import VIEWING_STORE, VIEWING_TTL, VIEWING_MAX_USERS
+
+
+class MemoryViewingStore:
+    """В памяти процесса; теряется при перезапуске"""
+
+    def __init__(self, max_users=VIEWING_MAX_USERS, ttl=VIEWING_TTL):
+        self._cache = TTLCache(maxsize=max_users, ttl=ttl)
+
+    async def get(self, user_id):
+        return self._cache.get(user_id)
+
+    async def set(self, user_id, target_id):
+        self._cache.set(user_id, target_id)
+
+    async def pop(self, user_id):
+        return self._cache.pop(user_id)
+
+    async def stats(self):
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class SQLiteViewingStore:
+    """В таблице viewing_state основной базы; переживает перезапуск бота"""
+
+    # Чистка просроченных и лишних записей раз в столько вызовов set()
+    TRIM_EVERY = 256
+
+    def __init__(self, max_users=VIEWING_MAX_USERS, ttl=VIEWING_TTL, timer=time.time):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._timer = timer
+        self._writes = 0
+        self.trimmed = 0
+
+    async def get(self, user_id):
+        return await db.get_viewing(user_id, self._timer() - self.ttl)
+
+    async def set(self, user_id, target_id):
+        now = self._timer()
+        await db.set_viewing(user_id, target_id, now)
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self.trimmed += await db.trim_viewing(now - self.ttl, self.max_users)
+
+    async def pop(self, user_id):
+        return await db.pop_viewing(user_id, self._timer() - self.ttl)
+
+    async def stats(self):
+        return {
+            "backend": "sqlite",
+            "size": await db.count_viewing(),
+            "maxsize": self.max_users,
+            "trimmed": self.trimmed,
+        }
+
+
+def create_store(backend=VIEWING_STORE):
+    """Хранилище по настройке VIEWING_STORE: memory или sqlite"""
+    if backend == "sqlite":
+        return SQLiteViewingStore()
+    if backend == "memory":
+        return MemoryViewingStore()
+    raise ValueError(f"Неизвестное хранилище просмотра: {backend}")
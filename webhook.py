@@ -0,0 +1,170 @@
+"""
+Прием апдейтов через webhook вместо long polling (RUN_MODE=webhook).
+
+aiohttp-сервер принимает POST от Telegram и кладет апдейт в очередь на
+WEBHOOK_QUEUE_SIZE мест; WEBHOOK_WORKERS задач разбирают ее через
+dp.feed_raw_update. Если очередь полна, ответ 429: Telegram повторит доставку
+позже, а память бота не растет. Тело, которое не разбирается как JSON-объект,
+получает 400 и в очередь не попадает. При остановке новые апдейты получают 503,
+а уже принятые дообрабатываются не дольше WEBHOOK_DRAIN_TIMEOUT секунд.
+
+    server = await WebhookServer(dp, bot).start(host, port)
+    ...
+    await server.stop()
+"""
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.methods import TelegramMethod
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_MAX_CONNECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+RETRY_AFTER = "1"
+
+
+async def read_update(request, secret=WEBHOOK_SECRET, draining=False):
+    """
+    Проверки запроса webhook, общие для WebhookServer и supervisor.Supervisor.
+    Возвращает (update, None) или (None, ответ): 401 без секрета, 503 при
+    остановке, 400 на тело, которое не разбирается как JSON-объект.
+    """
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+        return None, web.Response(status=401)
+    if draining:
+        return None, web.Response(status=503, headers={"Retry-After": RETRY_AFTER})
+    try:
+        update = await request.json()
+    except ValueError as e:  # json.JSONDecodeError и UnicodeDecodeError
+        error = e
+    else:
+        if isinstance(update, dict):
+            return update, None
+        error = f"ожидался JSON-объект, пришел {type(update).__name__}"
+    # Повтор доставки не поможет, поэтому 400, а не 5xx
+    logger.warning("Некорректное тело webhook от %s: %s", request.remote, error)
+    return None, web.Response(status=400)
+
+
+def stop_event():
+    """Event, который выставят SIGINT/SIGTERM"""
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopped.set)
+        except NotImplementedError:  # Windows: Ctrl+C отменяет задачу, finally у вызывающего все равно выполнится
+            pass
+    return stopped
+
+
+class WebhookServer:
+    def __init__(self, dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, **data):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.data = data  # дополнительные данные для обработчиков, как kwargs в start_polling
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._runner = None
+        self._draining = False
+        self.port = None
+        self.accepted = 0
+        self.rejected = 0
+        self.malformed = 0
+        self.failed = 0
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info("Webhook слушает %s:%s%s, обработчиков %s", host, self.port, self.path, self.workers)
+        return self
+
+    async def handle(self, request):
+        update, response = await read_update(request, self.secret, self._draining)
+        if response is not None:
+            if response.status == 400:
+                self.malformed += 1
+            return response
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Обратное давление: Telegram доставит апдейт повторно
+            self.rejected += 1
+            return web.Response(status=429, headers={"Retry-After": RETRY_AFTER})
+        self.accepted += 1
+        return web.Response()
+
+    async def _work(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                result = await self.dp.feed_raw_update(self.bot, update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dp.silent_call_request(self.bot, result)
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка обработки апдейта %s", update.get("update_id"))
+            finally:
+                self._queue.task_done()
+
+    async def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Перестает принимать апдейты и дожидается обработки принятых"""
+        self._draining = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов за %s с", self._queue.qsize(), timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "malformed": self.malformed,
+            "failed": self.failed,
+        }
+
+
+async def run_webhook(dp, bot, url=WEBHOOK_URL, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """Регистрирует webhook в Telegram и обслуживает его до SIGINT/SIGTERM"""
+    if not url:
+        raise RuntimeError("WEBHOOK_URL не задан: нужен публичный https-адрес для RUN_MODE=webhook")
+    server = await WebhookServer(dp, bot, dispatcher=dp).start(host, port)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await bot.set_webhook(
+        url.rstrip("/") + server.path,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+    stopped = stop_event()
+    try:
+        await stopped.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        logger.info("Webhook остановлен: %s", server.stats())